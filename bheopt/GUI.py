@@ -4,16 +4,28 @@ Created on Wed Feb 11 10:21:54 2026
 @author: qliu
 """
 
+import json
 import streamlit as st
 from PIL import Image
 import numpy as np
 import pandas as pd
 import folium
 from streamlit_folium import st_folium
-from main_refactor import plot_initial_heatmap, run_optimization, plot_optimized_heatmap
+from main_refactor import plot_initial_heatmap, run_optimization, plot_optimized_heatmap, plot_change_heatmap, plot_volume_slice, memoize_full_fields
+from api import get_influence_operator, grid_spacing
+from cache import clear_results
+from volume import volume_depths, cached_temperature_volume
+import profiling
+from jobs import start_job, job_running, cancel_job, drain_messages, wait_job
 from pyproj import Transformer
 import plotly.express as px
 
+# One in-memory operator per geometry and ground, shared by reruns and jobs (the optimizer never writes to it);
+# after a restart it is read back from the on-disk result cache
+cached_influence_operator = st.cache_resource(max_entries=4, show_spinner="Building influence operator ...")(get_influence_operator)
+# Full ΔT fields likewise, in front of the on-disk cache; incremental updates after a load change bypass it
+cached_full_temperature_grid = memoize_full_fields(st.cache_data(max_entries=16, show_spinner="Computing ΔT field ..."))
+
 st.markdown("""
     <style>
     .block-container {
@@ -40,6 +52,8 @@ if "show_opt_plot" not in st.session_state:
     st.session_state["show_opt_plot"] = False
 if "optimized_q" not in st.session_state:
     st.session_state["optimized_q"] = None
+if "opt_job" not in st.session_state:
+    st.session_state["opt_job"] = None
 
 logo = Image.open("logo.png")
 st.sidebar.image(logo, width=250)
@@ -187,18 +201,28 @@ with st.sidebar.expander("🌡️ Hydro-thermal Parameters"):
 st.sidebar.markdown("<h3 style='font-size:18px;'>Optimization</h3>", unsafe_allow_html=True)
 with st.sidebar.expander("🎯 Goals and Constraints"):
     goal = st.checkbox("Max Net Seasonal Heat Extraction", value=True)
+    solver = st.selectbox("Solver", ["SLSQP", "LP (HiGHS)"]) # variable for the following code
+    constraint_form = st.selectbox("Constraint Form (SLSQP)", ["Global max", "Per-BHE vector", "Smooth max (KS)"]) # variable for the following code
+    ks_rho = st.number_input("KS Aggregation Parameter ρ (1/°C)", min_value=1.0, value=50.0, step=10.0) # variable for the following code
+    operator_format = st.selectbox("Influence Operator", ["Dense", "Sparse (large fields)"]) # variable for the following code
+    depth_search = st.selectbox("Depth of Max ΔT", ["Sampled (10 m steps)", "Continuous (golden section)"]) # variable for the following code
     bhe_temp_min = st.number_input("Lower Bound", value=5) # variable for the following code
     bhe_temp_max = st.number_input("Upper Bound", value=50) # variable for the following code
     max_env_impact = st.number_input("Max Impact to Environment (°C)", value=6.0, step=0.1) # variable for the following code
     max_neighbor_impact = st.number_input("Max Impact from Neighbors (°C)", value=1.5, step=0.1) # variable for the following code
     max_iterations = st.slider("Max Iterations", 10, 200, 50, step=10) # variable for the following code
     ftol = st.number_input("Function Tolerance (ftol)", value=0.1, format="%.0001e") # variable for the following code
-    eps = st.number_input("Step Size Tolerance (eps)", value=0.1, format="%.0001e") # variable for the following code
 
 st.sidebar.markdown("<h3 style='font-size:18px;'>Visualization</h3>", unsafe_allow_html=True)
 with st.sidebar.expander("🖼️ Plot Options"):
     mesh_density = st.number_input("Grid Density (points)", min_value=1, value=2, step=1) # variable for the following code
     section_depth = st.number_input("Section Depth (m)", min_value=10, value=30, step=10) # variable for the following code
+    quadrature = st.selectbox("z₀ Quadrature", ["Trapezoid (1 m)", "Gauss–Legendre", "Adaptive Gauss–Legendre", "Tabulated kernel (cached)", "Exact (no GW flow)"]) # variable for the following code
+    quad_order = st.number_input("Gauss–Legendre Order", min_value=2, value=8, step=2) # variable for the following code
+    use_cutoff = st.checkbox("Limit Influence Radius", value=False) # variable for the following code
+    r_virtual = st.number_input("Influence Radius r_virtual (m)", min_value=10.0, value=500.0, step=50.0, disabled=not use_cutoff) # variable for the following code
+    grid_engine = st.selectbox("Grid Engine", ["Vectorized", "Sparse matrix", "Adaptive quadtree (far field interpolated)", "Barnes–Hut tree (far clusters aggregated)", "FFT (grid convolution, within ~1e-3 K)", "Direct (per node)"]) # variable for the following code
+    record_performance = st.checkbox("⏱️ Record Performance", value=False) # variable for the following code
 
 def get_user_params():
     V_T = u_gw * 4.2 / rho_c
@@ -213,15 +237,28 @@ def get_user_params():
         "R_w": 0.1,
         "maxiter": max_iterations,
         "ftol": ftol,
-        "eps": eps,
+        "method": "lp" if solver == "LP (HiGHS)" else "SLSQP",
+        "constraint_mode": {"Global max": "max", "Per-BHE vector": "vector", "Smooth max (KS)": "ks"}[constraint_form],
+        "ks_rho": ks_rho,
+        "operator_format": "sparse" if operator_format == "Sparse (large fields)" else "dense",
+        "depth_search": "continuous" if depth_search == "Continuous (golden section)" else "grid",
         "lim_env": max_env_impact,
         "lim_neigh": max_neighbor_impact,
         "low_lim": bhe_temp_min,
         "up_lim": bhe_temp_max,
         "point_density": mesh_density,
-        "obs_z": section_depth
+        "obs_z": section_depth,
+        "quadrature": {"Trapezoid (1 m)": "trapz", "Gauss–Legendre": "gauss", "Adaptive Gauss–Legendre": "adaptive", "Tabulated kernel (cached)": "table", "Exact (no GW flow)": "exact"}[quadrature],
+        "quad_order": int(quad_order),
+        "influence_radius": r_virtual if use_cutoff else None,
+        "engine": {"Vectorized": "vectorized", "Sparse matrix": "sparse", "Adaptive quadtree (far field interpolated)": "adaptive", "Barnes–Hut tree (far clusters aggregated)": "tree", "FFT (grid convolution, within ~1e-3 K)": "fft", "Direct (per node)": "direct"}[grid_engine]
     }
 
+# Stage timers and counters of everything computed in this script run, shown in the Performance panel
+# (the optimization job records its own, see optimization_progress)
+if record_performance:
+    profiling.enable()
+
 st.sidebar.markdown("<h3 style='font-size:18px;'>Action</h3>", unsafe_allow_html=True)
 col_a1, col_a2, col_a3 = st.sidebar.columns(3)
 with col_a1:
@@ -229,27 +266,46 @@ with col_a1:
         st.session_state.show_initial_plot = True
 
 with col_a2:
-    if st.button("🚀 Run Opt"):
+    # The optimization runs in a background job (repeated runs are served by the on-disk result cache);
+    # its progress and the cancel button are in the Optimization Progress section
+    opt_running = st.session_state.opt_job is not None and job_running(st.session_state.opt_job)
+    if st.button("🚀 Run Opt", disabled=opt_running):
         params = get_user_params()
-        result, logs = run_optimization(
+        st.session_state.optimization_logs = []
+        st.session_state.optimization_status = None
+        operator = cached_influence_operator(np.asarray(bhe_coord, dtype=float), np.asarray(bhe_length, dtype=float),
+                                             grid_spacing(bhe_coord, params["point_density"]), params["V_T"], params["ANGLE"], params["A"], params["LAMDA"],
+                                             quadrature=params["quadrature"], quad_order=params["quad_order"],
+                                             influence_radius=params["influence_radius"], operator_format=params["operator_format"])
+        st.session_state.opt_job = start_job(
+            run_optimization,
             bhe_coord, bhe_length,
             V_T=params["V_T"], ANGLE=params["ANGLE"],
             A=params["A"], LAMDA=params["LAMDA"],
             point_density=params["point_density"],
             maxiter=params["maxiter"],
             ftol=params["ftol"],
-            eps=params["eps"],
             lim_env=params["lim_env"],
             lim_neigh=params["lim_neigh"],
             low_lim=params["low_lim"],
-            up_lim=params["up_lim"]
+            up_lim=params["up_lim"],
+            method=params["method"],
+            constraint_mode=params["constraint_mode"],
+            ks_rho=params["ks_rho"],
+            quadrature=params["quadrature"],
+            quad_order=params["quad_order"],
+            influence_radius=params["influence_radius"],
+            operator_format=params["operator_format"],
+            depth_search=params["depth_search"],
+            operator=operator,
+            profile=record_performance
         )
-        if result.success:
-            st.session_state.optimized_q = result.x
-            st.session_state.optimization_logs = logs
-            st.success("✅ Optimization completed!")
-        else:
-            st.error("❌ Optimization failed. Please adjust your parameters.")
+        st.rerun()
+    status = st.session_state.get("optimization_status")
+    if opt_running:
+        st.info("⏳ Optimizing ...")
+    elif status:
+        getattr(st, status[0])(status[1])
 
 with col_a3:
     if st.button("📈 Opt ∆T") and st.session_state.optimized_q is not None:
@@ -260,6 +316,12 @@ if st.sidebar.button("❌ Clear Plots"):
     st.session_state["show_opt_plot"] = False
     st.session_state.optimized_q = None
 
+if st.sidebar.button("🗑️ Clear Result Cache"):
+    clear_results()
+    cached_influence_operator.clear()
+    cached_full_temperature_grid.clear()
+    st.sidebar.success("Cached results removed.")
+
 # # --------------------- Main: Visualization ---------------------
 st.markdown("<h3 style='font-size:24px; margin-top: 10px; font-weight:600;'>Temperature Change Map under Initial Load</h3>", unsafe_allow_html=True)
 with st.expander("🌡️ Ground Temperature Distribution (Click to expand)", expanded=False):
@@ -271,7 +333,10 @@ with st.expander("🌡️ Ground Temperature Distribution (Click to expand)", ex
             V_T=params["V_T"], ANGLE=params["ANGLE"],
             A=params["A"], LAMDA=params["LAMDA"],
             R_w=params["R_w"], point_density=params["point_density"],
-            lim_env=params["lim_env"],lim_neigh=params["lim_neigh"]
+            lim_env=params["lim_env"],lim_neigh=params["lim_neigh"],
+            engine=params["engine"],
+            quadrature=params["quadrature"], quad_order=params["quad_order"],
+            influence_radius=params["influence_radius"]
         )
 
         st.markdown(f"""
@@ -284,7 +349,49 @@ with st.expander("🌡️ Ground Temperature Distribution (Click to expand)", ex
 
 # --- Section: Optimization Logs ---
 st.markdown("<h3 style='font-size:24px; margin-top: 10px; font-weight:600;'>Optimization Iteration Log</h3>", unsafe_allow_html=True)
-with st.expander("📋 Optimization Progress (Click to expand)", expanded=False):
+
+# Polls the running job every second: new log lines, the current and best feasible iterate, cancel
+@st.fragment(run_every=1.0 if opt_running else None)
+def optimization_progress():
+    job = st.session_state.opt_job
+    if job is not None:
+        st.session_state.optimization_logs = st.session_state.get("optimization_logs", []) + drain_messages(job)
+        if job_running(job):
+            state = job["progress"]
+            if state:
+                best = state["best_total_q"]
+                st.markdown(f"""
+                - **Iteration {state['iteration']}**: total load {state['total_q']:.1f} W/m, max ΔT<sub>g</sub> {state['max_env']:.2f} °C, max ΔT<sub>n</sub> {state['max_neigh']:.2f} °C  
+                - **Best feasible total load**: {f"{best:.1f} W/m" if best is not None else "none yet"}  
+                """, unsafe_allow_html=True)
+                if state["best_q"] is not None:
+                    st.bar_chart(pd.DataFrame({"Best feasible q (W/m)": state["best_q"]}, index=np.arange(1, len(state["best_q"]) + 1)))
+            if st.button("⏹️ Cancel Optimization", disabled=job["cancel"].is_set()):
+                cancel_job(job)
+        else:
+            st.session_state.opt_job = None
+            # The job recorded into its own recording, which the script run's recording does not include
+            if job["recording"] is not None and profiling.events(job["recording"]):
+                st.session_state.performance = profiling.summary(job["recording"])
+                st.session_state.performance_trace = json.dumps(profiling.chrome_trace(job["recording"]))
+            try:
+                result, logs = wait_job(job)
+            except Exception as error:
+                st.session_state.optimization_status = ("error", f"❌ Optimization failed: {error}")
+            else:
+                st.session_state.optimization_logs = logs
+                if result.success:
+                    st.session_state.optimized_q = result.x
+                    st.session_state.optimization_status = ("success", "✅ Optimization completed!")
+                elif result.get("cancelled") and np.all(np.isfinite(result.x)):
+                    st.session_state.optimized_q = result.x
+                    st.session_state.optimization_status = ("warning", "⏹️ Optimization cancelled, keeping the best feasible iterate.")
+                elif result.get("cancelled"):
+                    st.session_state.optimization_status = ("warning", "⏹️ Optimization cancelled before a feasible iterate was found.")
+                else:
+                    st.session_state.optimization_status = ("error", "❌ Optimization failed. Please adjust your parameters.")
+            st.rerun()
+
     logs = st.session_state.get("optimization_logs", [])
     if logs:
         for line in logs:
@@ -292,6 +399,9 @@ with st.expander("📋 Optimization Progress (Click to expand)", expanded=False)
     else:
         st.info("No optimization logs available yet.")
 
+with st.expander("📋 Optimization Progress (Click to expand)", expanded=opt_running):
+    optimization_progress()
+
 # --- Optimized ΔT Heatmap ---
 st.markdown("<h3 style='font-size:24px; margin-top: 10px; font-weight:600;'>Optimized Temperature Change Map</h3>", unsafe_allow_html=True)
 with st.expander("🌡️ Ground Temperature After Optimization", expanded=False):
@@ -307,15 +417,74 @@ with st.expander("🌡️ Ground Temperature After Optimization", expanded=False
             A=params["A"], LAMDA=params["LAMDA"],
             R_w=params["R_w"], point_density=params["point_density"],
             lim_env=params["lim_env"],lim_neigh=params["lim_neigh"],
+            engine=params["engine"],
+            quadrature=params["quadrature"], quad_order=params["quad_order"],
+            influence_radius=params["influence_radius"],
         )
 
         st.markdown(f"""
         - **Min Heat Load**: {summary_opt['min_q']:.1f} W/m and **Max Heat Load**: {summary_opt['max_q']:.1f} W/m  
         - **Max ΔT<sub>g</sub> (ground)**: {summary_opt['max_Tg']:.2f} °C and **Max ΔT<sub>n</sub> (from neighbors)**: {summary_opt['max_Tn']:.2f} °C  
         """, unsafe_allow_html=True)
+
+        # Difference to the initial map, from the two cached fields
+        summary_diff = plot_change_heatmap(bhe_coord, params["obs_z"])
+        if summary_diff is not None:
+            st.markdown(f"- **ΔT<sub>g</sub> change (optimized − initial)**: {summary_diff['min_dT']:.2f} to {summary_diff['max_dT']:.2f} °C", unsafe_allow_html=True)
     else:
         st.info("Click **📈 Opt ΔT** in the sidebar to generate the plot.")
 
+# --- 3D Volume ---
+st.markdown("<h3 style='font-size:24px; margin-top: 10px; font-weight:600;'>Temperature Change Volume</h3>", unsafe_allow_html=True)
+with st.expander("🧊 ΔT at All Depths (Click to expand)", expanded=False):
+    col_v1, col_v2, col_v3, col_v4 = st.columns(4)
+    with col_v1:
+        volume_load = st.selectbox("Loads", ["Initial", "Optimized"]) # variable for the following code
+    with col_v2:
+        volume_z_min = st.number_input("Top (m)", min_value=1.0, value=10.0, step=5.0) # variable for the following code
+    with col_v3:
+        volume_z_max = st.number_input("Bottom (m)", min_value=1.0, value=70.0, step=5.0) # variable for the following code
+    with col_v4:
+        volume_z_step = st.number_input("Step (m)", min_value=0.5, value=5.0, step=0.5) # variable for the following code
+
+    if st.button("🧊 Compute Volume"):
+        if volume_load == "Optimized" and st.session_state.get("optimized_q") is None:
+            st.warning("Run the optimization first.")
+        elif volume_z_min > volume_z_max:
+            st.warning("The top depth must not be below the bottom depth.")
+        else:
+            params = get_user_params()
+            volume_q = bhe_load if volume_load == "Initial" else st.session_state.optimized_q
+            with st.spinner("Computing ΔT volume ..."):
+                # Stored as a memory-mapped file: moving the depth slider only reads one slice
+                st.session_state.volume = cached_temperature_volume(
+                    bhe_coord, bhe_length, volume_q, volume_depths(volume_z_min, volume_z_max, volume_z_step),
+                    V_T=params["V_T"], ANGLE=params["ANGLE"], A=params["A"], LAMDA=params["LAMDA"],
+                    point_density=params["point_density"], quadrature=params["quadrature"], quad_order=params["quad_order"],
+                    influence_radius=params["influence_radius"]
+                )
+            st.session_state.volume_q = np.asarray(volume_q, dtype=float)
+            st.session_state.volume_label = volume_load
+
+    volume = st.session_state.get("volume")
+    if volume is not None:
+        params = get_user_params()
+        z_slice = st.select_slider("Depth (m)", options=[float(z) for z in volume["z"]]) # variable for the following code
+        summary_vol = plot_volume_slice(
+            volume, bhe_coord, bhe_length, st.session_state.volume_q, z_slice,
+            V_T=params["V_T"], ANGLE=params["ANGLE"], A=params["A"], LAMDA=params["LAMDA"],
+            lim_env=params["lim_env"], lim_neigh=params["lim_neigh"],
+            title_suffix=f"({st.session_state.volume_label} Load)",
+            quadrature=params["quadrature"], quad_order=params["quad_order"], influence_radius=params["influence_radius"]
+        )
+        peak = np.max(volume["volume"], axis=(1, 2))
+        st.markdown(f"""
+        - **Max ΔT<sub>g</sub> at {z_slice:g} m**: {summary_vol['max_Tg']:.2f} °C and **Max ΔT<sub>n</sub>**: {summary_vol['max_Tn']:.2f} °C  
+        - **Max grid ΔT over all depths**: {peak.max():.2f} °C at z = {volume['z'][np.argmax(peak)]:g} m  
+        """, unsafe_allow_html=True)
+    else:
+        st.info("Click **🧊 Compute Volume** to compute ΔT at all depths.")
+
 # --- Final Comparison Summary ---
 st.markdown("<h3 style='font-size:24px; margin-top: 10px; font-weight:600;'>🔍 Summary: Optimization Comparison</h3>", unsafe_allow_html=True)
 
@@ -349,3 +518,27 @@ if st.session_state.get("show_initial_plot", False) and st.session_state.get("sh
     """)
 else:
     st.info("Run both ΔT plots to see comparison summary.")
+
+# --- Performance ---
+if record_performance:
+    profiling.disable()
+    # Keep the last run that computed anything (reruns served from the caches record nothing)
+    if profiling.events():
+        st.session_state.performance = profiling.summary()
+        st.session_state.performance_trace = json.dumps(profiling.chrome_trace())
+
+st.markdown("<h3 style='font-size:24px; margin-top: 10px; font-weight:600;'>Performance</h3>", unsafe_allow_html=True)
+with st.expander("⏱️ Performance of the Last Run (Click to expand)", expanded=False):
+    performance = st.session_state.get("performance")
+    if performance:
+        counts = performance["counters"]
+        hit_rate = performance["constraint_cache_hit_rate"]
+        st.markdown(f"""
+        - **Wall time**: {performance['wall_time_s']:.2f} s  
+        - **Kernel line integrals**: {counts.get('line_integrals', 0):,} ({counts.get('kernel_evaluations', 0):,} kernel evaluations)  
+        - **Constraint calls**: {counts.get('constraint_calls', 0):,}{f" (cache hit rate {hit_rate:.0%})" if hit_rate is not None else ""}, **solver iterations**: {counts.get('solver_iterations', 0):,}  
+        """)
+        st.dataframe(pd.DataFrame(performance["stages"])[["stage", "calls", "total_s", "mean_s", "max_s"]], hide_index=True)
+        st.download_button("💾 Download Trace (Chrome format)", st.session_state.performance_trace, file_name="bheopt_trace.json", mime="application/json")
+    else:
+        st.info("Tick **⏱️ Record Performance** in the plot options and run a computation.")
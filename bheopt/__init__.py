@@ -0,0 +1,15 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# __init__.py
+# The modules import each other by module name, as when run from bheopt/ (python bheopt/cli.py,
+# streamlit run bheopt/GUI.py); the installed bheopt command reaches them through this package
+import os
+import sys
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+if _PACKAGE_DIR not in sys.path:
+    sys.path.insert(0, _PACKAGE_DIR)
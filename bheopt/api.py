@@ -0,0 +1,234 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# api.py
+# Headless entry points: arrays and summaries in, arrays and summaries out, no UI imports
+import numpy as np
+from scipy.optimize import OptimizeResult
+from utils import find_closest_pair, create_extended_grid, assign_sources_to_nearest_nodes
+from borehole_model import precompute_integrals, compute_temperature_grid, compute_temperature_points, compute_self_Tchange
+from optimization import optimize_heat_load, observation_depths, build_influence_operator, build_sparse_influence_operator, scaled_start, trace_capacity_curve
+from cache import RESULT_CACHE_DIR, cached_call, find_results
+
+DEFAULT_LENGTH = 80
+DEFAULT_LOAD = 50
+
+# Fields of an optimization result kept in the on-disk cache (the operator is cached on its own)
+RESULT_FIELDS = ("x", "fun", "success", "status", "message", "nit", "nfev", "njev", "max_env", "max_neigh", "res_env", "res_neigh", "binding_env", "binding_neigh",
+                 "depth_env", "depth_neigh", "cancelled")
+# Inputs stored with an optimization result to find it again as a warm start
+WARM_START_FIELDS = ("x", "success", "sources", "H_array", "ground", "limits")
+# Cached solutions farther than this (see solution_distance) are not used as warm starts
+WARM_START_MAX_DISTANCE = 1.0
+
+def read_layout(path, default_length=DEFAULT_LENGTH, default_load=DEFAULT_LOAD):
+    # Same CSV formats as the GUI: local x/y in meters or latitude/longitude (EPSG:4326, projected
+    # to EPSG:3857), optional BHE length and initial load columns. Returns a DataFrame (x, y, H, q_l).
+    import pandas as pd
+    df_raw = pd.read_csv(path, encoding="utf-8-sig")
+    df_raw.columns = [col.strip().lower() for col in df_raw.columns]
+
+    def detect_column(name_keywords):
+        for col in df_raw.columns:
+            if any(keyword.lower() in col for keyword in name_keywords):
+                return col
+        return None
+
+    lat_col = detect_column(["lat"])
+    lon_col = detect_column(["long"])
+    len_col = "h" if "h" in df_raw.columns else detect_column(["length"])
+    load_col = detect_column(["q0"])
+    x_col = detect_column(["x"]) if not lon_col else None
+    y_col = detect_column(["y"]) if not lat_col else None
+
+    if lat_col and lon_col:
+        from pyproj import Transformer
+        transformer = Transformer.from_crs("epsg:4326", "epsg:3857", always_xy=True)  # WGS84 → meters
+        x_data, y_data = transformer.transform(df_raw[lon_col].values, df_raw[lat_col].values)
+    elif x_col and y_col:
+        x_data, y_data = df_raw[x_col].values, df_raw[y_col].values
+    else:
+        raise ValueError(f"Could not detect coordinate columns (latitude/longitude or x/y) in {path}")
+
+    n_rows = len(x_data)
+    return pd.DataFrame({
+        'x': np.asarray(x_data, dtype=float),
+        'y': np.asarray(y_data, dtype=float),
+        'H': df_raw[len_col].values.astype(float) if len_col else np.full(n_rows, float(default_length)),
+        'q_l': df_raw[load_col].values.astype(float) if load_col else np.full(n_rows, float(default_load))
+    })
+
+def hydro_parameters(lamda=2.5, rho_c=2.5, u_gw=1e-7, theta_gw=30):
+    # Model parameters from the GUI's ground inputs: λ (W/m·K), ρc (MJ/m^3/K), GW velocity (m/s) and direction (°)
+    return {
+        "V_T": u_gw * 4.2 / rho_c,
+        "ANGLE": (theta_gw / 180 + 1) * np.pi,
+        "A": lamda / rho_c / 1e6,
+        "LAMDA": lamda
+    }
+
+def grid_spacing(sources, point_density):
+    (_, _), min_dist = find_closest_pair(sources)
+    return min_dist / point_density
+
+def simulate(sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA, obs_z=30, point_density=2, engine="vectorized", quadrature="trapz", quad_order=8, influence_radius=None, tree_tol=0.01, cache_dir=None):
+    # ΔT map at depth obs_z and ΔT at every BHE (total and from neighbors), as in the GUI heat maps
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    spacing = grid_spacing(sources, point_density)
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals([obs_z], H_array, R_w=spacing)
+
+    def compute():
+        temp_map = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map,
+                                            engine=engine, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, tree_tol=tree_tol)
+        t_total = compute_temperature_points(sources[:, 0], sources[:, 1], [obs_z], sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA,
+                                             integrals=integrals, self_map={i: [i] for i in range(len(sources))}, quadrature=quadrature, quad_order=quad_order,
+                                             influence_radius=influence_radius)[:, 0]
+        t_self = np.array([compute_self_Tchange([obs_z], heat_rates[i], integrals[i], LAMDA)[0] for i in range(len(sources))])
+        return {"grid_x": grid_x, "grid_y": grid_y, "temp_map": temp_map, "t_total": t_total, "t_neigh": t_total - t_self}
+
+    fields = cached_call("simulation", compute, cache_dir=cache_dir, sources=sources, H_array=H_array, heat_rates=heat_rates, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,
+                         obs_z=obs_z, spacing=spacing, engine=engine, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius,
+                         tree_tol=tree_tol if engine == "tree" else None)
+    fields["summary"] = {
+        "obs_z": float(obs_z),
+        "max_Tg": float(np.max(fields["t_total"])),
+        "max_Tn": float(np.max(fields["t_neigh"])),
+        "max_grid_T": float(np.max(fields["temp_map"])),
+        "min_q": float(np.min(heat_rates)),
+        "max_q": float(np.max(heat_rates)),
+        "total_q": float(np.sum(heat_rates))
+    }
+    return fields
+
+def get_influence_operator(sources, H_array, spacing, V_T, ANGLE, A, LAMDA, quadrature='trapz', quad_order=8, influence_radius=None, operator_format='dense', cache_dir=RESULT_CACHE_DIR):
+    # The operator depends on geometry and ground only, so changing limits or bounds reuses it
+    z_values = observation_depths()
+    integrals = precompute_integrals(z_values, H_array, R_w=spacing)
+    build = build_sparse_influence_operator if operator_format == 'sparse' else build_influence_operator
+    return cached_call("operator", lambda: build(sources, H_array, z_values, integrals, V_T, ANGLE, A, LAMDA, quadrature=quadrature, quad_order=quad_order,
+                                                 influence_radius=influence_radius),
+                       cache_dir=cache_dir, sources=sources, H_array=H_array, z_values=z_values, spacing=spacing, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,
+                       quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, operator_format=operator_format)
+
+def optimization_kind(n_bhe):
+    # Cache kind of optimization results; the number of BHEs in the file name lets nearest_solution skip
+    # the other layouts without opening them
+    return f"optimization_n{n_bhe}"
+
+def ground_distance(stored_ground, ground):
+    # The ground part of solution_distance: turning the flow by 180° or changing V_T, A or λ by 100 % adds about 1
+    turn = np.abs((stored_ground[1] - ground[1] + np.pi) % (2 * np.pi) - np.pi) / np.pi
+    ground_change = np.abs(stored_ground - ground)[[0, 2, 3]] / np.maximum(np.abs(ground[[0, 2, 3]]), 1e-30)
+    return float(turn + np.max(ground_change))
+
+def solution_distance(stored, sources, H_array, ground, limits, spacing=None):
+    # How far a cached optimization is from a new problem: 0 for the same one; moving a BHE by the closest
+    # BHE spacing (pass it as spacing when comparing many entries), changing a length, limit or ground parameter
+    # by 100 % or turning the flow by 180° adds about 1 each. None if the layouts have different numbers of BHEs.
+    if len(stored["sources"]) != len(sources):
+        return None
+    spacing = grid_spacing(sources, 1) if spacing is None else spacing
+    limit_change = np.abs(stored["limits"] - limits) / np.maximum(np.abs(limits), 1e-12)
+    return float(np.max(np.hypot(*(stored["sources"] - sources).T)) / spacing + np.max(np.abs(stored["H_array"] - H_array) / H_array)
+                 + ground_distance(stored["ground"], ground) + np.max(limit_change))
+
+def nearest_solution(sources, H_array, V_T, ANGLE, A, LAMDA, lim_env, lim_neigh, low_lim, up_lim, cache_dir=RESULT_CACHE_DIR, max_distance=WARM_START_MAX_DISTANCE):
+    # Closest successful cached optimization of a layout with as many BHEs: {"key", "x", "distance"}, or None
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    ground, limits = np.array([V_T, ANGLE, A, LAMDA], dtype=float), np.array([lim_env, lim_neigh, low_lim, up_lim], dtype=float)
+    spacing = grid_spacing(sources, 1)
+
+    def promising(stored):
+        # the ground alone is a lower bound of the distance; read before the layout arrays
+        return "ground" in stored and bool(stored.get("success")) and ground_distance(stored["ground"], ground) <= max_distance
+    nearest = None
+    for key, stored in find_results(optimization_kind(len(sources)), cache_dir, fields=WARM_START_FIELDS, accept=promising, accept_fields=("ground", "success")):
+        if not all(name in stored for name in WARM_START_FIELDS):
+            continue
+        distance = solution_distance(stored, sources, H_array, ground, limits, spacing)
+        if distance is not None and distance <= max_distance and (nearest is None or distance < nearest["distance"]):
+            nearest = {"key": key, "x": stored["x"], "distance": distance}
+    return nearest
+
+def optimize_layout(sources, H_array, V_T, ANGLE, A, LAMDA, lim_env, lim_neigh, low_lim, up_lim, point_density=2, maxiter=50, ftol=0.1, method='SLSQP', constraint_mode='max', ks_rho=50.0, quadrature='trapz', quad_order=8, influence_radius=None, operator_format='dense', depth_search='grid', cache_dir=RESULT_CACHE_DIR, callback_logger=None, progress=None, cancel_event=None, initial_q=None, warm_start=True, operator=None, verbose=False):
+    # Returns (result, logs); result is an OptimizeResult with the fields in RESULT_FIELDS and the operator.
+    # operator, if given, must be get_influence_operator's for the same inputs (the GUI keeps it in memory).
+    # progress and cancel_event go to optimize_heat_load; a cancelled run is not cached.
+    # Without initial_q, SLSQP starts from the nearest cached solution (warm_start=True) scaled to the
+    # limits, else from 10 W/m everywhere; the LP solver takes no start point. Messages go to callback_logger
+    # only, unless verbose=True also prints them and the SLSQP report to stdout.
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    spacing = grid_spacing(sources, point_density)
+    if operator is None:
+        operator = get_influence_operator(sources, H_array, spacing, V_T, ANGLE, A, LAMDA, quadrature=quadrature, quad_order=quad_order,
+                                          influence_radius=influence_radius, operator_format=operator_format, cache_dir=cache_dir)
+
+    def optimize():
+        logs = []
+
+        def logger(msg):
+            logs.append(msg)
+            if callback_logger:
+                callback_logger(msg)
+        start = initial_q
+        if start is None and warm_start and method != 'lp':
+            nearest = nearest_solution(sources, H_array, V_T, ANGLE, A, LAMDA, lim_env, lim_neigh, low_lim, up_lim, cache_dir=cache_dir)
+            if nearest is not None:
+                start = scaled_start(operator, nearest["x"], lim_env, lim_neigh, low_lim, up_lim)
+                logger(f"♻️ Warm start from cached solution {nearest['key']} (distance {nearest['distance']:.3f})")
+        result = optimize_heat_load(sources, H_array, callback_logger=logger, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, R_w=spacing, maxiter=maxiter, ftol=ftol, eps=None, lim_env=lim_env, lim_neigh=lim_neigh, low_lim=low_lim, up_lim=up_lim, operator=operator, method=method, constraint_mode=constraint_mode, ks_rho=ks_rho, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, operator_format=operator_format, depth_search=depth_search, progress=progress, cancel_event=cancel_event, initial_q=start, verbose=verbose)
+        stored = {name: result.get(name) for name in RESULT_FIELDS}
+        stored.update(sources=sources, H_array=H_array, ground=np.array([V_T, ANGLE, A, LAMDA], dtype=float),
+                      limits=np.array([lim_env, lim_neigh, low_lim, up_lim], dtype=float))
+        stored["logs"] = np.array(logs, dtype=str)
+        return stored
+
+    stored = cached_call(optimization_kind(len(sources)), optimize, cache_dir=cache_dir, sources=sources, H_array=H_array, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, spacing=spacing,
+                         maxiter=maxiter, ftol=ftol, lim_env=lim_env, lim_neigh=lim_neigh, low_lim=low_lim, up_lim=up_lim, method=method, constraint_mode=constraint_mode,
+                         ks_rho=ks_rho, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, operator_format=operator_format,
+                         depth_search=depth_search, initial_q=None if initial_q is None else np.asarray(initial_q, dtype=float), cacheable=lambda values: not values.get("cancelled"))
+    result = OptimizeResult({name: stored[name] for name in RESULT_FIELDS if name in stored})
+    result.operator = operator
+    return result, [str(line) for line in stored["logs"]]
+
+def capacity_curve(sources, H_array, V_T, ANGLE, A, LAMDA, limits, low_lim, up_lim, point_density=2, maxiter=50, ftol=0.1, method='SLSQP', constraint_mode='max', ks_rho=50.0, quadrature='trapz', quad_order=8, influence_radius=None, operator_format='dense', depth_search='grid', cache_dir=RESULT_CACHE_DIR, callback_logger=None, warm_start=True, verbose=False):
+    # One optimization result per (lim_env, lim_neigh) in limits, traced by continuation with one operator;
+    # the first point is warm-started from the cache like optimize_layout
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    limits = [(float(lim_env), float(lim_neigh)) for lim_env, lim_neigh in limits]
+    spacing = grid_spacing(sources, point_density)
+    operator = get_influence_operator(sources, H_array, spacing, V_T, ANGLE, A, LAMDA, quadrature=quadrature, quad_order=quad_order,
+                                      influence_radius=influence_radius, operator_format=operator_format, cache_dir=cache_dir)
+    initial_q = None
+    if warm_start and method != 'lp' and limits:
+        nearest = nearest_solution(sources, H_array, V_T, ANGLE, A, LAMDA, *limits[0], low_lim, up_lim, cache_dir=cache_dir)
+        if nearest is not None:
+            initial_q = scaled_start(operator, nearest["x"], *limits[0], low_lim, up_lim)
+    return trace_capacity_curve(sources, H_array, V_T, ANGLE, A, LAMDA, spacing, limits, low_lim, up_lim, maxiter=maxiter, ftol=ftol, initial_q=initial_q,
+                                operator=operator, callback_logger=callback_logger, method=method, constraint_mode=constraint_mode, ks_rho=ks_rho,
+                                quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, operator_format=operator_format,
+                                depth_search=depth_search, verbose=verbose)
+
+def optimization_summary(result, lim_env, lim_neigh):
+    return {
+        "success": bool(result.success),
+        "message": str(result.message),
+        "iterations": int(result.nit),
+        "total_q": float(np.nansum(result.x)),
+        "min_q": float(np.nanmin(result.x)),
+        "max_q": float(np.nanmax(result.x)),
+        "max_env": float(result.max_env),
+        "max_neigh": float(result.max_neigh),
+        "lim_env": float(lim_env),
+        "lim_neigh": float(lim_neigh)
+    }
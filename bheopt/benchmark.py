@@ -0,0 +1,131 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# benchmark.py
+# Runtime scaling of the forward model and the optimizer over the sensitivity-case layouts
+import glob
+import json
+import os
+import platform
+import re
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import scipy
+from borehole_model import EVALUATION_COUNTS, precompute_integrals, compute_temperature_grid
+from optimization import compute_max_BHE_Tchange, observation_depths, build_neighbor_lists, optimize_heat_load
+from utils import create_extended_grid, assign_sources_to_nearest_nodes
+from api import read_layout, hydro_parameters, grid_spacing
+
+SENSITIVITY_LAYOUTS = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case", "BHE_generated_*.csv")),
+                             key=lambda path: int(re.findall(r"\d+", os.path.basename(path))[-1]))
+# A case is flagged when its wall time exceeds the baseline by more than this factor and by more than
+# this many seconds (timer noise dominates the millisecond cases)
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_SECONDS = 0.05
+
+def _measure(run, repeat):
+    # Best wall time of repeat runs, then one more run under tracemalloc for the peak memory
+    # (numpy buffers included) and the line-integral count, which tracing would slow down
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    EVALUATION_COUNTS["line_integrals"] = 0
+    tracemalloc.start()
+    try:
+        value = run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return value, {"wall_time": min(times), "peak_memory": peak, "line_integrals": EVALUATION_COUNTS["line_integrals"]}
+
+def benchmark_layout(path, point_densities=(1, 2, 4), engines=("vectorized",), methods=("lp", "SLSQP"), obs_z=30, repeat=3, hydro=None, quadrature="trapz",
+                     quad_order=8, influence_radius=None, lim_env=6.0, lim_neigh=1.5, low_lim=5, up_lim=50, maxiter=50, ftol=0.1):
+    # Cases of one layout: the ΔT grid per density and engine, the per-BHE max ΔT loop and the
+    # optimizer per method. Evaluation counts cover this process only (the operator pool workers
+    # count on their own).
+    layout = read_layout(path)
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+    hydro = hydro or hydro_parameters()
+    name = os.path.basename(path)
+    cases = []
+
+    for density in point_densities:
+        spacing = grid_spacing(sources, density)
+        grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+        node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+        integrals = precompute_integrals([obs_z], H_array, R_w=spacing)
+        for engine in engines:
+            _, stats = _measure(lambda: compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z, **hydro, integrals=integrals, node_map=node_map,
+                                                                 engine=engine, quadrature=quadrature, quad_order=quad_order,
+                                                                 influence_radius=influence_radius), repeat)
+            cases.append({"case": "compute_temperature_grid", "layout": name, "n_bhe": len(sources), "point_density": density, "option": engine,
+                          "grid_nodes": int(grid_x.size), **stats})
+
+    z_values = observation_depths()
+    integrals = precompute_integrals(z_values, H_array, R_w=grid_spacing(sources, 2))
+    neighbors = build_neighbor_lists(sources, influence_radius)
+
+    def max_loop():
+        return [compute_max_BHE_Tchange(i, sources, heat_rates, z_values, integrals, H_array, **hydro, influence_radius=influence_radius, neighbors=neighbors[i])
+                for i in range(len(sources))]
+
+    _, stats = _measure(max_loop, repeat)
+    cases.append({"case": "compute_max_BHE_Tchange", "layout": name, "n_bhe": len(sources), "point_density": 2, "option": "all BHEs", **stats})
+
+    for method in methods:
+        result, stats = _measure(lambda: optimize_heat_load(sources, H_array, None, **hydro, R_w=grid_spacing(sources, 2), maxiter=maxiter, ftol=ftol, eps=None,
+                                                            lim_env=lim_env, lim_neigh=lim_neigh, low_lim=low_lim, up_lim=up_lim, method=method,
+                                                            quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, verbose=False), repeat)
+        cases.append({"case": "optimize_heat_load", "layout": name, "n_bhe": len(sources), "point_density": 2, "option": method,
+                      "iterations": int(getattr(result, "nit", 0)), "success": bool(result.success), "total_q": float(np.sum(result.x)), **stats})
+    return cases
+
+def run_benchmark(layouts=None, **options):
+    # Report of all cases over the layouts (default: the sensitivity-case layouts), with the
+    # versions and machine it ran on, as written by write_report
+    layouts = SENSITIVITY_LAYOUTS if layouts is None else layouts
+    return {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__, "platform": platform.platform(),
+                        "processor": platform.processor(), "cpu_count": os.cpu_count()},
+        "options": {name: list(value) if isinstance(value, tuple) else value for name, value in options.items()},
+        "cases": [case for path in layouts for case in benchmark_layout(path, **options)]
+    }
+
+def write_report(path, report):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+def read_report(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def compare_reports(report, baseline, ratio=REGRESSION_RATIO, min_seconds=REGRESSION_MIN_SECONDS):
+    # One row per case found in both reports: wall time, memory and evaluations relative to the
+    # baseline, and whether the wall time regressed by more than ratio and min_seconds
+    key = ["case", "layout", "point_density", "option"]
+    current = pd.DataFrame(report["cases"])
+    previous = pd.DataFrame(baseline["cases"])
+    merged = current.merge(previous[key + ["wall_time", "peak_memory", "line_integrals"]], on=key, suffixes=("", "_baseline"))
+    merged["time_ratio"] = merged["wall_time"] / merged["wall_time_baseline"]
+    merged["memory_ratio"] = merged["peak_memory"] / merged["peak_memory_baseline"].replace(0, np.nan)
+    merged["evaluation_ratio"] = merged["line_integrals"] / merged["line_integrals_baseline"].replace(0, np.nan)
+    merged["regression"] = (merged["time_ratio"] > ratio) & (merged["wall_time"] - merged["wall_time_baseline"] > min_seconds)
+    return merged[key + ["n_bhe", "wall_time", "wall_time_baseline", "time_ratio", "memory_ratio", "evaluation_ratio", "regression"]]
+
+def scaling_table(report):
+    # Empirical exponent b of wall_time ≈ a * n_bhe^b per case, density and option (log-log least squares)
+    cases = pd.DataFrame(report["cases"])
+    rows = []
+    for (case, density, option), group in cases.groupby(["case", "point_density", "option"]):
+        group = group[group["wall_time"] > 0]
+        exponent = np.polyfit(np.log(group["n_bhe"]), np.log(group["wall_time"]), 1)[0] if group["n_bhe"].nunique() > 1 else np.nan
+        rows.append({"case": case, "point_density": density, "option": option, "layouts": len(group), "max_n_bhe": int(group["n_bhe"].max()),
+                     "max_wall_time": float(group["wall_time"].max()), "time_exponent": float(exponent)})
+    return pd.DataFrame(rows)
@@ -5,11 +5,27 @@ Created on Wed Feb 11 10:21:54 2026
 """
 
 # # borehole_model.py
+import hashlib
+import os
 import numpy as np
 from scipy.integrate import quad
+from scipy.spatial import cKDTree
+from scipy import sparse
+from joblib import Parallel, delayed
+from profiling import timed, count, is_enabled
 
 # z_values can be a vector for computing the T change at multiple depths
 
+# Memory ceiling for the temporaries of one block of the vectorized evaluator
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+# On-disk cache of tabulated MFLS kernels, see get_kernel_table
+KERNEL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bheopt", "kernels")
+_KERNEL_TABLES = {}
+
+# Number of (pair, depth) line integrals evaluated in this process (worker processes keep their own)
+EVALUATION_COUNTS = {"line_integrals": 0}
+
 def precompute_integrals(z_values, H_array, R_w=0.1):
     z_values = np.asarray(z_values, dtype=float)
     H_array = np.asarray(H_array, dtype=float)
@@ -33,49 +49,602 @@ def compute_self_Tchange(z_values, q_l, integrals_for_source, LAMDA):
         for z in z_values
     ], dtype=float)
 
-def compute_neighbor_Tchange(x, y, z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA):
-    z_values = np.asarray(z_values, dtype=float)
-
-    # Handle empty sources
-    if sources is None or len(sources) == 0:
-        return np.zeros_like(z_values, dtype=float)
-
-    sources = np.asarray(sources, dtype=float)
-    heat_rates = np.asarray(heat_rates, dtype=float)
-    H_array = np.asarray(H_array, dtype=float)
-
-    dx = x - sources[:, 0]         # shape: (n_sources,)
-    dy = y - sources[:, 1]
-    r_sq = dx**2 + dy**2           # shape: (n_sources,)
+def advection_factor(dx, dy, V_T, ANGLE, A):
+    # Directional groundwater-flow factor of the MFLS solution
     vx, vy = V_T * np.cos(ANGLE), V_T * np.sin(ANGLE)
-    exp_fac = np.exp(np.clip(-(vx * dx + vy * dy) / (2 * A), -1000, 1000))  # shape: (n_sources,)
+    return np.exp(np.clip(-(vx * dx + vy * dy) / (2 * A), -1000, 1000))
 
-    max_h = np.max(H_array)
-    z0_grid = np.arange(0, max_h + 1)  # longest possible z0, with a interval of 1m
+# np.trapz was renamed to np.trapezoid in NumPy 2.0
+_trapz = getattr(np, "trapezoid", None) or np.trapz
+
+def _trapz_line_integrals(r_sq, z_values, H_array, V_T, A, scaled=False, z0_max=None):
+    # the z0 grid runs to the longest source, or to z0_max when a caller evaluates a subset of a layout
+    max_h = np.max(H_array) if z0_max is None else z0_max
+    z0_grid = np.arange(0, max_h + 1, dtype=r_sq.dtype)  # longest possible z0, with a interval of 1m
     z0_mask = z0_grid[None, :] <= (H_array[:, None] + 1e-12)
 
     z_diff = z_values[None, :, None] - z0_grid[None, None, :]              # (n_sources, n_z, n_z0)
     z_diff_m = z_values[None, :, None] + z0_grid[None, None, :]
 
-    # Regularize distance to prevent r=0
     r = np.sqrt(r_sq[:, None, None] + z_diff**2)
     r_mirror = np.sqrt(r_sq[:, None, None] + z_diff_m**2)
 
-    kernel = np.exp(-V_T * r / (2 * A)) / r
-    kernel_m = np.exp(-V_T * r_mirror / (2 * A)) / r_mirror
+    # scaled: times exp(c * r_h), taken into the exponent so that it cannot overflow
+    shift = np.sqrt(r_sq)[:, None, None] if scaled else 0.0
+    kernel = np.exp(-V_T * (r - shift) / (2 * A)) / r
+    kernel_m = np.exp(-V_T * (r_mirror - shift) / (2 * A)) / r_mirror
     # Zero out invalid z0 indices per source using mask
     kernel *= z0_mask[:, None, :]
     kernel_m *= z0_mask[:, None, :]
 
-    # Integrate over z0 (axis=2)
-    int_direct = np.trapz(kernel, z0_grid, axis=2)
-    int_mirror = np.trapz(kernel_m, z0_grid, axis=2)
+    # Integrate over z0 (axis=2), direct minus mirror source
+    return _trapz(kernel, z0_grid, axis=2) - _trapz(kernel_m, z0_grid, axis=2)  # (n_sources, n_z)
+
+_GAUSS_NODES = {}
+
+def _gauss_kernel_integral(r, z, H, c, order, scaled=False):
+    # With u = z0 - z = r sinh(s) the kernel exp(-c * rho) / rho becomes exp(-c * r * cosh(s)) ds,
+    # which is smooth even for r << H, so a low fixed Gauss–Legendre order is enough.
+    # r, z and H broadcast against each other. scaled=True returns the integral times exp(c * r).
+    if order not in _GAUSS_NODES:
+        _GAUSS_NODES[order] = np.polynomial.legendre.leggauss(order)
+    t, w = _GAUSS_NODES[order]
+    if np.asarray(r).dtype == np.float32:
+        t, w = t.astype(np.float32), w.astype(np.float32)
+
+    def integral(lo, hi):
+        s_lo, s_hi = np.arcsinh(lo / r), np.arcsinh(hi / r)
+        half = (s_hi - s_lo) / 2
+        s = ((s_lo + s_hi) / 2)[..., None] + half[..., None] * t
+        return half * np.sum(w * np.exp(-c * np.asarray(r)[..., None] * (np.cosh(s) - scaled)), axis=-1)
+
+    return integral(-z, H - z) - integral(z, z + H)
+
+def _gauss_line_integrals(r_sq, z_values, H_array, V_T, A, order, scaled=False):
+    return _gauss_kernel_integral(np.sqrt(r_sq)[:, None], z_values[None, :], H_array[:, None], V_T / (2 * A), order, scaled)  # (n_sources, n_z)
+
+def _trapz_line_integrals_at(r_sq, z, H_array, V_T, A, z0_max, chunk_size=4096):
+    # _trapz_line_integrals with a depth per element, in chunks of elements
+    z0_grid = np.arange(0, z0_max + 1, dtype=float)
+    ints = np.empty(r_sq.shape)
+    for start in range(0, r_sq.size, chunk_size):
+        part = slice(start, start + chunk_size)
+        r_sq_c, z_c, H_c = r_sq.ravel()[part, None], z.ravel()[part, None], H_array.ravel()[part, None]
+        r = np.sqrt(r_sq_c + (z_c - z0_grid)**2)
+        r_mirror = np.sqrt(r_sq_c + (z_c + z0_grid)**2)
+        mask = z0_grid <= H_c + 1e-12
+        kernel = np.exp(-V_T * r / (2 * A)) / r * mask
+        kernel_m = np.exp(-V_T * r_mirror / (2 * A)) / r_mirror * mask
+        ints.ravel()[part] = _trapz(kernel, z0_grid, axis=1) - _trapz(kernel_m, z0_grid, axis=1)
+    return ints
+
+def compute_line_integrals_at(r_sq, z, H_array, V_T, A, quad_order=8, quadrature="gauss", quad_tol=1e-8, z0_max=None):
+    # Line integral of each source at its own depth z (same shape as r_sq), with the rules of
+    # compute_line_integrals; "table" has no tables at arbitrary depths and uses the order-32
+    # Gauss–Legendre rule its tables are built from. z0_max as in compute_line_integrals.
+    r_sq, z, H_array = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (r_sq, z, H_array)))
+    EVALUATION_COUNTS["line_integrals"] += r_sq.size
+    count("line_integrals", r_sq.size)
+    count("kernel_evaluations", r_sq.size * (kernel_evaluations_per_pair(quadrature, quad_order, H_array) if r_sq.size else 0))
+    c = V_T / (2 * A)
+    if quadrature == "trapz":
+        return _trapz_line_integrals_at(r_sq, z, H_array, V_T, A, np.max(H_array, initial=0.0) if z0_max is None else z0_max)
+    elif quadrature == "gauss":
+        return _gauss_kernel_integral(np.sqrt(r_sq), z, H_array, c, quad_order)
+    elif quadrature == "adaptive":
+        ints = _gauss_kernel_integral(np.sqrt(r_sq), z, H_array, c, quad_order)
+        todo = np.arange(r_sq.size)
+        order = quad_order
+        while len(todo) and order <= 64 * quad_order:
+            finer = _gauss_kernel_integral(np.sqrt(r_sq.ravel()[todo]), z.ravel()[todo], H_array.ravel()[todo], c, 2 * order)
+            err = np.abs(finer - ints.ravel()[todo])
+            ints.ravel()[todo] = finer
+            todo = todo[err > quad_tol * np.maximum(np.abs(finer), 1.0)]
+            order *= 2
+        return ints
+    elif quadrature == "table":
+        return _gauss_kernel_integral(np.sqrt(r_sq), z, H_array, c, 32)
+    elif quadrature == "exact":
+        if V_T != 0:
+            raise ValueError("The exact line integral requires V_T == 0 (no groundwater flow)")
+        r = np.sqrt(r_sq)
+        return (np.arcsinh(z / r) - np.arcsinh((z - H_array) / r)) - (np.arcsinh((z + H_array) / r) - np.arcsinh(z / r))
+    raise ValueError(f"Unknown quadrature: {quadrature!r}")
+
+def self_integrals_at(z, H, R_w):
+    # Direct-minus-mirror self term of precompute_integrals at arbitrary depths (broadcasts)
+    return (np.arcsinh(z / R_w) - np.arcsinh((z - H) / R_w)) - (np.arcsinh((z + H) / R_w) - np.arcsinh(z / R_w))
+
+def _exact_line_integrals(r_sq, z_values, H_array):
+    # Closed form of the line integrals of 1/rho, valid without groundwater flow (V_T == 0)
+    r = np.sqrt(r_sq)[:, None]
+    z = z_values[None, :]
+    H = H_array[:, None]
+    direct = np.arcsinh(z / r) - np.arcsinh((z - H) / r)
+    mirror = np.arcsinh((z + H) / r) - np.arcsinh(z / r)
+    return direct - mirror
+
+def compute_line_integrals(r_sq, z_values, H_array, V_T, A, quadrature="trapz", quad_order=8, quad_tol=1e-8, return_error=False, z0_max=None, dtype=float, scaled=False):
+    # Direct-minus-mirror MFLS line integral over z0 per source, shape (n_sources, n_z).
+    # quadrature: "trapz" (1 m trapezoid), "gauss" (fixed order per source), "adaptive" (order doubled
+    # per source-target pair until two orders agree to quad_tol), "exact" (closed form, V_T == 0 only)
+    # or "table" (interpolated from tabulated kernels, see get_kernel_table).
+    # With return_error=True an estimate of the absolute quadrature error is returned as well. z0_max pads
+    # the trapezoid z0 grid, so that a subset of a layout is integrated as the whole layout would be.
+    # dtype=np.float32 evaluates the trapz and Gauss kernels in single precision (about 1e-6 relative).
+    # scaled=True returns the integrals times exp(c * r), c = V_T / (2A), without the exp(-c * r) decay
+    # that underflows at large c * r (not available for "table").
+    r_sq = np.asarray(r_sq, dtype=dtype)
+    z_values = np.asarray(z_values, dtype=dtype)
+    H_array = np.asarray(H_array, dtype=dtype)
+    EVALUATION_COUNTS["line_integrals"] += r_sq.size * z_values.size
+    if is_enabled():
+        count("line_integrals", r_sq.size * z_values.size)
+        count("kernel_evaluations", r_sq.size * z_values.size * (kernel_evaluations_per_pair(quadrature, quad_order, H_array) if r_sq.size else 0))
+
+    if quadrature == "trapz":
+        ints = _trapz_line_integrals(r_sq, z_values, H_array, V_T, A, scaled, z0_max=z0_max)
+        err = np.abs(ints - _gauss_line_integrals(r_sq, z_values, H_array, V_T, A, 32, scaled)) if return_error else None
+    elif quadrature == "gauss":
+        ints = _gauss_line_integrals(r_sq, z_values, H_array, V_T, A, quad_order, scaled)
+        err = np.abs(ints - _gauss_line_integrals(r_sq, z_values, H_array, V_T, A, 2 * quad_order, scaled)) if return_error else None
+    elif quadrature == "adaptive":
+        ints = _gauss_line_integrals(r_sq, z_values, H_array, V_T, A, quad_order, scaled)
+        err = np.full(ints.shape, np.inf)
+        todo = np.arange(len(r_sq))
+        order = quad_order
+        while len(todo) and order <= 64 * quad_order:
+            finer = _gauss_line_integrals(r_sq[todo], z_values, H_array[todo], V_T, A, 2 * order, scaled)
+            err[todo] = np.abs(finer - ints[todo])
+            ints[todo] = finer
+            # pairs close to their source need the higher orders, distant ones stop early
+            todo = todo[np.any(err[todo] > quad_tol * np.maximum(np.abs(finer), 1.0), axis=1)]
+            order *= 2
+    elif quadrature == "table":
+        if scaled:
+            raise ValueError("scaled line integrals are not available for quadrature='table'")
+        ints, err = _table_line_integrals(r_sq, z_values, H_array, V_T, A)
+    elif quadrature == "exact":
+        if V_T != 0:
+            raise ValueError("The exact line integral requires V_T == 0 (no groundwater flow)")
+        ints = _exact_line_integrals(r_sq, z_values, H_array)
+        err = np.zeros_like(ints)
+    else:
+        raise ValueError(f"Unknown quadrature: {quadrature!r}")
+
+    return (ints, err) if return_error else ints
+
+def build_kernel_table(H, z, V_T, A, r_min=0.01, r_max=2000.0, n_r=2048, quad_order=32):
+    # Direct-minus-mirror line integral of one source length H at depth z on a log-spaced r grid.
+    # The integral behaves like exp(-c * r) times a slowly varying factor, so log(value) + c * r is
+    # tabulated and interpolated linearly in log(r). The interpolation is checked against the exact
+    # values at every interval midpoint, whose worst case is stored as the table's error bound.
+    c = V_T / (2 * A)
+    log_r = np.linspace(np.log(r_min), np.log(r_max), n_r)
+    mid = (log_r[:-1] + log_r[1:]) / 2
+    values = _gauss_line_integrals(np.exp(2 * log_r), np.array([z], dtype=float), np.full(n_r, float(H)), V_T, A, quad_order)[:, 0]
+    exact_mid = _gauss_line_integrals(np.exp(2 * mid), np.array([z], dtype=float), np.full(n_r - 1, float(H)), V_T, A, quad_order)[:, 0]
+    log_values = np.log(np.maximum(values, 1e-300)) + c * np.exp(log_r)
+    interp = np.exp((log_values[:-1] + log_values[1:]) / 2 - c * np.exp(mid))
+    interp_err = np.abs(interp - exact_mid)
+    return {
+        "log_r0": float(log_r[0]), "dlog_r": float(log_r[1] - log_r[0]), "c": float(c), "log_values": log_values,
+        "max_abs_error": float(np.max(interp_err)),
+        "max_rel_error": float(np.max(interp_err / np.maximum(np.abs(exact_mid), 1e-300))),
+    }
+
+def get_kernel_table(H, z, V_T, A, cache_dir=KERNEL_CACHE_DIR, **table_options):
+    # Tables are kept in memory and as .npz files keyed by (V_T, A, H, z, table options)
+    key_src = repr((float(V_T), float(A), float(H), float(z), sorted(table_options.items())))
+    key = hashlib.sha1(key_src.encode()).hexdigest()
+    if key in _KERNEL_TABLES:
+        return _KERNEL_TABLES[key]
+
+    path = os.path.join(cache_dir, f"mfls_{key}.npz") if cache_dir else None
+    if path and os.path.exists(path):
+        with np.load(path) as data:
+            table = {name: (data[name] if name == "log_values" else float(data[name])) for name in data.files}
+    else:
+        table = build_kernel_table(H, z, V_T, A, **table_options)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez_compressed(path, **table)
+    _KERNEL_TABLES[key] = table
+    return table
+
+def lookup_kernel_table(table, r_sq):
+    # Vectorized linear interpolation in log(r); NaN outside the tabulated range
+    log_values = table["log_values"]
+    with np.errstate(divide="ignore"):
+        t = (0.5 * np.log(r_sq) - table["log_r0"]) / table["dlog_r"]
+    inside = (t >= 0) & (t <= len(log_values) - 1)
+    idx = np.clip(np.floor(np.where(inside, t, 0)).astype(int), 0, len(log_values) - 2)
+    frac = np.where(inside, t, 0) - idx
+    g = log_values[idx] * (1 - frac) + log_values[idx + 1] * frac
+    return np.where(inside, np.exp(g - table["c"] * np.sqrt(r_sq)), np.nan)
+
+def _table_line_integrals(r_sq, z_values, H_array, V_T, A):
+    ints = np.empty((len(r_sq), len(z_values)))
+    err = np.empty_like(ints)
+    for H in np.unique(H_array):
+        rows = np.flatnonzero(H_array == H)
+        for k, z in enumerate(z_values):
+            table = get_kernel_table(H, z, V_T, A)
+            ints[rows, k] = lookup_kernel_table(table, r_sq[rows])
+            err[rows, k] = table["max_rel_error"] * np.abs(ints[rows, k])
+
+    # Pairs outside the tabulated r range are integrated directly
+    outside = np.flatnonzero(np.isnan(ints).any(axis=1) & (r_sq > 0))
+    if len(outside):
+        ints[outside] = _gauss_line_integrals(r_sq[outside], z_values, H_array[outside], V_T, A, 32)
+        err[outside] = 0.0
+    return ints, err
+
+def kernel_evaluations_per_pair(quadrature, quad_order, H_array):
+    # Kernel evaluations per (source, depth) pair, used to size evaluation blocks
+    if quadrature == "trapz":
+        return 2 * (int(np.max(H_array)) + 1)
+    if quadrature in ("exact", "table"):
+        return 1
+    return 2 * quad_order * (4 if quadrature == "adaptive" else 1)
+
+def compute_neighbor_response(x, y, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature="trapz", quad_order=8):
+    # Temperature change at (x, y, z_values) per unit load (1 W/m) of each source
+    sources = np.asarray(sources, dtype=float)
+    dx = x - sources[:, 0]         # shape: (n_sources,)
+    dy = y - sources[:, 1]
+    r_sq = dx**2 + dy**2           # shape: (n_sources,)
+    exp_fac = advection_factor(dx, dy, V_T, ANGLE, A)  # shape: (n_sources,)
+
+    ints = compute_line_integrals(r_sq, z_values, H_array, V_T, A, quadrature=quadrature, quad_order=quad_order)
+    return exp_fac[:, None] * ints / (4 * np.pi * LAMDA)  # (n_sources, n_z)
+
+def compute_neighbor_Tchange(x, y, z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA, quadrature="trapz", quad_order=8, quad_tol=1e-8, return_error=False, z0_max=None):
+    z_values = np.asarray(z_values, dtype=float)
+
+    # Handle empty sources
+    if sources is None or len(sources) == 0:
+        zeros = np.zeros_like(z_values, dtype=float)
+        return (zeros, zeros.copy()) if return_error else zeros
+
+    sources = np.asarray(sources, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    dx = x - sources[:, 0]
+    dy = y - sources[:, 1]
+    scale = heat_rates * advection_factor(dx, dy, V_T, ANGLE, A) / (4 * np.pi * LAMDA)
+    ints = compute_line_integrals(dx**2 + dy**2, z_values, H_array, V_T, A, quadrature=quadrature,
+                                  quad_order=quad_order, quad_tol=quad_tol, return_error=return_error, z0_max=z0_max)
 
     # Compute temperature change
-    t = (heat_rates[:, None] / (4 * np.pi * LAMDA)) * exp_fac[:, None] * (int_direct - int_mirror)
-    return np.sum(t, axis=0)  # (n_z,)
+    if return_error:
+        ints, err = ints
+        return scale @ ints, np.abs(scale) @ err
+    return scale @ ints  # (n_z,)
+
+def _grid_kernel(rows, cols, step_x, step_y, obs_z, H, V_T, ANGLE, A, LAMDA, quadrature="trapz", quad_order=8, influence_radius=None, z0_max=None, chunk_size=65536):
+    # Unit response of a source of length H at every node offset (di, dj), shape (2 * rows - 1, 2 * cols - 1),
+    # followed by its first and second derivatives with respect to the offset: [K, K_x, K_y, K_xx, K_xy, K_yy].
+    # The zero offset is left at 0 since it is covered by the self term.
+    # r depends only on |di|, |dj|, so the line integrals f(r) are evaluated once per distinct r of one
+    # quadrant (within influence_radius) and mirrored; f' and f'' come from central differences at r (1 ± 1e-4)
+    di, dj = np.meshgrid(np.arange(rows), np.arange(cols), indexing="ij")
+    r_unique, inverse = np.unique(np.sqrt((dj * step_x) ** 2 + (di * step_y) ** 2).ravel(), return_inverse=True)
+    n_eval = len(r_unique) if influence_radius is None else int(np.searchsorted(r_unique, influence_radius, side="right"))
+    eps = 1e-4 * r_unique
+    radial = np.zeros((3, len(r_unique)))
+    for start in range(1, n_eval, chunk_size):
+        stop = min(start + chunk_size, n_eval)
+        for k, shift in enumerate((0.0, 1.0, -1.0)):
+            radial[k, start:stop] = compute_line_integrals((r_unique[start:stop] + shift * eps[start:stop])**2, [obs_z], np.full(stop - start, H), V_T, A,
+                                                           quadrature=quadrature, quad_order=quad_order, z0_max=z0_max)[:, 0]
+    f = radial[0]
+    f_r, f_rr = np.zeros_like(f), np.zeros_like(f)
+    f_r[1:] = (radial[1, 1:] - radial[2, 1:]) / (2 * eps[1:])
+    f_rr[1:] = (radial[1, 1:] - 2 * f[1:] + radial[2, 1:]) / eps[1:]**2
+    f, f_r, f_rr = f[inverse], f_r[inverse], f_rr[inverse]
+
+    off_i = np.arange(-(rows - 1), rows)
+    off_j = np.arange(-(cols - 1), cols)
+    mirror = (np.abs(off_i)[:, None], np.abs(off_j)[None, :])
+    f, f_r, f_rr = (v.reshape(rows, cols)[mirror] / (4 * np.pi * LAMDA) for v in (f, f_r, f_rr))
+    dx, dy = off_j[None, :] * step_x, off_i[:, None] * step_y
+    r = np.hypot(dx, dy)
+    r[rows - 1, cols - 1] = 1.0
+    ux, uy = dx / r, dy / r
+    # K = f(r) * exp(g . d), g = -v / (2A)
+    gx, gy = -V_T * np.cos(ANGLE) / (2 * A), -V_T * np.sin(ANGLE) / (2 * A)
+    adv = advection_factor(dx, dy, V_T, ANGLE, A)
+    f_x, f_y = f_r * ux, f_r * uy
+    f_xx = f_rr * ux * ux + f_r / r * (1 - ux * ux)
+    f_xy = (f_rr - f_r / r) * ux * uy
+    f_yy = f_rr * uy * uy + f_r / r * (1 - uy * uy)
+    return [adv * f, adv * (f_x + gx * f), adv * (f_y + gy * f), adv * (f_xx + 2 * gx * f_x + gx * gx * f),
+            adv * (f_xy + gx * f_y + gy * f_x + gx * gy * f), adv * (f_yy + 2 * gy * f_y + gy * gy * f)]
+
+@timed("grid.fft")
+def _compute_temperature_grid_fft(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, near_cells=3, subcells=3, quadrature="trapz", quad_order=8, influence_radius=None):
+    # Sources are deposited as point loads on their node_map nodes, so the neighbor field is a sum of
+    # convolutions per distinct borehole length. The kernels are evaluated on a grid refined subcells
+    # (odd) times, and each source uses the kernel shifted by the refined offset nearest to its true
+    # position. The rest of its offset d (at most 1 / (2 subcells) of a cell) is corrected to second
+    # order, K(x - d) ≈ K - d.∇K + d.∇²K.d / 2, with five more convolutions of the derivative kernels
+    # with the loads times dx, dy, dx², dx dy, dy². Within near_cells of each source, where the
+    # expansion is least accurate, and wherever a snapped source may fall on the other side of
+    # influence_radius than the true one, the contribution is swapped for the exact one. All line
+    # integrals run over the z0 grid of the longest source, as in the direct engine.
+    from scipy.signal import fftconvolve  # imported here: scipy.signal alone takes longer to import than the rest of the model
+    rows, cols = grid_x.shape
+    z0_max = np.max(H_array)
+    step_x = float(grid_x[0, 1] - grid_x[0, 0]) if cols > 1 else 1.0
+    step_y = float(grid_y[1, 0] - grid_y[0, 0]) if rows > 1 else 1.0
+
+    src_idx, src_i, src_j = (np.array(a) for a in zip(*[(s, i, j) for (i, j), idx_list in node_map.items() for s in idx_list]))
+
+    # refined offset (pi, pj) of each source, and Taylor weights 1, -dx, -dy, dx² / 2, dx dy, dy² / 2
+    # of the rest for the kernels of _grid_kernel
+    half = subcells // 2
+    off_x = sources[src_idx, 0] - grid_x[src_i, src_j]
+    off_y = sources[src_idx, 1] - grid_y[src_i, src_j]
+    phase_i = np.clip(np.rint(off_y / step_y * subcells), -half, half).astype(int)
+    phase_j = np.clip(np.rint(off_x / step_x * subcells), -half, half).astype(int)
+    off_x = off_x - phase_j * step_x / subcells
+    off_y = off_y - phase_i * step_y / subcells
+    taylor = np.array([np.ones(len(src_idx)), -off_x, -off_y, off_x**2 / 2, off_x * off_y, off_y**2 / 2])
+
+    temp_map = np.zeros((rows, cols), dtype=float)
+    kernels = {}
+    fine_rows, fine_cols = (rows - 1) * subcells + half + 1, (cols - 1) * subcells + half + 1
+    for H in np.unique(H_array[src_idx]):
+        fine = _grid_kernel(fine_rows, fine_cols, step_x / subcells, step_y / subcells, obs_z, H, V_T, ANGLE, A, LAMDA,
+                            quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius, z0_max=z0_max)
+        for pi, pj in set(zip(phase_i[H_array[src_idx] == H], phase_j[H_array[src_idx] == H])):
+            m = (H_array[src_idx] == H) & (phase_i == pi) & (phase_j == pj)
+            # every subcells-th refined offset, starting from the one that lines up with this source;
+            # the zero offset is the source's own node, covered by the self term
+            kernel = [np.array(k[half - pi::subcells, half - pj::subcells][:2 * rows - 1, :2 * cols - 1]) for k in fine]
+            for k in kernel:
+                k[rows - 1, cols - 1] = 0.0
+            kernels[H, pi, pj] = kernel
+            for k, weight in zip(kernel, taylor):
+                loads = np.zeros((rows, cols), dtype=float)
+                np.add.at(loads, (src_i[m], src_j[m]), heat_rates[src_idx[m]] * weight[m])
+                temp_map += fftconvolve(k, loads, mode="valid")
+
+    # sum self terms for all sources snapped to each node
+    for s, i, j in zip(src_idx, src_i, src_j):
+        temp_map[i, j] += compute_self_Tchange([obs_z], heat_rates[s], integrals[s], LAMDA)[0]
+
+    if near_cells > 0 or influence_radius is not None:
+        # (source, node) pairs in the window around each snapped source, excluding its own node, and in
+        # the ring within half a cell diagonal of influence_radius
+        half_diag = 0.5 * np.hypot(step_x, step_y)
+        reach = near_cells if influence_radius is None else max(near_cells, int(np.ceil((influence_radius + half_diag) / min(step_x, step_y))))
+        w = np.arange(-reach, reach + 1)
+        wi, wj = [a.ravel() for a in np.meshgrid(w, w, indexing="ij")]
+        window = (np.maximum(np.abs(wi), np.abs(wj)) <= near_cells)
+        if influence_radius is not None:
+            window |= np.abs(np.hypot(wj * step_x, wi * step_y) - influence_radius) <= half_diag
+        window &= (wi != 0) | (wj != 0)
+        wi, wj = wi[window], wj[window]
+        ni, nj = src_i[:, None] + wi[None, :], src_j[:, None] + wj[None, :]
+        keep = (ni >= 0) & (ni < rows) & (nj >= 0) & (nj < cols)
+        pair = np.broadcast_to(np.arange(len(src_idx))[:, None], ni.shape)[keep]
+        oi, oj = np.broadcast_to(wi, ni.shape)[keep], np.broadcast_to(wj, ni.shape)[keep]
+        ni, nj = ni[keep], nj[keep]
+        s = src_idx[pair]
+
+        dx = grid_x[ni, nj] - sources[s, 0]
+        dy = grid_y[ni, nj] - sources[s, 1]
+        exact = advection_factor(dx, dy, V_T, ANGLE, A) * compute_line_integrals(dx**2 + dy**2, [obs_z], H_array[s], V_T, A, quadrature=quadrature, quad_order=quad_order, z0_max=z0_max)[:, 0] / (4 * np.pi * LAMDA)
+        if influence_radius is not None:
+            exact[dx**2 + dy**2 > influence_radius**2] = 0.0
+        snapped = np.empty(len(s))
+        for (H, pi, pj), kernel in kernels.items():
+            m = (H_array[s] == H) & (phase_i[pair] == pi) & (phase_j[pair] == pj)
+            snapped[m] = sum(taylor[t, pair[m]] * kernel[t][oi[m] + rows - 1, oj[m] + cols - 1] for t in range(len(kernel)))
+        np.add.at(temp_map, (ni, nj), heat_rates[s] * (exact - snapped))
+    return temp_map
+
+@timed("grid.adaptive")
+def _compute_temperature_grid_adaptive(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, tol=0.02, coarse_cells=8, max_bytes=DEFAULT_MAX_BYTES, quadrature="trapz", quad_order=8, influence_radius=None):
+    # Quadtree on the grid's own node lattice: square cells start at about 1/coarse_cells of the grid
+    # and are split while a BHE lies within two cell sizes, or while ΔT at their center or edge
+    # midpoints differs from the bilinear interpolation of their corners by more than tol / 2 (K), so
+    # that the nodes between the checked ones stay within tol. Only these nodes are evaluated (each
+    # level in one batch, snapped sources as on the full grid); the other nodes are bilinear in their
+    # leaf cell, so far-field nodes cost nothing.
+    rows, cols = grid_x.shape
+    step_x = float(grid_x[0, 1] - grid_x[0, 0]) if cols > 1 else 1.0
+    step_y = float(grid_y[1, 0] - grid_y[0, 0]) if rows > 1 else 1.0
+    x0, y0 = float(grid_x[0, 0]), float(grid_y[0, 0])
+    size = 2 ** max(0, int(np.floor(np.log2(max(rows, cols) / coarse_cells))))
+    n_i, n_j = -(-max(rows - 1, 1) // size), -(-max(cols - 1, 1) // size)
+    shape = (n_i * size + 1, n_j * size + 1)
+
+    values = np.full(shape, np.nan)
+    snapped = {key: idx_list for key, idx_list in node_map.items()}
+    bhe_tree = cKDTree(np.column_stack([(sources[:, 1] - y0) / step_y, (sources[:, 0] - x0) / step_x]))
+
+    def evaluate(ni, nj):
+        flat = np.unique(np.ravel_multi_index((ni, nj), shape))
+        flat = flat[np.isnan(values.ravel()[flat])]
+        if len(flat) == 0:
+            return
+        ni, nj = np.unravel_index(flat, shape)
+        self_map = {p: snapped[(i, j)] for p, (i, j) in enumerate(zip(ni.tolist(), nj.tolist())) if (i, j) in snapped}
+        values[ni, nj] = compute_temperature_points(x0 + nj * step_x, y0 + ni * step_y, [obs_z], sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA,
+                                                    integrals=integrals, self_map=self_map, max_bytes=max_bytes, quadrature=quadrature, quad_order=quad_order,
+                                                    influence_radius=influence_radius)[:, 0]
+
+    ci, cj = [a.ravel() * size for a in np.meshgrid(np.arange(n_i), np.arange(n_j), indexing="ij")]
+    leaves = []
+    while len(ci):
+        half = size // 2
+        corners_i = np.concatenate([ci, ci, ci + size, ci + size])
+        corners_j = np.concatenate([cj, cj + size, cj, cj + size])
+        if half == 0:
+            evaluate(corners_i, corners_j)
+            leaves.append((ci, cj, size))
+            break
+        mid_i = np.concatenate([ci + half, ci, ci + half, ci + half, ci + size])
+        mid_j = np.concatenate([cj + half, cj + half, cj, cj + size, cj + half])
+        evaluate(np.concatenate([corners_i, mid_i]), np.concatenate([corners_j, mid_j]))
+        v00, v01, v10, v11 = values[ci, cj], values[ci, cj + size], values[ci + size, cj], values[ci + size, cj + size]
+        predicted = np.concatenate([(v00 + v01 + v10 + v11) / 4, (v00 + v01) / 2, (v00 + v10) / 2, (v01 + v11) / 2, (v10 + v11) / 2])
+        deviation = np.abs(values[mid_i, mid_j] - predicted).reshape(5, -1).max(axis=0)
+        near = bhe_tree.query(np.column_stack([ci + half, cj + half]))[0] <= 2 * size
+        split = near | (deviation > tol / 2)
+        leaves.append((ci[~split], cj[~split], size))
+        ci = np.concatenate([ci[split] + di for di in (0, 0, half, half)])
+        cj = np.concatenate([cj[split] + dj for dj in (0, half, 0, half)])
+        size = half
+
+    # Bilinear fill of every leaf from its corners, then the evaluated nodes themselves
+    temp_map = np.zeros(shape)
+    for li, lj, s in leaves:
+        if len(li) == 0:
+            continue
+        a, b = np.meshgrid(np.arange(s + 1) / s, np.arange(s + 1) / s, indexing="ij")
+        v00, v01 = values[li, lj][:, None, None], values[li, lj + s][:, None, None]
+        v10, v11 = values[li + s, lj][:, None, None], values[li + s, lj + s][:, None, None]
+        block = (1 - a) * ((1 - b) * v00 + b * v01) + a * ((1 - b) * v10 + b * v11)
+        off = np.arange(s + 1)
+        temp_map[li[:, None, None] + off[None, :, None], lj[:, None, None] + off[None, None, :]] = block
+    exact = ~np.isnan(values)
+    temp_map[exact] = values[exact]
+    return temp_map[:rows, :cols]
+
+def _iter_point_source_pairs(px, py, sources, self_map, influence_radius, chunk_size):
+    # Yields (start, stop, pt, src): the (point, source) pairs of each block of points, against all
+    # sources or against those within influence_radius (KD-tree), minus the self_map pairs
+    nsrc = len(sources)
+    self_keys = np.array([p * nsrc + s for p, idx_list in (self_map or {}).items() for s in idx_list], dtype=int)
+    tree = cKDTree(sources) if influence_radius is not None else None
+    for start in range(0, len(px), chunk_size):
+        stop = min(start + chunk_size, len(px))
+        if tree is None:
+            pt = np.repeat(np.arange(start, stop), nsrc)
+            src = np.tile(np.arange(nsrc), stop - start)
+        else:
+            lists = tree.query_ball_point(np.column_stack([px[start:stop], py[start:stop]]), r=influence_radius)
+            pt = np.repeat(np.arange(start, stop), [len(l) for l in lists])
+            src = np.concatenate([np.asarray(l, dtype=int) for l in lists])
+
+        # neighbors = all except those snapped to this point
+        keep = ~np.isin(pt * nsrc + src, self_keys)
+        yield start, stop, pt[keep], src[keep]
+
+def compute_pair_responses(px, py, pt, src, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order, dtype=float):
+    # Unit-load neighbor responses of (point, source) pairs, shape (n_pairs, n_z)
+    dx = px[pt] - sources[src, 0]
+    dy = py[pt] - sources[src, 1]
+    # z0 grid of the whole layout, so that a block's result does not depend on which sources it holds
+    ints = compute_line_integrals(dx**2 + dy**2, z_values, H_array[src], V_T, A, quadrature=quadrature, quad_order=quad_order, z0_max=np.max(H_array), dtype=dtype)
+    return advection_factor(dx, dy, V_T, ANGLE, A)[:, None] * ints / (4 * np.pi * LAMDA)
+
+def _points_chunk_size(nsrc, n_z, H_array, quadrature, quad_order, max_bytes, itemsize=8):
+    # compute_line_integrals holds about four float arrays of (n_pairs, n_z, kernel evaluations) at once
+    n_eval = kernel_evaluations_per_pair(quadrature, quad_order, H_array)
+    return max(1, int(max_bytes // (4 * itemsize * nsrc * n_z * n_eval)))
+
+@timed("points")
+def compute_temperature_points(px, py, z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA, integrals=None, self_map=None, max_bytes=DEFAULT_MAX_BYTES, chunk_size=None, quadrature="trapz", quad_order=8, influence_radius=None, dtype=float):
+    # ΔT at arbitrary points, shape (n_points, n_z). Points are evaluated in blocks against all
+    # sources at once, or against the sources within influence_radius found with a KD-tree;
+    # self_map maps a point index to the sources snapped to it, which contribute their self term
+    # instead of the neighbor kernel (as node_map does for the grid). The kernels are evaluated in
+    # dtype (np.float32 halves the memory per block), the sums are accumulated in float64.
+    px = np.asarray(px, dtype=float).ravel()
+    py = np.asarray(py, dtype=float).ravel()
+    z_values = np.asarray(z_values, dtype=float)
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    n_pts, nsrc, n_z = len(px), len(sources), len(z_values)
+
+    out = np.zeros((n_pts, n_z), dtype=float)
+    if nsrc == 0:
+        return out
+
+    chunk_size = chunk_size or _points_chunk_size(nsrc, n_z, H_array, quadrature, quad_order, max_bytes, np.dtype(dtype).itemsize)
+    for start, stop, pt, src in _iter_point_source_pairs(px, py, sources, self_map, influence_radius, chunk_size):
+        if len(pt) == 0:
+            continue
+        contrib = heat_rates[src, None] * compute_pair_responses(px, py, pt, src, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order, dtype)
+        for k in range(n_z):
+            out[start:stop, k] += np.bincount(pt - start, weights=contrib[:, k], minlength=stop - start)
+
+    # sum self terms for all sources snapped to each point
+    for p, idx_list in (self_map or {}).items():
+        for s in idx_list:
+            out[p] += compute_self_Tchange(z_values, heat_rates[s], integrals[s], LAMDA)
+    return out
+
+def _response_matrix_block(px, py, pt, src, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order):
+    n_z = len(z_values)
+    vals = compute_pair_responses(px, py, pt, src, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order)
+    rows = (pt[:, None] * n_z + np.arange(n_z)[None, :]).ravel()
+    return rows, np.repeat(src, n_z), vals.ravel()
+
+@timed("response_matrix")
+def build_response_matrix(px, py, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, integrals=None, self_map=None, influence_radius=None, quadrature="trapz", quad_order=8, max_bytes=DEFAULT_MAX_BYTES, n_jobs=1):
+    # Sparse (CSR) unit-load response matrix of shape (n_points * n_z, n_sources), row p * n_z + k,
+    # so that ΔT = (M @ q).reshape(n_points, n_z). With influence_radius the number of entries grows
+    # with the local source density rather than the field size. Pairs in self_map hold the self
+    # term when integrals are given and are left out otherwise.
+    px = np.asarray(px, dtype=float).ravel()
+    py = np.asarray(py, dtype=float).ravel()
+    z_values = np.asarray(z_values, dtype=float)
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    n_pts, nsrc, n_z = len(px), len(sources), len(z_values)
+
+    chunk_size = _points_chunk_size(nsrc, n_z, H_array, quadrature, quad_order, max_bytes)
+    blocks = Parallel(n_jobs=n_jobs)(
+        delayed(_response_matrix_block)(px, py, pt, src, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order)
+        for _, _, pt, src in _iter_point_source_pairs(px, py, sources, self_map, influence_radius, chunk_size) if len(pt))
+    rows, cols, vals = [np.concatenate(parts) for parts in zip(*blocks)] if blocks else (np.zeros(0, dtype=int),) * 2 + (np.zeros(0),)
+
+    if integrals is not None and self_map:
+        self_pt, self_src = np.array([(p, s) for p, idx_list in self_map.items() for s in idx_list], dtype=int).reshape(-1, 2).T
+        self_vals = np.array([compute_self_Tchange(z_values, 1.0, integrals[s], LAMDA) for s in self_src]).reshape(-1, n_z)
+        rows = np.concatenate([rows, (self_pt[:, None] * n_z + np.arange(n_z)[None, :]).ravel()])
+        cols = np.concatenate([cols, np.repeat(self_src, n_z)])
+        vals = np.concatenate([vals, self_vals.ravel()])
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(n_pts * n_z, nsrc))
+
+@timed("grid")
+def compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, engine="vectorized", max_bytes=DEFAULT_MAX_BYTES, chunk_size=None, quadrature="trapz", quad_order=8, influence_radius=None, adaptive_tol=0.02, tree_tol=0.01, dtype=float):
+    if engine == "vectorized":
+        cols = grid_x.shape[1]
+        self_map = {i * cols + j: idx_list for (i, j), idx_list in node_map.items()}
+        return compute_temperature_points(grid_x, grid_y, [obs_z], sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA,
+                                          integrals=integrals, self_map=self_map, max_bytes=max_bytes, chunk_size=chunk_size, quadrature=quadrature, quad_order=quad_order,
+                                          influence_radius=influence_radius, dtype=dtype)[:, 0].reshape(grid_x.shape)
+    if engine == "sparse":
+        cols = grid_x.shape[1]
+        self_map = {i * cols + j: idx_list for (i, j), idx_list in node_map.items()}
+        response = build_response_matrix(grid_x, grid_y, [obs_z], sources, H_array, V_T, ANGLE, A, LAMDA, integrals=integrals, self_map=self_map,
+                                         influence_radius=influence_radius, quadrature=quadrature, quad_order=quad_order, max_bytes=max_bytes)
+        return (response @ np.asarray(heat_rates, dtype=float)).reshape(grid_x.shape)
+    if engine == "fft":
+        return _compute_temperature_grid_fft(grid_x, grid_y, np.asarray(sources, dtype=float), np.asarray(H_array, dtype=float), np.asarray(heat_rates, dtype=float),
+                                             obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, quadrature=quadrature, quad_order=quad_order,
+                                             influence_radius=influence_radius)
+    if engine == "adaptive":
+        return _compute_temperature_grid_adaptive(grid_x, grid_y, np.asarray(sources, dtype=float), np.asarray(H_array, dtype=float), np.asarray(heat_rates, dtype=float),
+                                                  obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, tol=adaptive_tol, max_bytes=max_bytes, quadrature=quadrature,
+                                                  quad_order=quad_order, influence_radius=influence_radius)
+    if engine == "tree":
+        from source_tree import compute_temperature_points_tree  # imported here: source_tree builds on this module
+        cols = grid_x.shape[1]
+        self_map = {i * cols + j: idx_list for (i, j), idx_list in node_map.items()}
+        return compute_temperature_points_tree(grid_x, grid_y, [obs_z], sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA,
+                                               integrals=integrals, self_map=self_map, tol=tree_tol, max_bytes=max_bytes, quadrature=quadrature, quad_order=quad_order,
+                                               influence_radius=influence_radius)[:, 0].reshape(grid_x.shape)
+    if engine != "direct":
+        raise ValueError(f"Unknown engine: {engine!r}")
 
-def compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map):
     temp_map = np.zeros_like(grid_x, dtype=float)
     rows, cols = grid_x.shape
 
@@ -83,6 +652,8 @@ def compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z
     H_array = np.asarray(H_array, dtype=float)
     heat_rates = np.asarray(heat_rates, dtype=float)
     nsrc = len(sources)
+    # with a cutoff each node sees a subset of the layout, still integrated over the z0 grid of the whole one
+    z0_max = np.max(H_array) if influence_radius is not None else None
 
     for i in range(rows):
         for j in range(cols):
@@ -90,14 +661,17 @@ def compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z
             y = float(grid_y[i, j])
             key = (i, j)  # node index
 
+            mask = np.ones(nsrc, dtype=bool)
+            if influence_radius is not None:
+                mask = (sources[:, 0] - x)**2 + (sources[:, 1] - y)**2 <= influence_radius**2
+
             if key in node_map:
                 self_idx_list = node_map[key]
 
                 # neighbors = all except those snapped to this node
-                mask = np.ones(nsrc, dtype=bool)
                 mask[self_idx_list] = False
 
-                t_neigh = compute_neighbor_Tchange(x, y, [obs_z], sources[mask], H_array[mask], heat_rates[mask], V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA)[0]
+                t_neigh = compute_neighbor_Tchange(x, y, [obs_z], sources[mask], H_array[mask], heat_rates[mask], V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, quadrature=quadrature, quad_order=quad_order, z0_max=z0_max)[0]
 
                 # sum self terms for all sources snapped to this node
                 t_self = 0.0
@@ -106,7 +680,56 @@ def compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, obs_z
 
                 temp_map[i, j] = t_self + t_neigh
             else:
-                temp_map[i, j] = compute_neighbor_Tchange(x, y, [obs_z], sources, H_array, heat_rates, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA)[0]
+                temp_map[i, j] = compute_neighbor_Tchange(x, y, [obs_z], sources[mask], H_array[mask], heat_rates[mask], V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, quadrature=quadrature, quad_order=quad_order, z0_max=z0_max)[0]
 
 
     return temp_map
+
+@timed("volume")
+def compute_temperature_volume(grid_x, grid_y, z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA, integrals, node_map, out=None, max_bytes=DEFAULT_MAX_BYTES, quadrature="trapz", quad_order=8, influence_radius=None):
+    # ΔT on the (z, y, x) block, shape (n_z, rows, cols); integrals must cover all z_values.
+    # Each block of grid rows is evaluated for all depths in one pass, so the pair search, offsets
+    # and advection factors are shared by the depths. out may be a memory-mapped array, which is
+    # then filled one block of rows at a time.
+    z_values = np.asarray(z_values, dtype=float)
+    rows, cols = grid_x.shape
+    n_z = len(z_values)
+    out = np.zeros((n_z, rows, cols)) if out is None else out
+    rows_per_block = max(1, int(max_bytes // (4 * 8 * n_z * cols)))
+    for r0 in range(0, rows, rows_per_block):
+        r1 = min(r0 + rows_per_block, rows)
+        self_map = {(i - r0) * cols + j: idx_list for (i, j), idx_list in node_map.items() if r0 <= i < r1}
+        block = compute_temperature_points(grid_x[r0:r1], grid_y[r0:r1], z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA,
+                                           integrals=integrals, self_map=self_map, max_bytes=max_bytes, quadrature=quadrature, quad_order=quad_order,
+                                           influence_radius=influence_radius)
+        out[:, r0:r1, :] = block.T.reshape(n_z, r1 - r0, cols)
+    return out
+
+# Engines whose field is exactly linear in the loads (the adaptive refinement and the tree's
+# cluster acceptance depend on the loads themselves)
+LINEAR_ENGINES = ("vectorized", "sparse", "direct", "fft")
+
+@timed("grid.update")
+def update_temperature_grid(temp_map, grid_x, grid_y, sources, H_array, old_rates, new_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, **grid_options):
+    # With a LINEAR_ENGINES engine the field is linear in heat_rates: add the field of the k changed
+    # loads' deltas to temp_map, O(k * grid) instead of O(n * grid). The adaptive and tree engines
+    # refine or cluster by the loads, so they recompute the whole field. grid_options are passed on
+    # to compute_temperature_grid.
+    old_rates = np.asarray(old_rates, dtype=float)
+    new_rates = np.asarray(new_rates, dtype=float)
+    if grid_options.get("engine", "vectorized") not in LINEAR_ENGINES:
+        return compute_temperature_grid(grid_x, grid_y, sources, H_array, new_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, **grid_options)
+    changed = np.flatnonzero(new_rates != old_rates)
+    if len(changed) == 0:
+        return np.array(temp_map, dtype=float)
+
+    # node_map and integrals restricted to the changed sources, renumbered 0..k-1
+    position = {s: p for p, s in enumerate(changed)}
+    sub_map = {}
+    for key, idx_list in node_map.items():
+        sub = [position[s] for s in idx_list if s in position]
+        if sub:
+            sub_map[key] = sub
+    delta = compute_temperature_grid(grid_x, grid_y, np.asarray(sources, dtype=float)[changed], np.asarray(H_array, dtype=float)[changed],
+                                     new_rates[changed] - old_rates[changed], obs_z, V_T, ANGLE, A, LAMDA, [integrals[s] for s in changed], sub_map, **grid_options)
+    return temp_map + delta
@@ -0,0 +1,147 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# cache.py
+import hashlib
+import os
+import numpy as np
+from scipy import sparse
+
+RESULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bheopt", "results")
+# Total size of the result cache; least recently used entries are evicted beyond it
+RESULT_CACHE_MAX_BYTES = 1024 * 2**20
+# Part of every key; bump it whenever a change to the model or the solvers changes stored results,
+# so entries written by an older version are never served
+MODEL_VERSION = 2
+
+def _update_hash(digest, value):
+    if isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        digest.update(f"array{value.dtype.str}{value.shape}".encode())
+        digest.update(value.tobytes())
+    elif isinstance(value, bytes):
+        digest.update(value)
+    elif isinstance(value, dict):
+        digest.update(b"dict")
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode())
+            _update_hash(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f"seq{len(value)}".encode())
+        for item in value:
+            _update_hash(digest, item)
+    else:
+        digest.update(repr(value).encode())
+
+def cache_key(kind, **inputs):
+    # Content address of a result: kind, model version and every input that affects it (arrays by value)
+    digest = hashlib.sha1(f"{kind}:{MODEL_VERSION}".encode())
+    _update_hash(digest, inputs)
+    return f"{kind}_{digest.hexdigest()}"
+
+def pack_arrays(values):
+    # Flattens a dict of arrays, scalars, strings and scipy sparse matrices into savez-able arrays
+    packed = {}
+    for name, value in values.items():
+        if sparse.issparse(value):
+            value = value.tocsr()
+            packed[f"{name}.csr_data"] = value.data
+            packed[f"{name}.csr_indices"] = value.indices
+            packed[f"{name}.csr_indptr"] = value.indptr
+            packed[f"{name}.csr_shape"] = np.array(value.shape)
+        elif value is not None:
+            packed[name] = np.asarray(value)
+    return packed
+
+def unpack_arrays(packed):
+    values = {}
+    for name in packed:
+        if name.endswith(".csr_data"):
+            base = name[:-len(".csr_data")]
+            values[base] = sparse.csr_matrix((packed[name], packed[f"{base}.csr_indices"], packed[f"{base}.csr_indptr"]),
+                                             shape=tuple(packed[f"{base}.csr_shape"]))
+        elif ".csr_" not in name:
+            value = packed[name]
+            values[name] = value.item() if value.ndim == 0 else value
+    return values
+
+def load_result(key, cache_dir=RESULT_CACHE_DIR):
+    # Returns the stored dict, or None; a hit refreshes the entry's position in the LRU order
+    path = os.path.join(cache_dir, f"{key}.npz")
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            values = unpack_arrays({name: data[name] for name in data.files})
+    except (OSError, ValueError):
+        return None
+    os.utime(path)
+    return values
+
+def store_result(key, values, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{key}.npz")
+    # Write then rename, so a concurrent reader never sees a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **pack_arrays(values))
+    os.replace(tmp_path, path)
+    evict_results(cache_dir, max_bytes)
+
+def evict_results(cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, suffixes=(".npz",)):
+    # Deletes least recently used entries until the cache fits in max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(suffixes):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total -= size
+
+def cached_call(kind, compute, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, cacheable=None, **inputs):
+    # compute() returns a dict as accepted by pack_arrays; it only runs on a cache miss.
+    # cache_dir=None disables the on-disk cache; cacheable(values) returning False keeps a result out of it.
+    if cache_dir is None:
+        return compute()
+    key = cache_key(kind, **inputs)
+    values = load_result(key, cache_dir)
+    if values is None:
+        values = compute()
+        if cacheable is None or cacheable(values):
+            store_result(key, values, cache_dir, max_bytes)
+    return values
+
+def find_results(kind, cache_dir=RESULT_CACHE_DIR, fields=None, accept=None, accept_fields=()):
+    # (key, values) of the stored results of one kind, most recently used first, reading only the named
+    # fields; unlike load_result it leaves the LRU order alone. accept(values of accept_fields) returning
+    # False skips an entry before the other fields are read.
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return
+
+    def read(data, names):
+        return unpack_arrays({field: data[field] for field in data.files if names is None or field.split(".")[0] in names})
+
+    names = [name for name in os.listdir(cache_dir) if name.startswith(f"{kind}_") and name.endswith(".npz")]
+    for name in sorted(names, key=lambda name: -os.path.getmtime(os.path.join(cache_dir, name))):
+        try:
+            with np.load(os.path.join(cache_dir, name), allow_pickle=False) as data:
+                if accept is not None and not accept(read(data, accept_fields)):
+                    continue
+                values = read(data, fields)
+        except (OSError, ValueError):
+            continue
+        yield name[:-len(".npz")], values
+
+def clear_results(cache_dir=RESULT_CACHE_DIR):
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(cache_dir, name))
@@ -0,0 +1,346 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# cli.py
+# Usage: python bheopt/cli.py {simulate,volume,optimize,capacity,sweep,uncertainty} LAYOUT.csv [options]
+#        python bheopt/cli.py benchmark [LAYOUT.csv ...] [--baseline REPORT.json] [options]
+#        python bheopt/cli.py validate [--tolerance K] [options]
+import argparse
+import json
+import os
+import sys
+
+def _add_ground_arguments(parser):
+    ground = parser.add_argument_group("ground properties")
+    ground.add_argument("--lamda", type=float, default=2.5, help="thermal conductivity (W/m·K)")
+    ground.add_argument("--rho-c", type=float, default=2.5, help="volumetric heat capacity (MJ/m^3/K)")
+    ground.add_argument("--u-gw", type=float, default=1e-7, help="groundwater seepage velocity (m/s)")
+    ground.add_argument("--theta-gw", type=float, default=30, help="groundwater flow direction (°)")
+
+def _add_model_arguments(parser):
+    _add_ground_arguments(parser)
+    model = parser.add_argument_group("evaluation")
+    model.add_argument("--point-density", type=int, default=2, help="grid points per closest BHE spacing")
+    model.add_argument("--quadrature", choices=["trapz", "gauss", "adaptive", "table", "exact"], default="trapz")
+    model.add_argument("--quad-order", type=int, default=8)
+    model.add_argument("--influence-radius", type=float, default=None, help="neighbor cutoff r_virtual (m); every BHE sees all others if omitted")
+    model.add_argument("--cache-dir", default=None, help="on-disk result cache directory (disabled if omitted)")
+
+def _add_optimization_arguments(parser):
+    opt = parser.add_argument_group("optimization")
+    opt.add_argument("--lim-env", type=float, default=6.0, help="max impact to environment (°C)")
+    opt.add_argument("--lim-neigh", type=float, default=1.5, help="max impact from neighbors (°C)")
+    opt.add_argument("--low-lim", type=float, default=5, help="lower load bound (W/m)")
+    opt.add_argument("--up-lim", type=float, default=50, help="upper load bound (W/m)")
+    opt.add_argument("--maxiter", type=int, default=50)
+    opt.add_argument("--ftol", type=float, default=0.1)
+    opt.add_argument("--method", choices=["SLSQP", "lp"], default="SLSQP")
+    opt.add_argument("--constraint-mode", choices=["max", "vector", "ks"], default="max")
+    opt.add_argument("--ks-rho", type=float, default=50.0)
+    opt.add_argument("--operator-format", choices=["dense", "sparse"], default="dense")
+    opt.add_argument("--depth-search", choices=["grid", "continuous"], default="grid", help="max ΔT at the sampled depths or between them")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bheopt", description="BHEOpt batch runs without the GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    simulate = commands.add_parser("simulate", help="ΔT map and per-BHE ΔT for the loads in the layout file")
+    simulate.add_argument("layout", help="BHE layout CSV (x/y or latitude/longitude, optional H and q0)")
+    simulate.add_argument("--obs-z", type=float, default=30, help="section depth (m)")
+    simulate.add_argument("--engine", choices=["vectorized", "sparse", "adaptive", "tree", "fft", "direct"], default="vectorized",
+                          help="grid engine; fft is within about 1e-3 K of vectorized at the grid densities of the examples")
+    simulate.add_argument("--tree-tol", type=float, default=0.01, help="error tolerance (K) of the tree engine")
+    simulate.add_argument("--out", required=True, help="output prefix: writes PREFIX.npz, PREFIX_bhe.csv and PREFIX.json")
+    _add_model_arguments(simulate)
+
+    volume = commands.add_parser("volume", help="ΔT on an (x, y, z) block for the loads in the layout file")
+    volume.add_argument("layout")
+    volume.add_argument("--z-min", type=float, default=10, help="top depth (m)")
+    volume.add_argument("--z-max", type=float, default=70, help="bottom depth (m)")
+    volume.add_argument("--z-step", type=float, default=5, help="depth step (m)")
+    volume.add_argument("--out", required=True, help="output prefix: writes PREFIX.npy (n_z, n_y, n_x), PREFIX_axes.npz and PREFIX.json")
+    _add_model_arguments(volume)
+
+    optimize = commands.add_parser("optimize", help="maximize the total heat load under the ΔT limits")
+    optimize.add_argument("layout")
+    optimize.add_argument("--out", required=True, help="output prefix: writes PREFIX.npz, PREFIX_bhe.csv and PREFIX.json")
+    _add_model_arguments(optimize)
+    _add_optimization_arguments(optimize)
+
+    capacity = commands.add_parser("capacity", help="optimized total load over a range of ΔT limits (continuation)")
+    capacity.add_argument("layout")
+    capacity.add_argument("--env-values", required=True, metavar="V1,V2,...", help="lim_env values (°C), traced in the given order")
+    capacity.add_argument("--neigh-values", default=None, metavar="V1,V2,...",
+                          help="lim_neigh values (°C), one per lim_env value (default: --lim-neigh at every point)")
+    capacity.add_argument("--out", required=True, help="output prefix: writes PREFIX.csv, PREFIX.npz (loads per point) and PREFIX.json")
+    _add_model_arguments(capacity)
+    _add_optimization_arguments(capacity)
+
+    sweep = commands.add_parser("sweep", help="ΔT and optimized load for every combination of parameter values")
+    sweep.add_argument("layout")
+    sweep.add_argument("--vary", action="append", required=True, metavar="NAME=V1,V2,...",
+                       help="values of u_gw, theta_gw, lamda, rho_c, lim_env, lim_neigh, low_lim or up_lim; repeat to combine")
+    sweep.add_argument("--no-optimize", action="store_true", help="only evaluate the loads of the layout file")
+    sweep.add_argument("--n-jobs", type=int, default=-1, help="parallel scenario workers")
+    sweep.add_argument("--out", required=True, help="output prefix: writes PREFIX.csv and PREFIX.json")
+    _add_model_arguments(sweep)
+    _add_optimization_arguments(sweep)
+
+    uncertainty = commands.add_parser("uncertainty", help="percentiles and exceedance probabilities of ΔT under uncertain ground properties")
+    uncertainty.add_argument("layout")
+    uncertainty.add_argument("--dist", action="append", required=True, metavar="NAME=KIND:ARGS",
+                             help="distribution of u_gw, theta_gw, lamda or rho_c, e.g. lamda=normal:2.5,0.3 or theta_gw=uniform:0,90; repeat per parameter")
+    uncertainty.add_argument("--samples", type=int, default=1000, help="number of realizations")
+    uncertainty.add_argument("--sampling", choices=["lhs", "mc"], default="lhs", help="Latin hypercube or plain Monte Carlo")
+    uncertainty.add_argument("--seed", type=int, default=0)
+    uncertainty.add_argument("--lim-env", type=float, default=6.0, help="max impact to environment (°C)")
+    uncertainty.add_argument("--lim-neigh", type=float, default=1.5, help="max impact from neighbors (°C)")
+    uncertainty.add_argument("--field-depth", type=float, default=None,
+                             help="also write percentile maps of ΔT at this depth (m) on the heatmap grid to PREFIX_field.npz")
+    uncertainty.add_argument("--out", required=True, help="output prefix: writes PREFIX.npz, PREFIX_bhe.csv and PREFIX.json")
+    _add_model_arguments(uncertainty)
+
+    benchmark = commands.add_parser("benchmark", help="wall time, peak memory and kernel evaluations over layouts and grid densities")
+    benchmark.add_argument("layouts", nargs="*", help="BHE layout CSVs (default: examples/sensitivity_case)")
+    benchmark.add_argument("--densities", default="1,2,4", help="grid points per closest BHE spacing, comma-separated")
+    benchmark.add_argument("--engines", default="vectorized", help="grid engines, comma-separated")
+    benchmark.add_argument("--methods", default="lp,SLSQP", help="optimizer methods, comma-separated")
+    benchmark.add_argument("--repeat", type=int, default=3, help="timed runs per case (the best is kept)")
+    benchmark.add_argument("--quadrature", choices=["trapz", "gauss", "adaptive", "table", "exact"], default="trapz")
+    benchmark.add_argument("--quad-order", type=int, default=8)
+    benchmark.add_argument("--influence-radius", type=float, default=None, help="neighbor cutoff r_virtual (m); every BHE sees all others if omitted")
+    benchmark.add_argument("--baseline", default=None, help="earlier report to compare against")
+    benchmark.add_argument("--ratio", type=float, default=None, help="wall time ratio to the baseline flagged as a regression")
+    benchmark.add_argument("--out", required=True, help="output prefix: writes PREFIX.json (cases and scaling exponents) and, with --baseline, PREFIX_compare.csv")
+    _add_ground_arguments(benchmark)
+
+    validate = commands.add_parser("validate", help="error against the COMSOL fields of examples/validation_case and runtime per model option")
+    validate.add_argument("--options", default=None, help="option labels of validation.VALIDATION_OPTIONS, comma-separated (default: all)")
+    validate.add_argument("--tolerance", type=float, default=0.1, help="accepted error (K) for choosing the fastest option")
+    validate.add_argument("--norm", choices=["max_abs", "rms", "mean_abs", "p99_abs"], default="rms")
+    validate.add_argument("--repeat", type=int, default=1, help="timed runs per option (the best is kept)")
+    validate.add_argument("--out", required=True, help="output prefix: writes PREFIX.csv and PREFIX.json")
+    return parser
+
+def _model_options(args):
+    return dict(quadrature=args.quadrature, quad_order=args.quad_order, influence_radius=args.influence_radius, cache_dir=args.cache_dir)
+
+def _optimization_options(args):
+    return dict(lim_env=args.lim_env, lim_neigh=args.lim_neigh, low_lim=args.low_lim, up_lim=args.up_lim, point_density=args.point_density,
+                maxiter=args.maxiter, ftol=args.ftol, method=args.method, constraint_mode=args.constraint_mode, ks_rho=args.ks_rho,
+                operator_format=args.operator_format, depth_search=args.depth_search)
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+def _prepare_output(prefix):
+    folder = os.path.dirname(prefix)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+def run_simulate(args):
+    import numpy as np
+    from api import read_layout, hydro_parameters, simulate
+
+    layout = read_layout(args.layout)
+    hydro = hydro_parameters(args.lamda, args.rho_c, args.u_gw, args.theta_gw)
+    fields = simulate(layout[['x', 'y']].values, layout['H'].values, layout['q_l'].values, **hydro, obs_z=args.obs_z,
+                      point_density=args.point_density, engine=args.engine, tree_tol=args.tree_tol, **_model_options(args))
+
+    _prepare_output(args.out)
+    np.savez_compressed(f"{args.out}.npz", grid_x=fields["grid_x"], grid_y=fields["grid_y"], temp_map=fields["temp_map"],
+                        t_total=fields["t_total"], t_neigh=fields["t_neigh"])
+    layout.assign(t_total=fields["t_total"], t_neigh=fields["t_neigh"]).to_csv(f"{args.out}_bhe.csv", index_label="id")
+    _write_json(f"{args.out}.json", fields["summary"])
+    return fields["summary"]
+
+def run_volume(args):
+    import numpy as np
+    from api import read_layout, hydro_parameters
+    from volume import volume_depths, write_temperature_volume
+
+    try:
+        z_values = volume_depths(args.z_min, args.z_max, args.z_step)
+    except ValueError as error:
+        raise SystemExit(f"bheopt volume: {error}")
+    layout = read_layout(args.layout)
+    hydro = hydro_parameters(args.lamda, args.rho_c, args.u_gw, args.theta_gw)
+    _prepare_output(args.out)
+    volume = write_temperature_volume(f"{args.out}.npy", layout[['x', 'y']].values, layout['H'].values, layout['q_l'].values,
+                                      z_values, **hydro, point_density=args.point_density,
+                                      quadrature=args.quadrature, quad_order=args.quad_order, influence_radius=args.influence_radius)
+    peak = np.max(volume["volume"], axis=(1, 2))
+    summary = {
+        "shape": list(volume["volume"].shape),
+        "z": volume["z"].tolist(),
+        "max_grid_T_per_depth": peak.tolist(),
+        "max_grid_T": float(peak.max()),
+        "z_of_max": float(volume["z"][np.argmax(peak)])
+    }
+    _write_json(f"{args.out}.json", summary)
+    return summary
+
+def run_optimize(args):
+    import numpy as np
+    from api import read_layout, hydro_parameters, optimize_layout, optimization_summary
+
+    layout = read_layout(args.layout)
+    hydro = hydro_parameters(args.lamda, args.rho_c, args.u_gw, args.theta_gw)
+    options = _optimization_options(args)
+    result, logs = optimize_layout(layout[['x', 'y']].values, layout['H'].values, **hydro, **options, **_model_options(args),
+                                   callback_logger=lambda msg: print(msg, file=sys.stderr))
+
+    summary = optimization_summary(result, args.lim_env, args.lim_neigh)
+    _prepare_output(args.out)
+    np.savez_compressed(f"{args.out}.npz", q_initial=layout['q_l'].values, q_opt=result.x)
+    layout.assign(q_opt=result.x).to_csv(f"{args.out}_bhe.csv", index_label="id")
+    _write_json(f"{args.out}.json", {**summary, "options": options, "logs": logs})
+    return summary
+
+def run_capacity(args):
+    import numpy as np
+    import pandas as pd
+    from api import read_layout, hydro_parameters, capacity_curve, optimization_summary
+
+    layout = read_layout(args.layout)
+    hydro = hydro_parameters(args.lamda, args.rho_c, args.u_gw, args.theta_gw)
+    env_values = [float(v) for v in args.env_values.split(",")]
+    neigh_values = [float(v) for v in args.neigh_values.split(",")] if args.neigh_values else [args.lim_neigh] * len(env_values)
+    if len(neigh_values) != len(env_values):
+        raise SystemExit("bheopt capacity: --neigh-values needs one value per --env-values value")
+    options = _optimization_options(args)
+    for name in ("lim_env", "lim_neigh"):
+        del options[name]
+    results = capacity_curve(layout[['x', 'y']].values, layout['H'].values, **hydro, limits=list(zip(env_values, neigh_values)), **options,
+                             **_model_options(args), callback_logger=lambda msg: print(msg, file=sys.stderr))
+
+    rows = [optimization_summary(result, lim_env, lim_neigh) for result, lim_env, lim_neigh in zip(results, env_values, neigh_values)]
+    _prepare_output(args.out)
+    pd.DataFrame(rows).to_csv(f"{args.out}.csv", index=False)
+    np.savez_compressed(f"{args.out}.npz", lim_env=env_values, lim_neigh=neigh_values, q_opt=np.array([result.x for result in results]))
+    _write_json(f"{args.out}.json", rows)
+    return rows
+
+def _parse_vary(items):
+    # ["u_gw=1e-7,2e-7", "theta_gw=0,90"] -> {"u_gw": [1e-7, 2e-7], "theta_gw": [0.0, 90.0]}
+    values = {}
+    for item in items:
+        name, _, listed = item.partition("=")
+        if not listed:
+            raise SystemExit(f"bheopt sweep: expected NAME=V1,V2,... but got {item!r}")
+        values[name.strip()] = [float(v) for v in listed.split(",")]
+    return values
+
+def run_sweep(args):
+    from api import read_layout
+    from sweep import scenario_grid, run_sweep as sweep_scenarios
+
+    layout = read_layout(args.layout)
+    ground = {"u_gw": args.u_gw, "theta_gw": args.theta_gw, "lamda": args.lamda, "rho_c": args.rho_c}
+    scenarios = scenario_grid(**{**{name: [value] for name, value in ground.items()}, **_parse_vary(args.vary)})
+    options = _optimization_options(args)
+    del options["operator_format"]  # the sweep always uses sparse operators
+    del options["depth_search"]
+    table = sweep_scenarios(layout[['x', 'y']].values, layout['H'].values, layout['q_l'].values, scenarios, optimize=not args.no_optimize,
+                            influence_radius=args.influence_radius, quadrature=args.quadrature, quad_order=args.quad_order, n_jobs=args.n_jobs, **options)
+
+    _prepare_output(args.out)
+    table.to_csv(f"{args.out}.csv", index=False)
+    rows = table.to_dict(orient="records")
+    _write_json(f"{args.out}.json", rows)
+    return rows
+
+def run_uncertainty(args):
+    import numpy as np
+    from api import read_layout
+    from uncertainty import parse_distribution, sample_parameters, propagate_uncertainty, propagate_field_uncertainty, uncertainty_table
+
+    layout = read_layout(args.layout)
+    distributions = {}
+    for item in args.dist:
+        name, _, spec = item.partition("=")
+        if not spec:
+            raise SystemExit(f"bheopt uncertainty: expected NAME=KIND:ARGS but got {item!r}")
+        distributions[name.strip()] = parse_distribution(spec.strip())
+    fixed = {"u_gw": args.u_gw, "theta_gw": args.theta_gw, "lamda": args.lamda, "rho_c": args.rho_c}
+    try:
+        samples = sample_parameters(distributions, args.samples, method=args.sampling, seed=args.seed, fixed=fixed)
+    except ValueError as error:
+        raise SystemExit(f"bheopt uncertainty: {error}")
+    result = propagate_uncertainty(layout[['x', 'y']].values, layout['H'].values, layout['q_l'].values, samples, args.lim_env, args.lim_neigh,
+                                   point_density=args.point_density, influence_radius=args.influence_radius, quadrature=args.quadrature, quad_order=args.quad_order)
+
+    summary = {
+        "samples": args.samples,
+        "sampling": args.sampling,
+        "distributions": dict(item.partition("=")[::2] for item in args.dist),
+        "p_any_exceedance": result["p_any_exceedance"],
+        "max_p_exceed_env": float(np.max(result["p_exceed_env"])),
+        "max_p_exceed_neigh": float(np.max(result["p_exceed_neigh"])),
+        "lim_env": args.lim_env,
+        "lim_neigh": args.lim_neigh
+    }
+    _prepare_output(args.out)
+    np.savez_compressed(f"{args.out}.npz", max_env=result["max_env"], max_neigh=result["max_neigh"],
+                        **{f"sample_{name}": samples[name].values for name in samples.columns})
+    layout.join(uncertainty_table(result).drop(columns="bhe")).to_csv(f"{args.out}_bhe.csv", index_label="id")
+    if args.field_depth is not None:
+        field = propagate_field_uncertainty(layout[['x', 'y']].values, layout['H'].values, layout['q_l'].values, samples, obs_z=args.field_depth,
+                                            point_density=args.point_density, quadrature=args.quadrature, quad_order=args.quad_order)
+        np.savez_compressed(f"{args.out}_field.npz", **field)
+    _write_json(f"{args.out}.json", summary)
+    return summary
+
+def run_benchmark(args):
+    from api import hydro_parameters
+    from benchmark import REGRESSION_RATIO, run_benchmark, write_report, read_report, compare_reports, scaling_table
+
+    report = run_benchmark(args.layouts or None, point_densities=tuple(int(v) for v in args.densities.split(",")), engines=tuple(args.engines.split(",")),
+                           methods=tuple(args.methods.split(",")), repeat=args.repeat, hydro=hydro_parameters(args.lamda, args.rho_c, args.u_gw, args.theta_gw),
+                           quadrature=args.quadrature, quad_order=args.quad_order, influence_radius=args.influence_radius)
+    report["scaling"] = scaling_table(report).to_dict(orient="records")
+    _prepare_output(args.out)
+    write_report(f"{args.out}.json", report)
+    summary = {"cases": len(report["cases"]), "total_wall_time": sum(case["wall_time"] for case in report["cases"]), "scaling": report["scaling"]}
+    if args.baseline:
+        comparison = compare_reports(report, read_report(args.baseline), args.ratio or REGRESSION_RATIO)
+        comparison.to_csv(f"{args.out}_compare.csv", index=False)
+        summary["compared"] = len(comparison)
+        summary["regressions"] = comparison[comparison["regression"]][["case", "layout", "point_density", "option", "time_ratio"]].to_dict(orient="records")
+    return summary
+
+def run_validate(args):
+    from validation import VALIDATION_OPTIONS, run_validation, fastest_within
+
+    labels = args.options.split(",") if args.options else list(VALIDATION_OPTIONS)
+    unknown = set(labels) - set(VALIDATION_OPTIONS)
+    if unknown:
+        raise SystemExit(f"bheopt validate: unknown options {sorted(unknown)}, choose from {list(VALIDATION_OPTIONS)}")
+    table = run_validation({label: VALIDATION_OPTIONS[label] for label in labels}, repeat=args.repeat)
+    passing = fastest_within(table, args.tolerance, args.norm)
+
+    _prepare_output(args.out)
+    table.to_csv(f"{args.out}.csv", index=False)
+    summary = {
+        "tolerance": args.tolerance,
+        "norm": args.norm,
+        "fastest_within_tolerance": passing.index[0] if len(passing) else None,
+        "within_tolerance": passing.reset_index().to_dict(orient="records")
+    }
+    _write_json(f"{args.out}.json", summary)
+    return summary
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    summary = {"simulate": run_simulate, "volume": run_volume, "optimize": run_optimize, "capacity": run_capacity, "sweep": run_sweep, "uncertainty": run_uncertainty,
+               "benchmark": run_benchmark, "validate": run_validate}[args.command](args)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    # a benchmark run that regressed against its baseline fails, so it can gate CI
+    return 1 if isinstance(summary, dict) and summary.get("regressions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
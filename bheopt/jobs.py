@@ -0,0 +1,59 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# jobs.py
+# Long computations (the GUI's optimization) in a background thread. The function gets the job's
+# callback_logger, progress and cancel_event; the caller polls the returned handle.
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from profiling import profile_run
+
+def start_job(function, *args, profile=False, **kwargs):
+    # profile=True records the job's stages in its own recording, job["recording"] (see profiling.py)
+    job = {"messages": queue.Queue(), "progress": None, "cancel": threading.Event(), "done": threading.Event(), "result": None, "error": None,
+           "started": time.time(), "recording": None}
+
+    def report(state):
+        job["progress"] = state
+
+    def run():
+        try:
+            with profile_run() if profile else nullcontext() as recording:
+                job["recording"] = recording
+                job["result"] = function(*args, callback_logger=job["messages"].put, progress=report, cancel_event=job["cancel"], **kwargs)
+        except Exception as error:
+            job["error"] = error
+        finally:
+            job["done"].set()
+
+    job["thread"] = threading.Thread(target=run, name="bheopt-job", daemon=True)
+    job["thread"].start()
+    return job
+
+def job_running(job):
+    return not job["done"].is_set()
+
+def cancel_job(job):
+    # The function stops at its next check of cancel_event
+    job["cancel"].set()
+
+def drain_messages(job):
+    # Log messages since the last call
+    messages = []
+    while True:
+        try:
+            messages.append(job["messages"].get_nowait())
+        except queue.Empty:
+            return messages
+
+def wait_job(job, timeout=None):
+    # The function's return value; re-raises its exception. None while it is still running after timeout.
+    job["done"].wait(timeout)
+    if job["error"] is not None:
+        raise job["error"]
+    return job["result"]
@@ -5,63 +5,121 @@ Created on Wed Feb 11 10:21:54 2026
 """
 
 # main_refactor.py
-import streamlit as st
+# The plotting modules (Streamlit, Plotly) are imported by the plot functions only, so that the field cache
+# and run_optimization also work headless
+import numpy as np
 from utils import find_closest_pair, create_extended_grid, assign_sources_to_nearest_nodes
-from borehole_model import precompute_integrals
-from visualization import plot_temperature_heatmap
-from optimization import optimize_heat_load
+from borehole_model import LINEAR_ENGINES, precompute_integrals, compute_temperature_grid, update_temperature_grid
+from api import optimize_layout
+from volume import volume_slice
+from cache import RESULT_CACHE_DIR, cached_call
 
-def plot_initial_heatmap(sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, R_w, point_density, lim_env, lim_neigh):
-    (_, _), min_dist = find_closest_pair(sources)
-    grid_spacing = min_dist / point_density
-    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, grid_spacing)
-    source_cell_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
-    integrals = precompute_integrals([obs_z], H_array, R_w=grid_spacing)
-    summary = plot_temperature_heatmap(
-        grid_x, grid_y,
-        sources=sources,
-        H_array=H_array,
-        heat_rates=heat_rates,
-        obs_z=obs_z, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, 
-        integrals=integrals,
-        node_map=source_cell_map,
-        lim_env=lim_env, lim_neigh=lim_neigh,
-        title_suffix="(Initial Load)"
-    )
+# Last field per plot ("initial" / "optimized") with its grid signature and loads; a new load set
+# on the same grid only adds the field of the loads that changed (the field is linear in q for the
+# LINEAR_ENGINES; the adaptive and tree engines are always recomputed)
+_FIELD_CACHE = {}
 
-    summary["min_q"] = float(min(heat_rates))
-    summary["max_q"] = float(max(heat_rates))
-    return summary
+def _field_signature(sources, H_array, obs_z, V_T, ANGLE, A, LAMDA, spacing, engine, quadrature, quad_order, influence_radius):
+    return (np.asarray(sources, dtype=float).tobytes(), np.asarray(H_array, dtype=float).tobytes(), obs_z, V_T, ANGLE, A, LAMDA, spacing,
+            engine, quadrature, quad_order, influence_radius)
+
+def _full_temperature_grid(signature, heat_rates, _grid_x, _grid_y, _sources, _H_array, obs_z, V_T, ANGLE, A, LAMDA, _integrals, _node_map, grid_options, cache_dir):
+    return cached_call("temperature_grid", lambda: {"temp_map": compute_temperature_grid(_grid_x, _grid_y, _sources, _H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA,
+                                                                                         _integrals, _node_map, **grid_options)},
+                       cache_dir=cache_dir, signature=signature, heat_rates=heat_rates)["temp_map"]
+
+full_temperature_grid = _full_temperature_grid
 
-def plot_optimized_heatmap(sources, optimized_q_l, H_array, obs_z, V_T, ANGLE, A, LAMDA, R_w, point_density, lim_env, lim_neigh):
+def memoize_full_fields(decorator):
+    # Puts an in-memory cache in front of the on-disk one for full fields (the GUI passes st.cache_data, which
+    # keeps its entries when a rerun wraps the function again). The signature covers everything the
+    # underscored arguments are derived from, so those need no hashing.
+    global full_temperature_grid
+    full_temperature_grid = decorator(_full_temperature_grid)
+    return full_temperature_grid
+
+def cached_temperature_grid(label, grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, spacing, engine="vectorized", quadrature="trapz", quad_order=8, influence_radius=None, cache_dir=RESULT_CACHE_DIR):
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    signature = _field_signature(sources, H_array, obs_z, V_T, ANGLE, A, LAMDA, spacing, engine, quadrature, quad_order, influence_radius)
+    grid_options = dict(engine=engine, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius)
+
+    # Start from the cached field on the same grid whose loads differ in the fewest BHEs
+    same_grid = [entry for entry in _FIELD_CACHE.values() if entry["signature"] == signature] if engine in LINEAR_ENGINES else []
+    if same_grid:
+        base = min(same_grid, key=lambda entry: np.count_nonzero(entry["heat_rates"] != heat_rates))
+        temp_map = update_temperature_grid(base["temp_map"], grid_x, grid_y, sources, H_array, base["heat_rates"], heat_rates, obs_z, V_T, ANGLE, A, LAMDA,
+                                           integrals, node_map, **grid_options)
+    else:
+        temp_map = full_temperature_grid(signature, heat_rates, grid_x, grid_y, sources, H_array, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map,
+                                         grid_options, cache_dir)
+
+    _FIELD_CACHE[label] = {"signature": signature, "heat_rates": heat_rates.copy(), "temp_map": temp_map, "grid": (grid_x, grid_y)}
+    return temp_map
+
+def _plot_load_heatmap(label, title_suffix, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, point_density, lim_env, lim_neigh, engine, quadrature, quad_order, influence_radius):
+    from visualization import plot_temperature_heatmap
     (_, _), min_dist = find_closest_pair(sources)
     spacing = min_dist / point_density
     grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
     cell_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
     integrals = precompute_integrals([obs_z], H_array, R_w=spacing)
+    temp_map = cached_temperature_grid(label, grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, cell_map, spacing,
+                                       engine=engine, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius)
     summary = plot_temperature_heatmap(
         grid_x, grid_y,
         sources=sources,
         H_array=H_array,
-        heat_rates=optimized_q_l,
+        heat_rates=heat_rates,
         obs_z=obs_z, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, 
         integrals=integrals,
         node_map=cell_map,
         lim_env=lim_env, lim_neigh=lim_neigh,
-        title_suffix="(After Optimization)"
+        title_suffix=title_suffix,
+        engine=engine, quadrature=quadrature, quad_order=quad_order,
+        influence_radius=influence_radius,
+        temp_map=temp_map
     )
 
-    summary["min_q"] = float(min(optimized_q_l))
-    summary["max_q"] = float(max(optimized_q_l))
+    summary["min_q"] = float(min(heat_rates))
+    summary["max_q"] = float(max(heat_rates))
     return summary
 
-def run_optimization(sources, H_array, V_T, ANGLE, A, LAMDA, point_density, maxiter, ftol, eps, lim_env, lim_neigh, low_lim, up_lim):
-    logs = []
-    (_, _), min_dist = find_closest_pair(sources)
-    spacing = min_dist / point_density
+def plot_initial_heatmap(sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, R_w, point_density, lim_env, lim_neigh, engine="vectorized", quadrature="trapz", quad_order=8, influence_radius=None):
+    return _plot_load_heatmap("initial", "(Initial Load)", sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, point_density, lim_env, lim_neigh,
+                              engine, quadrature, quad_order, influence_radius)
+
+def plot_optimized_heatmap(sources, optimized_q_l, H_array, obs_z, V_T, ANGLE, A, LAMDA, R_w, point_density, lim_env, lim_neigh, engine="vectorized", quadrature="trapz", quad_order=8, influence_radius=None):
+    return _plot_load_heatmap("optimized", "(After Optimization)", sources, H_array, optimized_q_l, obs_z, V_T, ANGLE, A, LAMDA, point_density, lim_env, lim_neigh,
+                              engine, quadrature, quad_order, influence_radius)
+
+def plot_change_heatmap(sources, obs_z):
+    # Optimized minus initial field, from the two cached fields; None until both exist on the same grid
+    from visualization import plot_difference_heatmap
+    initial, optimized = _FIELD_CACHE.get("initial"), _FIELD_CACHE.get("optimized")
+    if initial is None or optimized is None or initial["signature"] != optimized["signature"]:
+        return None
+    if initial["signature"][0] != np.asarray(sources, dtype=float).tobytes() or initial["signature"][2] != obs_z:
+        return None
+    grid_x, grid_y = optimized["grid"]
+    return plot_difference_heatmap(grid_x, grid_y, np.asarray(sources, dtype=float), optimized["temp_map"] - initial["temp_map"], obs_z,
+                                   title_suffix="(Optimized − Initial)")
 
-    def logger(msg):
-        logs.append(msg)
-    result = optimize_heat_load(sources, H_array, callback_logger=logger, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, R_w=spacing, maxiter=maxiter, ftol=ftol, eps=eps, lim_env=lim_env, lim_neigh=lim_neigh, low_lim=low_lim, up_lim=up_lim)
-    return result, logs
+def plot_volume_slice(volume, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, lim_env, lim_neigh, title_suffix="", quadrature="trapz", quad_order=8, influence_radius=None):
+    # Slice of a stored ΔT volume (see volume.py); only the BHE markers are evaluated at obs_z
+    from visualization import plot_temperature_heatmap
+    grid_x, grid_y = np.meshgrid(volume["x"], volume["y"])
+    integrals = precompute_integrals([obs_z], H_array, R_w=volume["spacing"])
+    summary = plot_temperature_heatmap(grid_x, grid_y, sources=np.asarray(sources, dtype=float), H_array=np.asarray(H_array, dtype=float), heat_rates=np.asarray(heat_rates, dtype=float),
+                                       obs_z=obs_z, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, integrals=integrals, node_map={}, lim_env=lim_env, lim_neigh=lim_neigh,
+                                       title_suffix=title_suffix, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius,
+                                       temp_map=volume_slice(volume, obs_z))
+    summary["min_q"] = float(min(heat_rates))
+    summary["max_q"] = float(max(heat_rates))
+    return summary
 
+def run_optimization(sources, H_array, V_T, ANGLE, A, LAMDA, point_density, maxiter, ftol, lim_env, lim_neigh, low_lim, up_lim, method='SLSQP', constraint_mode='max', ks_rho=50.0, quadrature='trapz', quad_order=8, influence_radius=None, operator_format='dense', depth_search='grid', cache_dir=RESULT_CACHE_DIR, callback_logger=None, progress=None, cancel_event=None, operator=None):
+    # The GUI keeps the iteration log on the console as well
+    return optimize_layout(sources, H_array, V_T, ANGLE, A, LAMDA, lim_env, lim_neigh, low_lim, up_lim, point_density=point_density, maxiter=maxiter, ftol=ftol,
+                           method=method, constraint_mode=constraint_mode, ks_rho=ks_rho, quadrature=quadrature, quad_order=quad_order,
+                           influence_radius=influence_radius, operator_format=operator_format, depth_search=depth_search, cache_dir=cache_dir,
+                           callback_logger=callback_logger, progress=progress, cancel_event=cancel_event, operator=operator, verbose=True)
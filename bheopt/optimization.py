@@ -6,87 +6,562 @@ Created on Wed Feb 11 10:21:54 2026
 
 # optimization.py
 import numpy as np
-from scipy.optimize import minimize
-from joblib import Parallel, delayed
-from borehole_model import compute_self_Tchange, compute_neighbor_Tchange, precompute_integrals
+from scipy.optimize import minimize, linprog, OptimizeResult
+from scipy import sparse
+from scipy.spatial import cKDTree
+from worker_pool import get_worker_pool, n_workers_for, share_array, attach_array, release_arrays, split_blocks
+from borehole_model import compute_self_Tchange, compute_neighbor_Tchange, compute_neighbor_response, compute_pair_responses, build_response_matrix, precompute_integrals, \
+    advection_factor, compute_line_integrals_at, self_integrals_at
+from profiling import timed, timer, count
 
-def compute_max_BHE_Tchange(i, locations, heat_rates, z_values, integrals, H_array, V_T, ANGLE, A, LAMDA):
+def build_neighbor_lists(locations, influence_radius=None, tree=None):
+    # Indices of the other BHEs within influence_radius of each BHE, from a KD-tree built once per layout
+    locations = np.asarray(locations, dtype=float)
+    if influence_radius is None:
+        return [np.delete(np.arange(len(locations)), i) for i in range(len(locations))]
+    tree = cKDTree(locations) if tree is None else tree
+    lists = tree.query_ball_point(locations, r=influence_radius)
+    return [np.array(sorted(set(l) - {i}), dtype=int) for i, l in enumerate(lists)]
+
+def compute_max_BHE_Tchange(i, locations, heat_rates, z_values, integrals, H_array, V_T, ANGLE, A, LAMDA, influence_radius=None, neighbors=None):
+    locations = np.asarray(locations, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
     x, y = locations[i]
-    mask = np.arange(len(locations)) != i
-    sources = locations[mask]
-    neighbor_rates = heat_rates[mask]
     self_rate = heat_rates[i]
 
-    dx = np.abs(sources[:, 0] - x)
-    dy = np.abs(sources[:, 1] - y)
-    close = (dx <= 500) & (dy <= 500)
-    sources = sources[close]
-    neighbor_rates = neighbor_rates[close]
+    if neighbors is None:
+        dist_sq = (locations[:, 0] - x)**2 + (locations[:, 1] - y)**2
+        close = np.ones(len(locations), dtype=bool) if influence_radius is None else dist_sq <= influence_radius**2
+        close[i] = False
+        neighbors = np.flatnonzero(close)
 
-    t_neigh = compute_neighbor_Tchange(x, y, z_values, sources, H_array[mask], neighbor_rates, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,)
+    t_neigh = compute_neighbor_Tchange(x, y, z_values, locations[neighbors], H_array[neighbors], heat_rates[neighbors], V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,)
     t_self = compute_self_Tchange(z_values, self_rate, integrals[i], LAMDA)
     return np.max(t_neigh), np.max(t_neigh + t_self.T)
 
-def optimize_heat_load(locations, H_array, callback_logger, V_T, ANGLE, A, LAMDA, R_w, maxiter, ftol, eps, lim_env, lim_neigh, low_lim, up_lim, initial_q=None, obs_z_range=(10, 70), obs_z_step=10):
+def _influence_rows(targets, neighbors, locations, z_values, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order):
+    # Unit-load responses of the neighbors of each target, shape (len(targets), n_z, n)
+    n = len(locations)
+    rows = np.zeros((len(targets), len(z_values), n))
+    for row, (i, idx) in enumerate(zip(targets, neighbors)):
+        x, y = locations[i]
+        if len(idx):
+            rows[row][:, idx] = compute_neighbor_response(x, y, z_values, locations[idx], H_array[idx], V_T, ANGLE, A, LAMDA, quadrature, quad_order).T
+    return rows
+
+def _influence_block_shared(block, neighbors, specs, z_values, V_T, ANGLE, A, LAMDA, quadrature, quad_order):
+    # Pool task: geometry is read from and the rows written to shared memory, so only indices travel
+    blocks, (locations, H_array, neigh) = zip(*[attach_array(spec) for spec in specs])
+    try:
+        neigh[block] = _influence_rows(block, neighbors, locations, z_values, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order)
+    finally:
+        del locations, H_array, neigh
+        for shm in blocks:
+            shm.close()
+
+@timed("influence_operator")
+def build_influence_operator(locations, H_array, z_values, integrals, V_T, ANGLE, A, LAMDA, n_jobs=-1, quadrature="trapz", quad_order=8, influence_radius=None):
+    # Geometry-only linear operator: ΔT_neigh[i, k] = neigh[i, k, :] @ q and ΔT_self[i, k] = self[i, k] * q[i]
+    locations = np.asarray(locations, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    n, n_z = len(locations), len(z_values)
+    neighbors = build_neighbor_lists(locations, influence_radius)
+
+    if n_workers_for(n_jobs) == 1:
+        neigh = _influence_rows(np.arange(n), neighbors, locations, z_values, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order)
+    else:
+        # A few contiguous blocks per worker of the persistent pool; the workers fill neigh in place
+        shared = [share_array(locations), share_array(H_array), share_array(np.zeros((n, n_z, n)))]
+        try:
+            specs = [spec for _, spec in shared]
+            with timer("influence_operator.dispatch", workers=n_workers_for(n_jobs)):
+                futures = [get_worker_pool(n_jobs).submit(_influence_block_shared, block, [neighbors[i] for i in block], specs, z_values, V_T, ANGLE, A, LAMDA, quadrature, quad_order)
+                           for block in split_blocks(n, n_jobs, per_worker=4)]
+                for future in futures:
+                    future.result()
+            shm, view = attach_array(specs[2])
+            neigh = view.copy()
+            del view
+            shm.close()
+        finally:
+            release_arrays([shm for shm, _ in shared])
+
+    self_terms = np.array([compute_self_Tchange(z_values, 1.0, integrals[i], LAMDA) for i in range(n)])
+    return {"neigh": neigh, "self": self_terms, "z_values": np.asarray(z_values, dtype=float)}
+
+@timed("influence_operator.sparse")
+def build_sparse_influence_operator(locations, H_array, z_values, integrals, V_T, ANGLE, A, LAMDA, n_jobs=-1, quadrature="trapz", quad_order=8, influence_radius=None, n_error_samples=32, seed=0):
+    # Same operator with neigh stored as a CSR matrix of shape (n_bhe * n_z, n_bhe), row i * n_z + k,
+    # holding only the pairs within influence_radius, so memory grows as O(n * neighbors) instead of O(n^2 * n_z).
+    # truncation[i, k] estimates the ΔT at (i, k) per unit load of every BHE left outside the radius
+    locations = np.asarray(locations, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    z_values = np.asarray(z_values, dtype=float)
+    n = len(locations)
+    self_map = {i: [i] for i in range(n)}
+    neigh = build_response_matrix(locations[:, 0], locations[:, 1], z_values, locations, H_array, V_T, ANGLE, A, LAMDA, self_map=self_map,
+                                  influence_radius=influence_radius, quadrature=quadrature, quad_order=quad_order, n_jobs=n_jobs)
+
+    self_terms = np.array([compute_self_Tchange(z_values, 1.0, integrals[i], LAMDA) for i in range(n)])
+    operator = {"neigh": neigh, "self": self_terms, "z_values": z_values}
+    operator["truncation"] = _truncation_estimate(locations, H_array, z_values, V_T, ANGLE, A, LAMDA, quadrature, quad_order, influence_radius, n_error_samples, seed)
+    return operator
+
+def _truncation_estimate(locations, H_array, z_values, V_T, ANGLE, A, LAMDA, quadrature, quad_order, influence_radius, n_samples, seed):
+    # Monte Carlo estimate of the neglected far-field sum per target: sample other BHEs uniformly,
+    # keep the responses of those beyond the radius and scale by the number of other BHEs
+    n = len(locations)
+    if influence_radius is None or n < 2 or n_samples <= 0:
+        return np.zeros((n, len(z_values)))
+    rng = np.random.default_rng(seed)
+    pt = np.repeat(np.arange(n), n_samples)
+    src = (pt + rng.integers(1, n, size=len(pt))) % n
+    far = np.sum((locations[pt] - locations[src])**2, axis=1) > influence_radius**2
+    resp = np.zeros((len(pt), len(z_values)))
+    if np.any(far):
+        resp[far] = compute_pair_responses(locations[:, 0], locations[:, 1], pt[far], src[far], z_values, locations, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order)
+    return (n - 1) * resp.reshape(n, n_samples, -1).mean(axis=1)
+
+def _neigh_matrix(operator):
+    # neigh as a (n_bhe * n_z, n_bhe) matrix, whether stored dense (n_bhe, n_z, n_bhe) or sparse
+    neigh = operator["neigh"]
+    return neigh if sparse.issparse(neigh) else neigh.reshape(-1, neigh.shape[-1])
+
+def apply_influence_operator(operator, q):
+    # Returns (ΔT_neigh, ΔT_total), both shaped (n_bhe, n_z)
+    q = np.asarray(q, dtype=float)
+    t_neigh = (_neigh_matrix(operator) @ q).reshape(operator["self"].shape)
+    return t_neigh, t_neigh + operator["self"] * q[:, None]
+
+def influence_gradient(operator, i, k, include_self=True):
+    # d ΔT[i, k] / dq, exact since ΔT is linear in q
+    row = _neigh_matrix(operator)[i * operator["self"].shape[1] + k]
+    # a copy: the dense row is a view into the operator, which the self term must not change
+    grad = np.array(row.toarray() if sparse.issparse(row) else row, dtype=float).ravel()
+    if include_self:
+        grad[i] += operator["self"][i, k]
+    return grad
+
+def influence_constraint_matrices(operator):
+    # Row (i * n_z + k) maps q to ΔT at BHE i and depth k: (M_env, M_neigh), both sparse (n_bhe * n_z, n_bhe)
+    n, n_z = operator["self"].shape
+    m_neigh = sparse.csr_matrix(_neigh_matrix(operator))
+    m_self = sparse.csr_matrix((operator["self"].ravel(), (np.arange(n * n_z), np.repeat(np.arange(n), n_z))), shape=(n * n_z, n))
+    return (m_neigh + m_self).tocsr(), m_neigh
+
+def ks_aggregate(values, rows, rho):
+    # Kreisselmeier–Steinhauser smooth max of values = rows @ q, and its gradient;
+    # it over-estimates max(values) by at most log(len(values)) / rho
+    v_max = np.max(values)
+    w = np.exp(rho * (values - v_max))
+    w_sum = np.sum(w)
+    return v_max + np.log(w_sum) / rho, rows.T @ (w / w_sum)
+
+def _vector_constraints(operator, lim_env, lim_neigh, constraint_mode, ks_rho):
+    # Per-(BHE, depth) margins as vector constraints, or their KS aggregate as two smooth scalar constraints.
+    # The KS rows stay sparse; the vector Jacobian is dense inside SLSQP, so it needs the dense operator.
+    m_env, m_neigh = influence_constraint_matrices(operator)
+    env_rows = m_env
+    neigh_rows = m_neigh[m_neigh.getnnz(axis=1) > 0]
+    if constraint_mode == 'vector':
+        if sparse.issparse(operator["neigh"]):
+            raise ValueError("constraint_mode='vector' needs a dense (n_bhe * n_z, n_bhe) Jacobian; with operator_format='sparse' "
+                             "use constraint_mode='ks' or 'max', or method='lp'")
+        env_rows, neigh_rows = env_rows.toarray(), neigh_rows.toarray()
+
+    constraints = []
+    for rows, lim in ((env_rows, lim_env), (neigh_rows, lim_neigh)):
+        if rows.shape[0] == 0:
+            continue
+        if constraint_mode == 'vector':
+            constraints.append({'type': 'ineq', 'fun': lambda q, rows=rows, lim=lim: lim - rows @ q,
+                                'jac': lambda q, rows=rows: -rows})
+        else:
+            constraints.append({'type': 'ineq', 'fun': lambda q, rows=rows, lim=lim: lim - ks_aggregate(rows @ q, rows, ks_rho)[0],
+                                'jac': lambda q, rows=rows: -ks_aggregate(rows @ q, rows, ks_rho)[1]})
+    return constraints
+
+@timed("lp")
+def _solve_lp(operator, lim_env, lim_neigh, low_lim, up_lim, callback_logger, tol=1e-7, extra_rows=()):
+    # max sum(q) s.t. ΔT_env <= lim_env and ΔT_neigh <= lim_neigh at every sampled (BHE, depth),
+    # plus the (rows, limit) pairs of extra_rows
+    n, n_z = operator["self"].shape
+    m_env, m_neigh = influence_constraint_matrices(operator)
+    # Neighbor rows without any neighbor in range are trivially satisfied
+    keep = m_neigh.getnnz(axis=1) > 0
+    A_ub = sparse.vstack([m_env, m_neigh[keep]] + [rows for rows, _ in extra_rows]).tocsr()
+    b_ub = np.concatenate([np.full(n * n_z, float(lim_env)), np.full(int(keep.sum()), float(lim_neigh))]
+                          + [np.full(rows.shape[0], float(lim)) for rows, lim in extra_rows])
+
+    res = linprog(-np.ones(n), A_ub=A_ub, b_ub=b_ub, bounds=[(low_lim, up_lim)] * n, method='highs')
+    # Same fields as the SLSQP result; an LP needs no function or gradient evaluations
+    result = OptimizeResult(x=res.x if res.x is not None else np.full(n, np.nan), fun=res.fun if res.fun is not None else np.nan,
+                            jac=-np.ones(n), success=res.success, status=res.status, message=res.message, nit=res.nit, nfev=0, njev=0)
+
+    if res.success:
+        slack = res.ineqlin.residual
+        neigh_slack = np.full(n * n_z, np.inf)
+        neigh_slack[keep] = slack[n * n_z:n * n_z + int(keep.sum())]
+        # Binding (BHE, depth) pairs, shape (n_bhe, n_z)
+        result.binding_env = (slack[:n * n_z] <= tol * max(1.0, abs(lim_env))).reshape(n, n_z)
+        result.binding_neigh = (neigh_slack <= tol * max(1.0, abs(lim_neigh))).reshape(n, n_z)
+        result.marginals = res.ineqlin.marginals
+        if callback_logger:
+            z_values = operator["z_values"]
+            for label, binding in (("ΔT_env", result.binding_env), ("ΔT_neigh", result.binding_neigh)):
+                for i in np.flatnonzero(binding.any(axis=1)):
+                    depths = ", ".join(f"{z:g}" for z in z_values[binding[i]])
+                    callback_logger(f"🔒 Binding {label} at BHE {i + 1} (z = {depths} m)")
+    return result
+
+def observation_depths(obs_z_range=(10, 70), obs_z_step=10):
+    # Depths at which the constraints are sampled
+    return list(range(obs_z_range[0], obs_z_range[1] + obs_z_step, obs_z_step))
+
+GOLDEN = (np.sqrt(5) - 1) / 2
+
+def build_depth_search(locations, H_array, R_w, V_T, ANGLE, A, LAMDA, influence_radius=None, quadrature="trapz", quad_order=8):
+    # Depth-independent part of ΔT(z) at the BHEs: the pairs within influence_radius, their advection
+    # factors and source lengths. ΔT at any per-BHE depths then costs one line integral per pair, with
+    # the operator's quadrature so that the profile passes through the sampled values.
+    locations = np.asarray(locations, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    n = len(locations)
+    if influence_radius is None:
+        pt, src = np.repeat(np.arange(n), n), np.tile(np.arange(n), n)
+    else:
+        pairs = cKDTree(locations).query_pairs(r=influence_radius, output_type="ndarray")
+        pt, src = np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+    keep = pt != src
+    pt, src = pt[keep], src[keep]
+    dx, dy = locations[pt, 0] - locations[src, 0], locations[pt, 1] - locations[src, 1]
+    return {
+        "n": n, "pt": pt, "src": src, "r_sq": dx**2 + dy**2, "H_src": H_array[src],
+        "weight": advection_factor(dx, dy, V_T, ANGLE, A) / (4 * np.pi * LAMDA),
+        "H_array": H_array, "R_w": R_w, "V_T": V_T, "A": A, "LAMDA": LAMDA, "quadrature": quadrature, "quad_order": quad_order
+    }
+
+def _target_pairs(search, targets):
+    # Pairs whose target BHE is in targets, and the position of that target in targets
+    local = np.full(search["n"], -1)
+    local[targets] = np.arange(len(targets))
+    pairs = np.flatnonzero(local[search["pt"]] >= 0)
+    return pairs, local[search["pt"][pairs]]
+
+def _pair_responses_at(search, pairs, z_pair):
+    return search["weight"][pairs] * compute_line_integrals_at(search["r_sq"][pairs], z_pair, search["H_src"][pairs], search["V_T"], search["A"], search["quad_order"],
+                                                               search["quadrature"], z0_max=np.max(search["H_array"]))
+
+def depth_profile(search, q, z, include_self=True, targets=None):
+    # ΔT at each target BHE (all by default) at its own depth z
+    q = np.asarray(q, dtype=float)
+    targets = np.arange(search["n"]) if targets is None else np.asarray(targets, dtype=int)
+    z = np.asarray(z, dtype=float)
+    pairs, local = _target_pairs(search, targets)
+    t = np.bincount(local, _pair_responses_at(search, pairs, z[local]) * q[search["src"][pairs]], minlength=len(targets))
+    if include_self:
+        t += q[targets] * self_integrals_at(z, search["H_array"][targets], search["R_w"]) / (4 * np.pi * search["LAMDA"])
+    return t
+
+def depth_rows(search, targets, z, include_self=True):
+    # d ΔT[target, z] / dq for each target at its own depth, sparse (len(targets), n_bhe)
+    targets = np.asarray(targets, dtype=int)
+    z = np.asarray(z, dtype=float)
+    pairs, local = _target_pairs(search, targets)
+    rows = sparse.csr_matrix((_pair_responses_at(search, pairs, z[local]), (local, search["src"][pairs])), shape=(len(targets), search["n"]))
+    if include_self:
+        diag = self_integrals_at(z, search["H_array"][targets], search["R_w"]) / (4 * np.pi * search["LAMDA"])
+        rows = rows + sparse.csr_matrix((diag, (np.arange(len(targets)), targets)), shape=rows.shape)
+    return rows.tocsr()
+
+def depth_gradient(search, i, z, include_self=True):
+    # d ΔT[i, z] / dq, the continuous-depth counterpart of influence_gradient
+    return depth_rows(search, [i], [z], include_self).toarray().ravel()
+
+def _golden_section_max(f, lo, hi, tol):
+    # Elementwise golden-section search for the maximum of f on [lo, hi]; f maps a depth per
+    # element to a value per element, so every step is one vectorized evaluation
+    a, b = lo.astype(float), hi.astype(float)
+    x1, x2 = b - GOLDEN * (b - a), a + GOLDEN * (b - a)
+    f1, f2 = f(x1), f(x2)
+    width = np.max(b - a) if len(a) else 0.0
+    n_steps = int(np.ceil(np.log(tol / width) / np.log(GOLDEN))) if width > tol else 0
+    for _ in range(n_steps):
+        left = f1 >= f2  # the maximum lies in [a, x2]
+        a, b = np.where(left, a, x1), np.where(left, x2, b)
+        x_new = np.where(left, b - GOLDEN * (b - a), a + GOLDEN * (b - a))
+        f_new = f(x_new)
+        x1, x2, f1, f2 = (np.where(left, x_new, x2), np.where(left, x1, x_new),
+                          np.where(left, f_new, f2), np.where(left, f1, f_new))
+    better = f1 >= f2
+    return np.where(better, x1, x2), np.where(better, f1, f2)
+
+@timed("depth_search")
+def refine_depth_maximum(search, q, z_values, t_grid, include_self=True, start=None, tol=0.05):
+    # Per-BHE maximum over depth of ΔT, located to within tol (m): the sampled profile t_grid
+    # (n_bhe, n_z) at z_values brackets it between the neighbors of its largest node, where a
+    # golden-section search refines it for all BHEs at once. start holds the depths found at the
+    # previous q; inside the bracket they narrow it to a quarter of the node spacing around them.
+    # Returns (depth, ΔT) per BHE.
+    z_values = np.asarray(z_values, dtype=float)
+    n = len(t_grid)
+    k = np.argmax(t_grid, axis=1)
+    z_best, t_best = z_values[k], t_grid[np.arange(n), k]
+    if len(z_values) < 2:
+        return z_best, t_best
+    lo, hi = z_values[np.maximum(k - 1, 0)], z_values[np.minimum(k + 1, len(z_values) - 1)]
+
+    def profile(targets):
+        return lambda z: depth_profile(search, q, z, include_self, targets)
+
+    narrowed = np.zeros(n, dtype=bool)
+    a, b = lo, hi
+    if start is not None:
+        half = np.min(np.diff(z_values)) / 4
+        narrowed = (start > lo) & (start < hi)
+        a, b = np.where(narrowed, np.maximum(lo, start - half), lo), np.where(narrowed, np.minimum(hi, start + half), hi)
+    z_fine, t_fine = _golden_section_max(profile(np.arange(n)), a, b, tol)
+
+    # A peak on the edge of a narrowed bracket has moved out of it: search the full bracket again
+    redo = np.flatnonzero(narrowed & (((z_fine - a < tol) & (a > lo)) | ((b - z_fine < tol) & (b < hi))))
+    if len(redo):
+        z_fine[redo], t_fine[redo] = _golden_section_max(profile(redo), lo[redo], hi[redo], tol)
+
+    # Guard against multimodal profiles: never report less than the sampled maximum
+    better = t_fine > t_best
+    return np.where(better, z_fine, z_best), np.where(better, t_fine, t_best)
+
+def _solve_lp_continuous(operator, search, lim_env, lim_neigh, low_lim, up_lim, callback_logger, depth_tol, max_rounds=8, tol=1e-5):
+    # Cutting planes: solve the LP on the sampled depths, locate the continuous depth maxima at its
+    # solution and add the rows of the BHEs that exceed a limit there, until none does
+    extra_rows = []
+    for round_ in range(max_rounds):
+        result = _solve_lp(operator, lim_env, lim_neigh, low_lim, up_lim, callback_logger if round_ == 0 else None, extra_rows=extra_rows)
+        if not result.success:
+            break
+        t_neigh, t_total = apply_influence_operator(operator, result.x)
+        z_env, v_env = refine_depth_maximum(search, result.x, operator["z_values"], t_total, True, tol=depth_tol)
+        z_neigh, v_neigh = refine_depth_maximum(search, result.x, operator["z_values"], t_neigh, False, tol=depth_tol)
+        over_env = np.flatnonzero(v_env > lim_env + tol * max(1.0, abs(lim_env)))
+        over_neigh = np.flatnonzero(v_neigh > lim_neigh + tol * max(1.0, abs(lim_neigh)))
+        if len(over_env) == 0 and len(over_neigh) == 0:
+            break
+        if callback_logger:
+            callback_logger(f"📍 Depth cuts {round_ + 1}: {len(over_env)} ΔT_env and {len(over_neigh)} ΔT_neigh maxima between sampled depths")
+        extra_rows += [(depth_rows(search, over_env, z_env[over_env], True), lim_env),
+                       (depth_rows(search, over_neigh, z_neigh[over_neigh], False), lim_neigh)]
+    return result
+
+@timed("optimize")
+def optimize_heat_load(locations, H_array, callback_logger, V_T, ANGLE, A, LAMDA, R_w, maxiter, ftol, eps, lim_env, lim_neigh, low_lim, up_lim, initial_q=None, obs_z_range=(10, 70), obs_z_step=10, operator=None, method='SLSQP', constraint_mode='max', ks_rho=50.0, quadrature='trapz', quad_order=8, influence_radius=None, operator_format='dense', depth_search='grid', depth_tol=0.05, progress=None, cancel_event=None, verbose=True):
+    # progress(state) is called with the current and the best feasible iterate after every solver
+    # iteration; setting cancel_event (threading.Event) stops SLSQP at its next iteration and returns
+    # the best feasible iterate so far (the LP is only checked before it starts, HiGHS cannot be interrupted).
+    # verbose=False keeps stdout clean (no progress prints, no SLSQP report): messages only go to callback_logger.
+    def log(msg):
+        if verbose:
+            print(msg)
+        if callback_logger:
+            callback_logger(msg)
+
+    locations = np.asarray(locations, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
     n = len(locations)
     initial_q = np.full(n, 10.0) if initial_q is None else initial_q
     bounds = [(low_lim, up_lim)] * n
-    z_values = list(range(obs_z_range[0], obs_z_range[1] + obs_z_step, obs_z_step))
+    z_values = observation_depths(obs_z_range, obs_z_step)
     integrals = precompute_integrals(z_values, H_array, R_w)
+    # ΔT is linear in q, so the MFLS kernels are integrated once per layout instead of per evaluation
+    if operator is None and operator_format == 'sparse':
+        operator = build_sparse_influence_operator(locations, H_array, z_values, integrals, V_T, ANGLE, A, LAMDA, quadrature=quadrature, quad_order=quad_order,
+                                                   influence_radius=influence_radius)
+        msg = f"🧮 Sparse operator: {operator['neigh'].nnz} entries, far-field truncation ≈ {np.max(operator['truncation']) * up_lim:.3f} K at full load (estimate)"
+        log(msg)
+    elif operator is None:
+        operator = build_influence_operator(locations, H_array, z_values, integrals, V_T, ANGLE, A, LAMDA, quadrature=quadrature, quad_order=quad_order,
+                                            influence_radius=influence_radius)
+    z_values = operator["z_values"]
+    # depth_search='continuous' locates the per-BHE maximum between the sampled depths; the depths
+    # found are kept in active_depth and narrow the search at the next q
+    if depth_search == 'continuous':
+        if method != 'lp' and constraint_mode != 'max':
+            raise ValueError("depth_search='continuous' needs method='lp' or constraint_mode='max'")
+        search = build_depth_search(locations, H_array, R_w, V_T, ANGLE, A, LAMDA, influence_radius=influence_radius, quadrature=quadrature, quad_order=quad_order)
+    elif depth_search == 'grid':
+        search = None
+    else:
+        raise ValueError(f"Unknown depth_search: {depth_search!r}")
+    active_depth = {}
+    gradient = influence_gradient if search is None else (lambda i, z, include_self=True: depth_gradient(search, i, z, include_self))
     constraint_cache = {}
 
     def round_key(q): return tuple(np.round(q, 3))
 
     def evaluate_constraints(q):
         key = round_key(q)
+        count("constraint_calls")
         if key in constraint_cache:
+            count("constraint_cache_hits")
             return constraint_cache[key]
 
-        results = Parallel(n_jobs=-1)(
-            delayed(compute_max_BHE_Tchange)(i, locations, q, z_values, integrals, H_array, V_T, ANGLE, A, LAMDA)
-            for i in range(n))
-        
-        results = np.array(results)
-        max_neigh = np.max(results[:, 0])
-        max_env = np.max(results[:, 1])
-        constraint_cache[key] = (max_env, max_neigh)
-        return max_env, max_neigh
+        t_neigh, t_total = apply_influence_operator(operator, q)
+        if search is None:
+            # Active (BHE, depth) of each max() constraint, used for the subgradients
+            env_idx = np.unravel_index(np.argmax(t_total), t_total.shape)
+            neigh_idx = np.unravel_index(np.argmax(t_neigh), t_neigh.shape)
+            constraint_cache[key] = (t_total[env_idx], t_neigh[neigh_idx], (operator, *env_idx), (operator, *neigh_idx))
+            return constraint_cache[key]
+
+        # Active (BHE, continuous depth) of each max() constraint
+        z_env, v_env = refine_depth_maximum(search, q, z_values, t_total, True, active_depth.get("env"), depth_tol)
+        z_neigh, v_neigh = refine_depth_maximum(search, q, z_values, t_neigh, False, active_depth.get("neigh"), depth_tol)
+        active_depth.update(env=z_env, neigh=z_neigh)
+        i_env, i_neigh = np.argmax(v_env), np.argmax(v_neigh)
+        constraint_cache[key] = (v_env[i_env], v_neigh[i_neigh], (i_env, z_env[i_env]), (i_neigh, z_neigh[i_neigh]))
+        return constraint_cache[key]
 
     def constraint_env(q): return lim_env - evaluate_constraints(q)[0]
     def constraint_neigh(q): return lim_neigh - evaluate_constraints(q)[1]
+    def constraint_env_jac(q): return -gradient(*evaluate_constraints(q)[2])
+    def constraint_neigh_jac(q): return -gradient(*evaluate_constraints(q)[3], include_self=False)
 
     def objective(q): return -np.sum(q)
+    def objective_jac(q): return -np.ones_like(q)
 
     iteration = {'count': 0}
+    best = {"q": None, "total_q": -np.inf}
+
+    def cancelled():
+        return cancel_event is not None and cancel_event.is_set()
+
+    def track(q):
+        # Best iterate within the limits and bounds so far, reported to progress with the current one
+        max_env, max_neigh = evaluate_constraints(q)[:2]
+        feasible = (max_env <= lim_env + 1e-6 * max(1.0, abs(lim_env)) and max_neigh <= lim_neigh + 1e-6 * max(1.0, abs(lim_neigh))
+                    and np.all(q >= low_lim - 1e-9) and np.all(q <= up_lim + 1e-9))
+        if feasible and np.sum(q) > best["total_q"]:
+            best.update(q=np.array(q, dtype=float), total_q=float(np.sum(q)))
+        if progress:
+            progress({"iteration": iteration['count'], "q": np.array(q, dtype=float), "total_q": float(np.sum(q)), "max_env": float(max_env),
+                      "max_neigh": float(max_neigh), "feasible": bool(feasible), "best_q": best["q"],
+                      "best_total_q": best["total_q"] if best["q"] is not None else None})
+
+    if cancelled():
+        result = OptimizeResult(x=np.full(n, np.nan), fun=np.nan, success=False, status=99, message="Cancelled before the solver started", nit=0, nfev=0, njev=0,
+                                cancelled=True)
+        return _finalize_result(result, evaluate_constraints, operator, lim_env, lim_neigh, active_depth, log)
+
+    if method == 'lp':
+        if search is None:
+            result = _solve_lp(operator, lim_env, lim_neigh, low_lim, up_lim, callback_logger)
+        else:
+            result = _solve_lp_continuous(operator, search, lim_env, lim_neigh, low_lim, up_lim, callback_logger, depth_tol)
+        msg = f"📊 LP (HiGHS): {result.message} Load={np.nansum(result.x):.2f}"
+        log(msg)
+        if np.all(np.isfinite(result.x)):
+            track(result.x)
+        return _finalize_result(result, evaluate_constraints, operator, lim_env, lim_neigh, active_depth, log)
 
     def callback(q):
         iteration['count'] += 1
-        max_env, max_neigh = evaluate_constraints(q)
+        count("solver_iterations")
+        max_env, max_neigh = evaluate_constraints(q)[:2]
         msg = f"📊 Iter {iteration['count']:>2}: Load={np.sum(q):.2f}, MaxΔT_env={max_env:.2f}, MaxΔT_neigh={max_neigh:.2f}"
-        print(msg)
-        if callback_logger:
-            callback_logger(msg)
+        log(msg)
+        track(q)
+        if cancelled():
+            # SciPy ends the minimization when the callback raises StopIteration
+            raise StopIteration
     
-    result = minimize(
-        fun=objective,
-        x0=initial_q,
-        bounds=bounds,
-        method='SLSQP',
-        constraints=[
-            {'type': 'ineq', 'fun': constraint_env},
-            {'type': 'ineq', 'fun': constraint_neigh}
-        ],
-        callback=callback,
-        options={'disp': True, 'maxiter': maxiter, 'ftol': ftol, 'eps': eps}
-    )
+    if constraint_mode == 'max':
+        constraints = [
+            {'type': 'ineq', 'fun': constraint_env, 'jac': constraint_env_jac},
+            {'type': 'ineq', 'fun': constraint_neigh, 'jac': constraint_neigh_jac}
+        ]
+    elif constraint_mode in ('vector', 'ks'):
+        constraints = _vector_constraints(operator, lim_env, lim_neigh, constraint_mode, ks_rho)
+    else:
+        raise ValueError(f"Unknown constraint_mode: {constraint_mode!r}")
+
+    track(np.asarray(initial_q, dtype=float))
+    with timer("slsqp", n=n, constraint_mode=constraint_mode):
+        result = minimize(
+            fun=objective,
+            x0=initial_q,
+            jac=objective_jac,
+            bounds=bounds,
+            method='SLSQP',
+            constraints=constraints,
+            callback=callback,
+            # eps only matters for finite differences, which the analytic jacobians replace
+            options={'disp': verbose, 'maxiter': maxiter, 'ftol': ftol, **({'eps': eps} if eps is not None else {})}
+        )
+
+    if cancelled():
+        result.cancelled = True
+        result.success = False
+        if best["q"] is not None:
+            result.x, result.fun = best["q"], -best["total_q"]
+            result.message = f"Cancelled at iteration {iteration['count']}: best feasible iterate so far"
+        else:
+            result.message = f"Cancelled at iteration {iteration['count']} before a feasible iterate was found"
+        msg = f"⏹️ {result.message} (Load={np.sum(result.x):.2f})"
+        log(msg)
     
+    return _finalize_result(result, evaluate_constraints, operator, lim_env, lim_neigh, active_depth, log)
+
+def _finalize_result(result, evaluate_constraints, operator, lim_env, lim_neigh, active_depth=None, log=None):
     q_opt = result.x
-    max_env, max_neigh = evaluate_constraints(q_opt)
+    max_env, max_neigh = evaluate_constraints(q_opt)[:2]
+    if active_depth and np.all(np.isfinite(q_opt)):
+        # Depth of the maximum per BHE (continuous depth search only)
+        result.depth_env, result.depth_neigh = active_depth["env"], active_depth["neigh"]
+        (i_env, z_env), (i_neigh, z_neigh) = evaluate_constraints(q_opt)[2:]
+        msg = f"📍 Peak ΔT_env at BHE {i_env + 1} (z = {z_env:.2f} m), peak ΔT_neigh at BHE {i_neigh + 1} (z = {z_neigh:.2f} m)"
+        if log:
+            log(msg)
 
     result.max_env = max_env
     result.max_neigh = max_neigh
-    result.res_env = 6.0 - max_env        # >=0 means satisfied
-    result.res_neigh = 1.5 - max_neigh    # >=0 means satisfied
+    result.res_env = lim_env - max_env        # >=0 means satisfied
+    result.res_neigh = lim_neigh - max_neigh  # >=0 means satisfied
+    result.operator = operator
 
     return result
 
+
+def scaled_start(operator, q, lim_env, lim_neigh, low_lim, up_lim):
+    # ΔT is linear in q: scaling a solution by the tighter of the two limit ratios puts its peak ΔT
+    # on the new limits, which is a near-optimal start when the limits (or little else) changed
+    t_neigh, t_total = apply_influence_operator(operator, q)
+    ratios = [lim / peak for lim, peak in ((lim_env, np.max(t_total)), (lim_neigh, np.max(t_neigh))) if peak > 0]
+    return np.clip(np.asarray(q, dtype=float) * min(ratios, default=1.0), low_lim, up_lim)
+
+def _read_only(operator):
+    # The operator with its dense arrays as read-only views, shared by the points of a curve
+    frozen = {}
+    for name, value in operator.items():
+        if isinstance(value, np.ndarray):
+            value = value.view()
+            value.flags.writeable = False
+        frozen[name] = value
+    return frozen
+
+def trace_capacity_curve(locations, H_array, V_T, ANGLE, A, LAMDA, R_w, limits, low_lim, up_lim, maxiter=50, ftol=0.1, eps=None, initial_q=None, operator=None, callback_logger=None, **options):
+    # Optimal total load along a path of (lim_env, lim_neigh) limits (continuation). The influence operator
+    # is built once, and each point starts from the previous solution scaled to its limits, so it usually
+    # takes a few SLSQP iterations instead of a cold solve; a failed point passes on the last solution.
+    # Neighboring limits on the path give the best starts.
+    results = []
+    q = initial_q
+    for lim_env, lim_neigh in limits:
+        if q is not None and operator is not None:
+            q = scaled_start(operator, q, lim_env, lim_neigh, low_lim, up_lim)
+        result = optimize_heat_load(locations, H_array, callback_logger, V_T, ANGLE, A, LAMDA, R_w, maxiter, ftol, eps, lim_env, lim_neigh, low_lim, up_lim,
+                                    initial_q=q, operator=operator, **options)
+        operator = _read_only(result.operator)
+        if result.success:
+            q = result.x
+        results.append(result)
+    return results
@@ -0,0 +1,139 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# profiling.py
+# Opt-in stage timers and counters. Off by default: timer() and count() then return immediately.
+# Inside profile_run() (or after enable()) every timed stage is recorded as an event and can be
+# summarized per stage or exported as a Chrome trace (chrome://tracing, ui.perfetto.dev).
+# Recordings belong to the thread that starts them: a background job records into its own (see
+# jobs.start_job), and the GUI script thread turning its recording off does not cut the job's short.
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# active: the calling thread's running recording or None; last: its most recent one
+_LOCAL = threading.local()
+
+def _new_recording():
+    return {"origin": time.perf_counter(), "events": [], "counters": {}}
+
+def _active():
+    return getattr(_LOCAL, "active", None)
+
+def _recording(recording=None):
+    # The given recording, else the calling thread's last one (empty if it never recorded)
+    if recording is None:
+        recording = getattr(_LOCAL, "last", None)
+    return recording if recording is not None else _new_recording()
+
+def enable():
+    # Starts a new recording in the calling thread (its previous events and counters are dropped) and returns it
+    _LOCAL.active = _LOCAL.last = _new_recording()
+    return _LOCAL.active
+
+def disable():
+    # Stops the calling thread's recording; it stays available to summary() and the exports
+    _LOCAL.active = None
+
+def is_enabled():
+    return _active() is not None
+
+@contextmanager
+def profile_run():
+    # Yields the recording, which other threads can pass to summary() and the exports
+    recording = enable()
+    try:
+        yield recording
+    finally:
+        disable()
+
+@contextmanager
+def timer(name, **args):
+    # Times the enclosed block as stage `name`; args (sizes, options) go into the trace event
+    recording = _active()
+    if recording is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stop = time.perf_counter()
+        recording["events"].append({"name": name, "start": start - recording["origin"], "duration": stop - start,
+                                    "thread": threading.get_ident(), "args": args})
+
+def timed(name):
+    # Decorator form of timer() for whole functions
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active() is None:
+                return function(*args, **kwargs)
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name, n=1):
+    recording = _active()
+    if recording is not None:
+        recording["counters"][name] = recording["counters"].get(name, 0) + n
+
+# The readers take a recording (as returned by enable() / profile_run()), by default the calling thread's last
+
+def events(recording=None):
+    return list(_recording(recording)["events"])
+
+def counters(recording=None):
+    return dict(_recording(recording)["counters"])
+
+def summary(recording=None):
+    # Per stage: calls, total / mean / max seconds (nested stages are also part of their parent's
+    # total); the counters, and the constraint-cache hit rate when constraints were evaluated
+    recording = _recording(recording)
+    stages = {}
+    for event in recording["events"]:
+        stage = stages.setdefault(event["name"], {"stage": event["name"], "calls": 0, "total_s": 0.0, "max_s": 0.0})
+        stage["calls"] += 1
+        stage["total_s"] += event["duration"]
+        stage["max_s"] = max(stage["max_s"], event["duration"])
+    for stage in stages.values():
+        stage["mean_s"] = stage["total_s"] / stage["calls"]
+
+    counts = counters(recording)
+    calls = counts.get("constraint_calls", 0)
+    return {
+        "stages": sorted(stages.values(), key=lambda stage: -stage["total_s"]),
+        "counters": counts,
+        "constraint_cache_hit_rate": counts.get("constraint_cache_hits", 0) / calls if calls else None,
+        "wall_time_s": max((event["start"] + event["duration"] for event in recording["events"]), default=0.0)
+    }
+
+def chrome_trace(recording=None):
+    # Trace Event Format: one complete ("X") event per timed stage, times in microseconds,
+    # and the final counter values as counter ("C") events at the end of the run
+    recording = _recording(recording)
+    pid = os.getpid()
+    trace = [{"name": event["name"], "ph": "X", "ts": event["start"] * 1e6, "dur": event["duration"] * 1e6, "pid": pid, "tid": event["thread"],
+              "args": {key: value if isinstance(value, (int, float, str, bool)) or value is None else str(value) for key, value in event["args"].items()}}
+             for event in recording["events"]]
+    end = summary(recording)["wall_time_s"] * 1e6
+    trace += [{"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}} for name, value in counters(recording).items()]
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+def write_trace(path, format="chrome", recording=None):
+    # format="chrome": Trace Event Format; "json": the events, counters and summary as recorded
+    if format == "chrome":
+        data = chrome_trace(recording)
+    elif format == "json":
+        data = {"events": events(recording), "counters": counters(recording), "summary": summary(recording)}
+    else:
+        raise ValueError(f"Unknown trace format: {format!r}")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False, default=str)
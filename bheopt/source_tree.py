@@ -0,0 +1,155 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# source_tree.py
+# Barnes–Hut style evaluation of the neighbor sum: distant clusters of sources act as one equivalent source
+import numpy as np
+from borehole_model import DEFAULT_MAX_BYTES, advection_factor, compute_line_integrals, compute_pair_responses, compute_self_Tchange, kernel_evaluations_per_pair, \
+    _exact_line_integrals
+from profiling import timed
+
+def build_source_tree(sources, leaf_size=8):
+    # Binary tree over the sources by median splits of the longer side of each box. Node k covers
+    # order[start[k]:stop[k]]; left/right are -1 for leaves.
+    sources = np.asarray(sources, dtype=float)
+    order = np.arange(len(sources))
+    start, stop, left, right = [0], [len(sources)], [-1], [-1]
+    todo = [0]
+    while todo:
+        k = todo.pop()
+        if stop[k] - start[k] <= leaf_size:
+            continue
+        idx = order[start[k]:stop[k]]
+        pts = sources[idx]
+        axis = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+        half = len(idx) // 2
+        order[start[k]:stop[k]] = idx[np.argpartition(pts[:, axis], half)]
+        for lo, hi in ((start[k], start[k] + half), (start[k] + half, stop[k])):
+            start.append(lo)
+            stop.append(hi)
+            left.append(-1)
+            right.append(-1)
+            todo.append(len(start) - 1)
+        left[k], right[k] = len(start) - 2, len(start) - 1
+    return {"order": order, "start": np.array(start), "stop": np.array(stop), "left": np.array(left), "right": np.array(right)}
+
+def _cluster_moments(tree, sources, weights):
+    # Equivalent source of every node: (load-weighted centroid, radius about the centroid, total load)
+    n_nodes = len(tree["start"])
+    centroid, radius, load = np.zeros((n_nodes, 2)), np.zeros(n_nodes), np.zeros(n_nodes)
+    for k in range(n_nodes):
+        idx = tree["order"][tree["start"][k]:tree["stop"][k]]
+        pts = sources[idx]
+        load[k] = weights[idx].sum()
+        centroid[k] = weights[idx] @ pts / load[k]
+        radius[k] = np.sqrt(np.max(np.sum((pts - centroid[k])**2, axis=1)))
+    return centroid, radius, load
+
+@timed("points.tree")
+def compute_temperature_points_tree(px, py, z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA, integrals=None, self_map=None, tol=0.01, leaf_size=8,
+                                    max_bytes=DEFAULT_MAX_BYTES, quadrature="trapz", quad_order=8, influence_radius=None):
+    # compute_temperature_points with an error of at most about tol (K) at every point. A cluster is
+    # replaced by its equivalent source (one line integral at its weighted centroid, which cancels the
+    # first-order error) when the bound on the second-order remainder is within its share of tol,
+    # tol * |cluster load| / |total load|; the clusters a point accepts are disjoint, so their shares add
+    # up to at most tol. Other clusters are opened down to their leaves, whose sources are evaluated exactly.
+    # Sources are grouped by length and by load sign, so every cluster has one H and positive weights.
+    # Cost is about O(points * log(sources)) when most of the sources are far from most points.
+    px = np.asarray(px, dtype=float).ravel()
+    py = np.asarray(py, dtype=float).ravel()
+    z_values = np.asarray(z_values, dtype=float)
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    n_pts, nsrc, n_z = len(px), len(sources), len(z_values)
+    out = np.zeros((n_pts, n_z))
+    if nsrc == 0:
+        return out
+
+    c = V_T / (2 * A)
+    total_load = np.sum(np.abs(heat_rates))
+    self_pt, self_src = np.array([(p, s) for p, idx_list in (self_map or {}).items() for s in idx_list], dtype=int).reshape(-1, 2).T
+    self_keys = self_pt * nsrc + self_src
+    # Clusters closer than this to a point may contain a source snapped to it, so they are never replaced
+    r_min = np.sqrt(np.max((px[self_pt] - sources[self_src, 0])**2 + (py[self_pt] - sources[self_src, 1])**2)) if len(self_pt) else 0.0
+    # Pairs per kernel call (compute_line_integrals holds about four (pairs, n_z, evaluations) arrays),
+    # and points per traversal block, with about log2(sources) * leaf_size pairs per point
+    pair_chunk = max(1, int(max_bytes // (4 * 8 * n_z * kernel_evaluations_per_pair(quadrature, quad_order, H_array))))
+    block_size = max(1, int(pair_chunk // (max(1.0, np.log2(nsrc + 1)) * leaf_size)))
+
+    def accumulate(b0, pt, values):
+        for k in range(n_z):
+            out[b0:b0 + block_size, k] += np.bincount(pt - b0, weights=values[:, k], minlength=min(block_size, n_pts - b0))
+
+    for H in np.unique(H_array):
+        for sign in (1.0, -1.0):
+            members = np.flatnonzero((H_array == H) & (sign * heat_rates > 0))
+            if len(members) == 0:
+                continue
+            tree = build_source_tree(sources[members], leaf_size)
+            centroid, radius, load = _cluster_moments(tree, sources[members], sign * heat_rates[members])
+            is_leaf = tree["left"] < 0
+
+            for b0 in range(0, n_pts, block_size):
+                pt = np.arange(b0, min(b0 + block_size, n_pts))
+                node = np.zeros(len(pt), dtype=int)
+                far_pt, far_node, near_pt, near_node = [], [], [], []
+                while len(pt):
+                    d = np.hypot(px[pt] - centroid[node, 0], py[pt] - centroid[node, 1])
+                    r = radius[node]
+                    keep = np.ones(len(pt), dtype=bool)
+                    inside = np.ones(len(pt), dtype=bool)
+                    if influence_radius is not None:
+                        keep = d - r <= influence_radius       # otherwise entirely out of range
+                        inside = d + r <= influence_radius     # entirely in range
+                    # Second-order remainder over a ball of radius r at distance d: about r^2 / 2 (4 / gap) (2c + 4 / gap)
+                    # times the size of the cluster's response at the nearest distance gap = d - r: the closed-form line
+                    # integral without flow damped by exp(-c gap), times the largest advection factor over the ball. Along the plume the two exponentials cancel and
+                    # the response varies on the scale of the distance, across it on the scale sqrt(distance / c).
+                    gap = np.maximum(d - r, 1e-12)
+                    size = np.exp(-c * gap) * np.max(np.abs(_exact_line_integrals(gap**2, z_values, np.full(len(gap), H))), axis=1)
+                    bound = (load[node] * advection_factor(px[pt] - centroid[node, 0], py[pt] - centroid[node, 1], V_T, ANGLE, A) * np.exp(c * r) * size
+                             * r**2 / 2 * 4 / gap * (2 * c + 4 / gap) / (4 * np.pi * LAMDA))
+                    accept = keep & inside & (d - r > r_min) & (bound <= tol * load[node] / total_load)
+                    far_pt.append(pt[accept])
+                    far_node.append(node[accept])
+                    opened = keep & ~accept
+                    near = opened & is_leaf[node]
+                    near_pt.append(pt[near])
+                    near_node.append(node[near])
+                    split = opened & ~is_leaf[node]
+                    pt = np.concatenate([pt[split], pt[split]])
+                    node = np.concatenate([tree["left"][node[split]], tree["right"][node[split]]])
+
+                # Equivalent sources
+                far_pt, far_node = np.concatenate(far_pt), np.concatenate(far_node)
+                for c0 in range(0, len(far_pt), pair_chunk):
+                    pt, node = far_pt[c0:c0 + pair_chunk], far_node[c0:c0 + pair_chunk]
+                    dx, dy = px[pt] - centroid[node, 0], py[pt] - centroid[node, 1]
+                    ints = compute_line_integrals(dx**2 + dy**2, z_values, np.full(len(pt), H), V_T, A, quadrature=quadrature, quad_order=quad_order,
+                                                  z0_max=np.max(H_array))
+                    scale = sign * load[node] * advection_factor(dx, dy, V_T, ANGLE, A) / (4 * np.pi * LAMDA)
+                    accumulate(b0, pt, scale[:, None] * ints)
+
+                # Exact pairs with the sources of the opened leaves
+                pt, node = np.concatenate(near_pt), np.concatenate(near_node)
+                if len(pt):
+                    sizes = tree["stop"][node] - tree["start"][node]
+                    pair_pt = np.repeat(pt, sizes)
+                    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+                    pair_src = members[tree["order"][np.repeat(tree["start"][node], sizes) + offsets]]
+                    keep = ~np.isin(pair_pt * nsrc + pair_src, self_keys)
+                    if influence_radius is not None:
+                        keep &= (px[pair_pt] - sources[pair_src, 0])**2 + (py[pair_pt] - sources[pair_src, 1])**2 <= influence_radius**2
+                    pair_pt, pair_src = pair_pt[keep], pair_src[keep]
+                    for c0 in range(0, len(pair_pt), pair_chunk):
+                        pt, src = pair_pt[c0:c0 + pair_chunk], pair_src[c0:c0 + pair_chunk]
+                        accumulate(b0, pt, heat_rates[src, None] * compute_pair_responses(px, py, pt, src, z_values, sources, H_array, V_T, ANGLE, A, LAMDA, quadrature, quad_order))
+
+    # sum self terms for all sources snapped to each point
+    for p, s in zip(self_pt, self_src):
+        out[p] += compute_self_Tchange(z_values, heat_rates[s], integrals[s], LAMDA)
+    return out
@@ -0,0 +1,118 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# sweep.py
+import itertools
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.spatial import cKDTree
+from joblib import Parallel, delayed
+from borehole_model import precompute_integrals, compute_line_integrals, advection_factor
+from optimization import observation_depths, apply_influence_operator, optimize_heat_load
+from api import hydro_parameters, grid_spacing
+
+GROUND_PARAMETERS = ("u_gw", "theta_gw", "lamda", "rho_c")
+# Columns of a scenario table that override the optimization settings of run_sweep
+LIMIT_PARAMETERS = ("lim_env", "lim_neigh", "low_lim", "up_lim")
+
+def scenario_grid(**values):
+    # Cartesian product of parameter values as a scenario table, e.g. scenario_grid(u_gw=[1e-7, 5e-7], theta_gw=[0, 90])
+    names = list(values)
+    return pd.DataFrame([dict(zip(names, combo)) for combo in itertools.product(*(np.atleast_1d(values[name]) for name in names))])
+
+def build_sweep_geometry(sources, H_array, point_density=2, influence_radius=None, obs_z_range=(10, 70), obs_z_step=10):
+    # Everything that does not depend on the ground parameters: BHE pairs within the radius,
+    # their offsets, the observation depths and the self-term line integrals
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    n = len(sources)
+    if influence_radius is None:
+        pt, src = np.repeat(np.arange(n), n), np.tile(np.arange(n), n)
+    else:
+        pairs = cKDTree(sources).query_pairs(r=influence_radius, output_type="ndarray")
+        pt, src = np.concatenate([pairs[:, 0], pairs[:, 1]]), np.concatenate([pairs[:, 1], pairs[:, 0]])
+    keep = pt != src
+    # sorted by target, so that the pairs of a BHE are contiguous
+    order = np.lexsort((src[keep], pt[keep]))
+    pt, src = pt[keep][order], src[keep][order]
+
+    z_values = np.asarray(observation_depths(obs_z_range, obs_z_step), dtype=float)
+    spacing = grid_spacing(sources, point_density)
+    integrals = precompute_integrals(z_values, H_array, R_w=spacing)
+    self_integrals = np.array([[ints[float(z)]["direct"] - ints[float(z)]["mirror"] for z in z_values] for ints in integrals])
+    return {
+        "sources": sources, "H_array": H_array, "spacing": spacing, "z_values": z_values,
+        "pt": pt, "src": src, "dx": sources[pt, 0] - sources[src, 0], "dy": sources[pt, 1] - sources[src, 1],
+        "self_integrals": self_integrals
+    }
+
+def _scenario_operators(geometry, hydro_list, quadrature, quad_order):
+    # Operators of all scenarios. The z0 line integrals depend on the ground only through V_T / (2A),
+    # so they are computed once per distinct value and shared by the scenarios that only differ in
+    # flow direction or in λ at fixed u_gw; the advection factors are evaluated for all of them at once.
+    n, n_z = len(geometry["sources"]), len(geometry["z_values"])
+    rows = (geometry["pt"][:, None] * n_z + np.arange(n_z)[None, :]).ravel()
+    cols = np.repeat(geometry["src"], n_z)
+    r_sq = geometry["dx"]**2 + geometry["dy"]**2
+
+    operators = [None] * len(hydro_list)
+    decay = np.array([hydro["V_T"] / (2 * hydro["A"]) for hydro in hydro_list])
+    for c in np.unique(decay):
+        group = np.flatnonzero(decay == c)
+        first = hydro_list[group[0]]
+        ints = compute_line_integrals(r_sq, geometry["z_values"], geometry["H_array"][geometry["src"]], first["V_T"], first["A"],
+                                      quadrature=quadrature, quad_order=quad_order, z0_max=np.max(geometry["H_array"]))
+        V_T = np.array([hydro_list[s]["V_T"] for s in group])[:, None]
+        ANGLE = np.array([hydro_list[s]["ANGLE"] for s in group])[:, None]
+        A = np.array([hydro_list[s]["A"] for s in group])[:, None]
+        LAMDA = np.array([hydro_list[s]["LAMDA"] for s in group])
+        exp_fac = advection_factor(geometry["dx"][None, :], geometry["dy"][None, :], V_T, ANGLE, A)  # (n_group, n_pairs)
+        for k, s in enumerate(group):
+            vals = (exp_fac[k][:, None] * ints).ravel() / (4 * np.pi * LAMDA[k])
+            operators[s] = {
+                "neigh": sparse.csr_matrix((vals, (rows, cols)), shape=(n * n_z, n)),
+                "self": geometry["self_integrals"] / (4 * np.pi * LAMDA[k]),
+                "z_values": geometry["z_values"]
+            }
+    return operators
+
+def _evaluate_scenario(geometry, operator, hydro, heat_rates, limits, optimize, solver_options):
+    t_neigh, t_total = apply_influence_operator(operator, heat_rates)
+    row = {"max_env_initial": float(np.max(t_total)), "max_neigh_initial": float(np.max(t_neigh)), "total_q_initial": float(np.sum(heat_rates))}
+    if optimize:
+        result = optimize_heat_load(geometry["sources"], geometry["H_array"], None, hydro["V_T"], hydro["ANGLE"], hydro["A"], hydro["LAMDA"], geometry["spacing"],
+                                    eps=None, operator=operator, verbose=False, **limits, **solver_options)
+        row.update({"success": bool(result.success), "total_q_opt": float(np.sum(result.x)),
+                    "max_env_opt": float(result.max_env), "max_neigh_opt": float(result.max_neigh)})
+    return row
+
+def run_sweep(sources, H_array, heat_rates, scenarios, lim_env=6.0, lim_neigh=1.5, low_lim=5, up_lim=50, optimize=True, point_density=2, influence_radius=None,
+              quadrature="trapz", quad_order=8, method="lp", constraint_mode="max", ks_rho=50.0, maxiter=50, ftol=0.1, n_jobs=-1):
+    # One row per scenario: its parameters, max ΔT_env / ΔT_nb under heat_rates and, with optimize=True,
+    # the optimized total load. scenarios is a table (DataFrame or list of dicts) with any of
+    # GROUND_PARAMETERS and LIMIT_PARAMETERS as columns; missing ground parameters take the GUI defaults.
+    scenarios = pd.DataFrame(scenarios).reset_index(drop=True)
+    unknown = set(scenarios.columns) - set(GROUND_PARAMETERS) - set(LIMIT_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    if optimize and method != "lp" and constraint_mode == "vector":
+        raise ValueError("constraint_mode='vector' needs dense operators; the sweep's are sparse, use 'ks', 'max' or method='lp'")
+
+    geometry = build_sweep_geometry(sources, H_array, point_density=point_density, influence_radius=influence_radius)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    hydro_list = [hydro_parameters(**{name: row[name] for name in GROUND_PARAMETERS if name in scenarios.columns}) for _, row in scenarios.iterrows()]
+    operators = _scenario_operators(geometry, hydro_list, quadrature, quad_order)
+
+    defaults = {"lim_env": lim_env, "lim_neigh": lim_neigh, "low_lim": low_lim, "up_lim": up_lim}
+    limits = [{name: row.get(name, default) for name, default in defaults.items()} for _, row in scenarios.iterrows()]
+    solver_options = dict(method=method, constraint_mode=constraint_mode, ks_rho=ks_rho, maxiter=maxiter, ftol=ftol)
+
+    # Scenarios are independent: one task each, fanned out over the cores
+    rows = Parallel(n_jobs=n_jobs)(
+        delayed(_evaluate_scenario)(geometry, operators[s], hydro_list[s], heat_rates, limits[s], optimize, solver_options)
+        for s in range(len(scenarios)))
+    return pd.concat([scenarios, pd.DataFrame(limits).drop(columns=[c for c in LIMIT_PARAMETERS if c in scenarios.columns]), pd.DataFrame(rows)], axis=1)
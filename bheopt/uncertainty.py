@@ -0,0 +1,229 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# uncertainty.py
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.stats import qmc
+from borehole_model import compute_line_integrals, self_integrals_at, DEFAULT_MAX_BYTES
+from sweep import GROUND_PARAMETERS, build_sweep_geometry
+from utils import create_extended_grid, assign_sources_to_nearest_nodes
+from api import hydro_parameters, grid_spacing
+
+# Values of the ground parameters that are not sampled (GUI defaults)
+DEFAULT_GROUND = {"u_gw": 1e-7, "theta_gw": 30.0, "lamda": 2.5, "rho_c": 2.5}
+
+def parse_distribution(spec):
+    # "normal:2.5,0.3", "uniform:0,90" (low, high), "lognormal:1e-7,0.5" (median, sigma of log),
+    # "truncnormal:2.5,0.3,1.5,3.5" (mean, sd, low, high) or a constant "2.5"
+    kind, _, args = spec.partition(":")
+    if not args:
+        return stats.uniform(float(kind), 0.0)
+    values = [float(v) for v in args.split(",")]
+    if kind == "normal":
+        return stats.norm(values[0], values[1])
+    if kind == "uniform":
+        return stats.uniform(values[0], values[1] - values[0])
+    if kind == "lognormal":
+        return stats.lognorm(values[1], scale=values[0])
+    if kind == "truncnormal":
+        mean, sd, low, high = values
+        return stats.truncnorm((low - mean) / sd, (high - mean) / sd, loc=mean, scale=sd)
+    raise ValueError(f"Unknown distribution: {spec!r}")
+
+def sample_parameters(distributions, n_samples, method="lhs", seed=0, fixed=None):
+    # One row per realization. distributions maps ground parameter names to frozen scipy.stats
+    # distributions (anything with .ppf); samples are drawn by inverse transform of uniform
+    # Monte Carlo ("mc") or Latin hypercube ("lhs") points, the other parameters are fixed.
+    unknown = set(distributions) - set(GROUND_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown uncertain parameters: {sorted(unknown)}")
+    names = list(distributions)
+    if method == "lhs":
+        u = qmc.LatinHypercube(d=max(1, len(names)), seed=seed).random(n_samples)
+    elif method == "mc":
+        u = np.random.default_rng(seed).random((n_samples, max(1, len(names))))
+    else:
+        raise ValueError(f"Unknown sampling method: {method!r}")
+
+    samples = pd.DataFrame({name: np.full(n_samples, value, dtype=float) for name, value in {**DEFAULT_GROUND, **(fixed or {})}.items()})
+    for k, name in enumerate(names):
+        samples[name] = distributions[name].ppf(u[:, k])
+    check_samples(samples)
+    return samples
+
+def check_samples(samples):
+    # The flow direction is theta_gw, so a negative u_gw (e.g. from the tail of a normal distribution) is
+    # meaningless and makes V_T / (2A) negative, where the tabulated integrals are NaN; λ and ρc must be positive
+    for name, bad in (("u_gw", samples["u_gw"] < 0), ("lamda", samples["lamda"] <= 0), ("rho_c", samples["rho_c"] <= 0)):
+        if np.any(bad):
+            raise ValueError(f"{int(np.sum(bad))} of {len(samples)} samples have {name} {'< 0' if name == 'u_gw' else '<= 0'} "
+                             f"(lowest {samples[name].min():g}); use a distribution bounded to valid values, e.g. truncnormal, lognormal or uniform")
+
+# Offset of the log-spaced c grid (1/m): the integrals change on the scale c * length ~ 1 with lengths of 1-1000 m
+C_OFFSET = 1e-3
+
+def _c_grid(decay, n_c):
+    # Nodes uniform in log(c + C_OFFSET) over the sampled range of c = V_T / (2A)
+    if decay.max() <= decay.min():
+        return decay[:1].copy()
+    c_grid = np.exp(np.linspace(np.log(decay.min() + C_OFFSET), np.log(decay.max() + C_OFFSET), n_c)) - C_OFFSET
+    c_grid[[0, -1]] = decay.min(), decay.max()
+    return c_grid
+
+def _interpolation_weights(c, c_grid):
+    # Four-point (cubic) Lagrange weights in log(c + C_OFFSET), shape (len(c), n_c)
+    if len(c_grid) == 1:
+        return np.ones((len(c), 1))
+    s_grid = np.log(c_grid + C_OFFSET)
+    s = np.log(c + C_OFFSET)
+    if len(c_grid) < 4:
+        # too few nodes for a cubic: piecewise linear
+        return np.column_stack([np.interp(s, s_grid, basis) for basis in np.eye(len(c_grid))])
+    weights = np.zeros((len(c), len(c_grid)))
+    first = np.clip(np.searchsorted(s_grid, s) - 2, 0, len(c_grid) - 4)
+    nodes = first[:, None] + np.arange(4)[None, :]
+    s_nodes = s_grid[nodes]
+    for j in range(4):
+        w = np.ones(len(c))
+        for m in range(4):
+            if m != j:
+                w *= (s - s_nodes[:, m]) / (s_nodes[:, j] - s_nodes[:, m])
+        weights[np.arange(len(c)), nodes[:, j]] = w
+    return weights
+
+def _scaled_integral_table(geometry, c_grid, quadrature, quad_order):
+    # J(c) = I(c) * exp(c * r) per pair and depth, shape (n_c, n_pairs * n_z): the pair line integrals
+    # with their dominant exp(-c * r) decay taken out, which leaves a bounded, smooth function of c.
+    # The decay is removed inside the kernel: I(c) alone underflows at large c * r (fast flow, far pairs).
+    r_sq = geometry["dx"]**2 + geometry["dy"]**2
+    H_src = geometry["H_array"][geometry["src"]]
+    return np.array([compute_line_integrals(r_sq, geometry["z_values"], H_src, 2 * c, 1.0, quadrature=quadrature, quad_order=quad_order,
+                                            z0_max=np.max(geometry["H_array"]), scaled=True).ravel()
+                     for c in c_grid])
+
+def _ground_arrays(samples):
+    # V_T, ANGLE, A and LAMDA per realization
+    hydro = [hydro_parameters(**{name: row[name] for name in GROUND_PARAMETERS}) for _, row in samples[list(GROUND_PARAMETERS)].iterrows()]
+    return tuple(np.array([h[key] for h in hydro]) for key in ("V_T", "ANGLE", "A", "LAMDA"))
+
+def _neighbor_sums(geometry, table, c_grid, decay, ANGLE, heat_rates, n_targets):
+    # Σ_src q_src * advection factor * line integral per target and depth for a block of realizations,
+    # (len(decay), n_targets, n_z), without the 1 / (4πλ); the pairs are sorted by target
+    pt, src = geometry["pt"], geometry["src"]
+    n_pairs, n_z = len(pt), len(geometry["z_values"])
+    m = len(decay)
+    scaled = (_interpolation_weights(decay, c_grid) @ table).reshape(m, n_pairs, n_z)
+    # exp(-c * r) times the advection factor exp(-c * (v . d) / |v|); the exponent is never positive
+    r = np.sqrt(geometry["dx"]**2 + geometry["dy"]**2)
+    decay_fac = np.exp(-decay[:, None] * (r + np.cos(ANGLE)[:, None] * geometry["dx"] + np.sin(ANGLE)[:, None] * geometry["dy"]))
+    scaled *= (decay_fac * heat_rates[src])[:, :, None]
+    t_neigh = np.zeros((m, n_targets, n_z))
+    if n_pairs:
+        # contributions are summed per contiguous run of a target
+        starts = np.flatnonzero(np.r_[True, pt[1:] != pt[:-1]])
+        t_neigh[:, pt[starts]] = np.add.reduceat(scaled, starts, axis=1)
+    return t_neigh
+
+def propagate_uncertainty(sources, H_array, heat_rates, samples, lim_env, lim_neigh, point_density=2, influence_radius=None, percentiles=(5, 50, 95),
+                          n_c=24, quadrature="gauss", quad_order=8, max_bytes=DEFAULT_MAX_BYTES):
+    # Max over depth of ΔT_env (total) and ΔT_nb (from neighbors) at every BHE for every realization
+    # in samples (a table as returned by sample_parameters), under fixed heat_rates.
+    # The pair line integrals are tabulated once on n_c values of V_T / (2A) spanning the samples and
+    # interpolated per realization with one matrix product per block of realizations, so a realization
+    # costs O(n_pairs * n_z) with no kernel evaluations.
+    samples = pd.DataFrame(samples).reset_index(drop=True)
+    check_samples(samples)
+    geometry = build_sweep_geometry(sources, H_array, point_density=point_density, influence_radius=influence_radius)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    n, n_z = len(geometry["sources"]), len(geometry["z_values"])
+    n_pairs, n_samples = len(geometry["pt"]), len(samples)
+
+    V_T, ANGLE, A, LAMDA = _ground_arrays(samples)
+    decay = V_T / (2 * A)
+    c_grid = _c_grid(decay, n_c)
+    table = _scaled_integral_table(geometry, c_grid, quadrature, quad_order)
+    self_t = geometry["self_integrals"] * heat_rates[:, None]  # (n, n_z), divided by 4πλ per realization
+
+    max_env = np.zeros((n_samples, n))
+    max_neigh = np.zeros((n_samples, n))
+    block = max(1, int(max_bytes // (3 * 8 * max(n_pairs, 1) * n_z)))
+    for start in range(0, n_samples, block):
+        s = slice(start, min(start + block, n_samples))
+        scale = 1 / (4 * np.pi * LAMDA[s])[:, None, None]
+        t_neigh = _neighbor_sums(geometry, table, c_grid, decay[s], ANGLE[s], heat_rates, n) * scale
+        max_neigh[s] = t_neigh.max(axis=2)
+        max_env[s] = (t_neigh + self_t[None] * scale).max(axis=2)
+    # NaN compares as below every limit, so it would pass as zero exceedance probability
+    if not (np.all(np.isfinite(max_env)) and np.all(np.isfinite(max_neigh))):
+        raise ValueError("Non-finite ΔT in the uncertainty propagation; check the sampled ground parameters")
+
+    return {
+        "samples": samples,
+        "max_env": max_env,                                   # (n_samples, n_bhe)
+        "max_neigh": max_neigh,
+        "percentiles": np.asarray(percentiles, dtype=float),
+        "env_percentiles": np.percentile(max_env, percentiles, axis=0),  # (n_percentiles, n_bhe)
+        "neigh_percentiles": np.percentile(max_neigh, percentiles, axis=0),
+        "p_exceed_env": np.mean(max_env > lim_env, axis=0),   # per BHE
+        "p_exceed_neigh": np.mean(max_neigh > lim_neigh, axis=0),
+        "p_any_exceedance": float(np.mean(np.any(max_env > lim_env, axis=1) | np.any(max_neigh > lim_neigh, axis=1)))
+    }
+
+def propagate_field_uncertainty(sources, H_array, heat_rates, samples, obs_z=30, point_density=2, percentiles=(5, 50, 95), n_c=24, quadrature="gauss",
+                                quad_order=8, max_bytes=DEFAULT_MAX_BYTES):
+    # Percentile maps of ΔT at obs_z on the heatmap grid (engine "vectorized": all sources, the ones snapped
+    # to a node by their self term), with the line integrals tabulated in V_T / (2A) as in propagate_uncertainty.
+    # The table holds n_c * grid nodes * n_bhe values and the realizations are kept in float32 until the
+    # percentiles are taken, n_samples * grid nodes * 4 bytes.
+    samples = pd.DataFrame(samples).reset_index(drop=True)
+    check_samples(samples)
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    spacing = grid_spacing(sources, point_density)
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    n, n_pts, n_samples = len(sources), grid_x.size, len(samples)
+
+    snapped_pt = np.array([i * grid_x.shape[1] + j for (i, j), idx_list in node_map.items() for _ in idx_list], dtype=int)
+    snapped_src = np.array([s for idx_list in node_map.values() for s in idx_list], dtype=int)
+    pt, src = np.repeat(np.arange(n_pts), n), np.tile(np.arange(n), n_pts)
+    keep = np.ones(len(pt), dtype=bool)
+    keep[snapped_pt * n + snapped_src] = False
+    pt, src = pt[keep], src[keep]
+    geometry = {"H_array": H_array, "z_values": np.array([float(obs_z)]), "pt": pt, "src": src,
+                "dx": grid_x.ravel()[pt] - sources[src, 0], "dy": grid_y.ravel()[pt] - sources[src, 1]}
+    self_t = np.bincount(snapped_pt, weights=heat_rates[snapped_src] * self_integrals_at(float(obs_z), H_array[snapped_src], spacing), minlength=n_pts)
+
+    V_T, ANGLE, A, LAMDA = _ground_arrays(samples)
+    decay = V_T / (2 * A)
+    c_grid = _c_grid(decay, n_c)
+    table = _scaled_integral_table(geometry, c_grid, quadrature, quad_order)
+
+    fields = np.zeros((n_samples, n_pts), dtype=np.float32)
+    block = max(1, int(max_bytes // (3 * 8 * max(len(pt), 1))))
+    for start in range(0, n_samples, block):
+        s = slice(start, min(start + block, n_samples))
+        fields[s] = (_neighbor_sums(geometry, table, c_grid, decay[s], ANGLE[s], heat_rates, n_pts)[:, :, 0] + self_t) / (4 * np.pi * LAMDA[s])[:, None]
+    if not np.all(np.isfinite(fields)):
+        raise ValueError("Non-finite ΔT in the uncertainty propagation; check the sampled ground parameters")
+    return {
+        "grid_x": grid_x, "grid_y": grid_y, "obs_z": float(obs_z),
+        "percentiles": np.asarray(percentiles, dtype=float),
+        "fields": np.percentile(fields, percentiles, axis=0).reshape((len(percentiles),) + grid_x.shape)  # (n_percentiles, ny, nx)
+    }
+
+def uncertainty_table(result):
+    # Per-BHE summary: percentiles of max ΔT_env / ΔT_nb and the exceedance probabilities
+    table = pd.DataFrame({"bhe": np.arange(1, result["max_env"].shape[1] + 1)})
+    for p, env, neigh in zip(result["percentiles"], result["env_percentiles"], result["neigh_percentiles"]):
+        table[f"env_p{p:g}"] = env
+        table[f"neigh_p{p:g}"] = neigh
+    table["p_exceed_env"] = result["p_exceed_env"]
+    table["p_exceed_neigh"] = result["p_exceed_neigh"]
+    return table
@@ -0,0 +1,104 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# validation.py
+# Accuracy vs. runtime of the fast-path options against the COMSOL fields of examples/validation_case
+import os
+import time
+import numpy as np
+import pandas as pd
+from borehole_model import precompute_integrals, compute_temperature_grid
+from utils import assign_sources_to_nearest_nodes
+from api import read_layout, hydro_parameters
+
+VALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "validation_case")
+VALIDATION_LAYOUT = "BHE layout_benchmark.csv"
+# The fields cover x, y in [-50, 50] m on a square grid, no groundwater flow
+VALIDATION_EXTENT = (-50.0, 50.0)
+VALIDATION_GROUND = {"u_gw": 0.0, "theta_gw": 0.0, "lamda": 2.5, "rho_c": 2.5}
+# Nodes within this distance of a BHE are left out of the norms (the line source is singular there)
+SOURCE_MASK_RADIUS = 0.2
+
+# Settings compared by run_validation: keyword arguments of compute_temperature_grid
+VALIDATION_OPTIONS = {
+    "trapz": {"quadrature": "trapz"},
+    "trapz float32": {"quadrature": "trapz", "dtype": np.float32},
+    "gauss 4": {"quadrature": "gauss", "quad_order": 4},
+    "gauss 8": {"quadrature": "gauss", "quad_order": 8},
+    "gauss 16": {"quadrature": "gauss", "quad_order": 16},
+    "gauss 8 float32": {"quadrature": "gauss", "quad_order": 8, "dtype": np.float32},
+    "adaptive": {"quadrature": "adaptive", "quad_order": 4},
+    "table": {"quadrature": "table"},
+    "exact": {"quadrature": "exact"},
+    "gauss 8 cutoff 50 m": {"quadrature": "gauss", "quad_order": 8, "influence_radius": 50.0},
+    "gauss 8 cutoff 25 m": {"quadrature": "gauss", "quad_order": 8, "influence_radius": 25.0},
+    "gauss 8 cutoff 10 m": {"quadrature": "gauss", "quad_order": 8, "influence_radius": 10.0},
+}
+
+def load_validation_case(folder=VALIDATION_DIR):
+    # Layout, grid and the reference fields per depth: {"comsol": {30: array, 60: array}, "bheopt": {...}}
+    # from the temp_interp_opt_{comsol,BHEOpt}_{depth}m.npy files
+    layout = read_layout(os.path.join(folder, VALIDATION_LAYOUT))
+    fields = {"comsol": {}, "bheopt": {}}
+    for name in sorted(os.listdir(folder)):
+        parts = os.path.splitext(name)[0].split("_")
+        if name.startswith("temp_interp_opt_") and name.endswith("m.npy") and parts[-2].lower() in ("comsol", "bheopt"):
+            fields[parts[-2].lower()][int(parts[-1][:-1])] = np.load(os.path.join(folder, name))
+    n = next(iter(fields["comsol"].values())).shape[0]
+    axis = np.linspace(*VALIDATION_EXTENT, n)
+    grid_x, grid_y = np.meshgrid(axis, axis)
+    return {"layout": layout, "grid_x": grid_x, "grid_y": grid_y, "fields": fields}
+
+def source_mask(grid_x, grid_y, sources, radius=SOURCE_MASK_RADIUS):
+    # True where a node is farther than radius from every BHE
+    keep = np.ones(grid_x.shape, dtype=bool)
+    for x, y in sources:
+        keep &= (grid_x - x)**2 + (grid_y - y)**2 > radius**2
+    return keep
+
+def error_norms(field, reference, mask):
+    diff = (field - reference)[mask]
+    return {
+        "max_abs": float(np.max(np.abs(diff))),
+        "rms": float(np.sqrt(np.mean(diff**2))),
+        "mean_abs": float(np.mean(np.abs(diff))),
+        "p99_abs": float(np.percentile(np.abs(diff), 99)),
+        "rel_l2": float(np.linalg.norm(diff) / np.linalg.norm(reference[mask]))
+    }
+
+def run_validation(options=None, case=None, ground=None, repeat=1):
+    # One row per option and depth: wall time of the grid evaluation (best of repeat) and its error
+    # norms against COMSOL; the shipped BHEOpt fields are listed as "stored BHEOpt" (no timing).
+    options = VALIDATION_OPTIONS if options is None else options
+    case = load_validation_case() if case is None else case
+    hydro = hydro_parameters(**{**VALIDATION_GROUND, **(ground or {})})
+    layout, grid_x, grid_y = case["layout"], case["grid_x"], case["grid_y"]
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+    spacing = grid_x[0, 1] - grid_x[0, 0]
+    node_map = assign_sources_to_nearest_nodes(sources, grid_x[0], grid_y[:, 0])
+    mask = source_mask(grid_x, grid_y, sources)
+
+    rows = []
+    for depth, reference in sorted(case["fields"]["comsol"].items()):
+        if depth in case["fields"]["bheopt"]:
+            rows.append({"option": "stored BHEOpt", "depth": depth, "wall_time": np.nan, **error_norms(case["fields"]["bheopt"][depth], reference, mask)})
+        integrals = precompute_integrals([depth], H_array, R_w=spacing)
+        for label, settings in options.items():
+            if settings.get("quadrature") == "exact" and hydro["V_T"] != 0:
+                continue
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                field = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, depth, **hydro, integrals=integrals, node_map=node_map, **settings)
+                times.append(time.perf_counter() - start)
+            rows.append({"option": label, "depth": depth, "wall_time": min(times), **error_norms(field, reference, mask)})
+    return pd.DataFrame(rows)
+
+def fastest_within(table, tolerance, norm="max_abs"):
+    # Options whose error norm meets tolerance at every depth, fastest (total wall time) first
+    timed = table[table["wall_time"].notna()]
+    summary = timed.groupby("option").agg(wall_time=("wall_time", "sum"), error=(norm, "max"))
+    return summary[summary["error"] <= tolerance].sort_values("wall_time")
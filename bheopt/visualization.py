@@ -8,19 +8,25 @@ Created on Wed Feb 11 10:21:54 2026
 import numpy as np
 import streamlit as st
 from borehole_model import compute_neighbor_Tchange, compute_temperature_grid, compute_self_Tchange
+from profiling import timed, timer
 import plotly.graph_objects as go
 
-def plot_temperature_heatmap(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, lim_env, lim_neigh, title_suffix=""):
-    # Compute temperature grid
-    temp_map = compute_temperature_grid(
-        grid_x, grid_y,
-        sources=sources,
-        H_array=H_array,
-        heat_rates=heat_rates,
-        obs_z=obs_z, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, 
-        integrals=integrals,
-        node_map=node_map,
-    )
+@timed("heatmap")
+def plot_temperature_heatmap(grid_x, grid_y, sources, H_array, heat_rates, obs_z, V_T, ANGLE, A, LAMDA, integrals, node_map, lim_env, lim_neigh, title_suffix="", engine="vectorized", quadrature="trapz", quad_order=8, influence_radius=None, temp_map=None):
+    # Compute temperature grid, unless a precomputed one is passed in
+    if temp_map is None:
+        temp_map = compute_temperature_grid(
+            grid_x, grid_y,
+            sources=sources,
+            H_array=H_array,
+            heat_rates=heat_rates,
+            obs_z=obs_z, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA, 
+            integrals=integrals,
+            node_map=node_map,
+            engine=engine,
+            quadrature=quadrature, quad_order=quad_order,
+            influence_radius=influence_radius,
+        )
     
     fig = go.Figure()
     max_Tg = 0  # Track maximum ground impact
@@ -59,64 +65,68 @@ def plot_temperature_heatmap(grid_x, grid_y, sources, H_array, heat_rates, obs_z
     min_heat = np.min(heat_rates)
     max_heat = np.max(heat_rates)
 
-    for i, (x, y) in enumerate(sources):
-        other_ids = np.delete(np.arange(len(sources)), i)
-        t_neigh = compute_neighbor_Tchange(
-            x, y, [obs_z],
-            sources[other_ids],
-            H_array[other_ids],
-            heat_rates[other_ids], V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,
-        )[0]
-        t_self = compute_self_Tchange([obs_z], heat_rates[i], integrals[i], LAMDA)
-        # print(t_self.T)
-        t_total = t_neigh + t_self.T
+    # ΔT at every BHE and its marker (one kernel evaluation per BHE)
+    with timer("heatmap.markers", n=len(sources)):
+        for i, (x, y) in enumerate(sources):
+            other_ids = np.delete(np.arange(len(sources)), i)
+            if influence_radius is not None:
+                other_ids = other_ids[np.hypot(sources[other_ids, 0] - x, sources[other_ids, 1] - y) <= influence_radius]
+            t_neigh = compute_neighbor_Tchange(
+                x, y, [obs_z],
+                sources[other_ids],
+                H_array[other_ids],
+                heat_rates[other_ids], V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,
+                quadrature=quadrature, quad_order=quad_order,
+            )[0]
+            t_self = compute_self_Tchange([obs_z], heat_rates[i], integrals[i], LAMDA)[0]
+            t_total = t_neigh + t_self
         
-        max_Tg = max(max_Tg, t_total)
-        max_Tn = max(max_Tn, t_neigh)
+            max_Tg = max(max_Tg, t_total)
+            max_Tn = max(max_Tn, t_neigh)
 
-        # Marker scaling
-        if max_heat != min_heat:
-            marker_size = 8 + (heat_rates[i] - min_heat) / (max_heat - min_heat) * (16 - 8)
-        else:
-            marker_size = 12  # default size
+            # Marker scaling
+            if max_heat != min_heat:
+                marker_size = 8 + (heat_rates[i] - min_heat) / (max_heat - min_heat) * (16 - 8)
+            else:
+                marker_size = 12  # default size
         
-        threshold_Tn = lim_neigh
-        if t_neigh > threshold_Tn+ 0.1:
-            symbol = "x"
-            label = f"ΔT<sub>n</sub> > {threshold_Tn}°C"
-            marker_style = dict(
-                size=marker_size,
-                symbol=symbol,
-                color='black'
-            )
-        else:
-            symbol = "circle"
-            label = f"ΔT<sub>n</sub> ≤ {threshold_Tn}°C"
-            marker_style = dict(
-                size=marker_size,
-                symbol=symbol,
-                color='white',
-                line=dict(color='black', width=1)
-            )
+            threshold_Tn = lim_neigh
+            if t_neigh > threshold_Tn+ 0.1:
+                symbol = "x"
+                label = f"ΔT<sub>n</sub> > {threshold_Tn}°C"
+                marker_style = dict(
+                    size=marker_size,
+                    symbol=symbol,
+                    color='black'
+                )
+            else:
+                symbol = "circle"
+                label = f"ΔT<sub>n</sub> ≤ {threshold_Tn}°C"
+                marker_style = dict(
+                    size=marker_size,
+                    symbol=symbol,
+                    color='white',
+                    line=dict(color='black', width=1)
+                )
 
-        showlegend = not legend_added[symbol]
-        legend_added[symbol] = True
+            showlegend = not legend_added[symbol]
+            legend_added[symbol] = True
 
-        fig.add_trace(go.Scatter(
-            x=[x],
-            y=[y],
-            mode='markers+text',
-            name=label,
-            textposition="top right",
-            marker=marker_style,
-            showlegend=showlegend,
-            hovertemplate=(
-                f"BHE {i+1}<br>"
-                f"ΔT<sub>n</sub>: {t_neigh:.2f}°C<br>"
-                f"Heat Load: {heat_rates[i]:.1f} W/m"
-                "<extra></extra>"
-            )
-        ))
+            fig.add_trace(go.Scatter(
+                x=[x],
+                y=[y],
+                mode='markers+text',
+                name=label,
+                textposition="top right",
+                marker=marker_style,
+                showlegend=showlegend,
+                hovertemplate=(
+                    f"BHE {i+1}<br>"
+                    f"ΔT<sub>n</sub>: {t_neigh:.2f}°C<br>"
+                    f"Heat Load: {heat_rates[i]:.1f} W/m"
+                    "<extra></extra>"
+                )
+            ))
 
     # Layout settings
     fig.update_layout(
@@ -170,3 +180,47 @@ def plot_temperature_heatmap(grid_x, grid_y, sources, H_array, heat_rates, obs_z
         "max_q": float(max_heat)
     }
 
+def plot_difference_heatmap(grid_x, grid_y, sources, diff_map, obs_z, title_suffix=""):
+    # ΔT difference between two load sets on the same grid, on a symmetric diverging scale
+    span = max(float(np.max(np.abs(diff_map))), 1e-6)
+    fig = go.Figure()
+    fig.add_trace(go.Contour(
+        z=diff_map,
+        x=grid_x[0],
+        y=grid_y[:, 0],
+        contours=dict(coloring='fill', showlines=False),
+        colorscale='RdBu_r',
+        zmin=-span,
+        zmax=span,
+        colorbar=dict(
+            title="Δ(ΔT<sub>g</sub>) (°C)",
+            titlefont=dict(size=14, family="Verdana", color='black'),
+            tickfont=dict(size=12, family="Verdana", color='black'),
+            len=0.75
+        ),
+        hovertemplate="x: %{x}<br>y: %{y}<br>Δ(ΔT<sub>g</sub>): %{z:.2f}°C<extra></extra>"
+    ))
+    fig.add_trace(go.Scatter(
+        x=sources[:, 0],
+        y=sources[:, 1],
+        mode='markers',
+        marker=dict(size=8, color='white', line=dict(color='black', width=1)),
+        showlegend=False,
+        hoverinfo='skip'
+    ))
+    fig.update_layout(
+        title=f"Change of Temperature Change at z = {obs_z} m {title_suffix}".strip(),
+        autosize=False,
+        xaxis=dict(title="X (m)", showgrid=False, titlefont=dict(color='black'), tickfont=dict(color='black')),
+        yaxis=dict(title="Y (m)", showgrid=False, zeroline=False, scaleanchor="x", scaleratio=1, titlefont=dict(color='black'), tickfont=dict(color='black')),
+        font=dict(color='black'),
+        width=1000,
+        height=700,
+        margin=dict(l=20, r=20, t=60, b=40)
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+    return {
+        "min_dT": float(np.min(diff_map)),
+        "max_dT": float(np.max(diff_map))
+    }
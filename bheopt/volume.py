@@ -0,0 +1,90 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# volume.py
+# ΔT volumes on (z, y, x) as memory-mapped .npy files, with the axes in a "<name>_axes.npz" next to them
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from utils import find_closest_pair, create_extended_grid, assign_sources_to_nearest_nodes
+from borehole_model import precompute_integrals, compute_temperature_volume
+from cache import cache_key, evict_results
+
+VOLUME_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "bheopt", "volumes")
+VOLUME_CACHE_MAX_BYTES = 4096 * 2**20
+
+def volume_depths(z_min=10, z_max=70, z_step=5):
+    if z_step <= 0:
+        raise ValueError(f"The depth step must be positive, got {z_step:g} m")
+    if z_min > z_max:
+        raise ValueError(f"The top depth ({z_min:g} m) is below the bottom depth ({z_max:g} m)")
+    return np.arange(z_min, z_max + z_step / 2, z_step, dtype=float)
+
+def _axes_path(path):
+    return f"{os.path.splitext(path)[0]}_axes.npz"
+
+def write_temperature_volume(path, sources, H_array, heat_rates, z_values, V_T, ANGLE, A, LAMDA, point_density=2, quadrature="trapz", quad_order=8, influence_radius=None):
+    # Computes the volume on the GUI's grid straight into path; returns the opened volume
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    z_values = np.asarray(z_values, dtype=float)
+    (_, _), min_dist = find_closest_pair(sources)
+    spacing = min_dist / point_density
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals(z_values, H_array, R_w=spacing)
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    # Written under a temporary name, so a reader never opens a partial volume
+    tmp_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp.npy"
+    out = open_memmap(tmp_path, mode="w+", dtype=np.float64, shape=(len(z_values), *grid_x.shape))
+    compute_temperature_volume(grid_x, grid_y, z_values, sources, H_array, heat_rates, V_T, ANGLE, A, LAMDA, integrals, node_map, out=out,
+                               quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius)
+    out.flush()
+    del out
+    np.savez(_axes_path(path), x=x_grid, y=y_grid, z=z_values, spacing=spacing)
+    os.replace(tmp_path, path)
+    return open_temperature_volume(path)
+
+def open_temperature_volume(path):
+    # {"volume": read-only memmap (n_z, n_y, n_x), "x", "y", "z", "spacing"}; slices are read on demand
+    with np.load(_axes_path(path)) as axes:
+        volume = {name: axes[name] for name in axes.files}
+    volume["spacing"] = float(volume["spacing"])
+    volume["volume"] = np.load(path, mmap_mode="r")
+    return volume
+
+def volume_slice(volume, z):
+    # ΔT map at depth z, linear between the two nearest stored depths
+    z_values = volume["z"]
+    if z <= z_values[0] or len(z_values) == 1:
+        return np.array(volume["volume"][0])
+    if z >= z_values[-1]:
+        return np.array(volume["volume"][-1])
+    k = int(np.searchsorted(z_values, z)) - 1
+    w = (z - z_values[k]) / (z_values[k + 1] - z_values[k])
+    return (1 - w) * volume["volume"][k] + w * volume["volume"][k + 1]
+
+def cached_temperature_volume(sources, H_array, heat_rates, z_values, V_T, ANGLE, A, LAMDA, point_density=2, quadrature="trapz", quad_order=8, influence_radius=None,
+                              cache_dir=VOLUME_CACHE_DIR, max_bytes=VOLUME_CACHE_MAX_BYTES):
+    # Content-addressed like the result cache: the same inputs open the stored volume
+    sources = np.asarray(sources, dtype=float)
+    H_array = np.asarray(H_array, dtype=float)
+    heat_rates = np.asarray(heat_rates, dtype=float)
+    z_values = np.asarray(z_values, dtype=float)
+    key = cache_key("volume", sources=sources, H_array=H_array, heat_rates=heat_rates, z_values=z_values, V_T=V_T, ANGLE=ANGLE, A=A, LAMDA=LAMDA,
+                    point_density=point_density, quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius)
+    path = os.path.join(cache_dir, f"{key}.npy")
+    if os.path.exists(path) and os.path.exists(_axes_path(path)):
+        os.utime(path)
+        os.utime(_axes_path(path))
+        return open_temperature_volume(path)
+    volume = write_temperature_volume(path, sources, H_array, heat_rates, z_values, V_T, ANGLE, A, LAMDA, point_density=point_density,
+                                      quadrature=quadrature, quad_order=quad_order, influence_radius=influence_radius)
+    evict_results(cache_dir, max_bytes, suffixes=(".npy", ".npz"))
+    return volume
@@ -0,0 +1,82 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# worker_pool.py
+import atexit
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from joblib import cpu_count as joblib_cpu_count
+
+# One long-lived pool per session, created on first use and reused by every build
+_POOL = {"executor": None, "n_workers": 0}
+# Workers are not forked from the calling process, which may be the GUI's script or job thread with other
+# threads holding locks: forkserver where the platform has it, spawn otherwise (Windows)
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+_ATTACH_LOCK = threading.Lock()
+
+def n_workers_for(n_jobs):
+    # joblib convention: -1 means all cores, -2 all but one, ...
+    n_cpu = joblib_cpu_count()
+    if n_jobs is None:
+        return 1
+    return max(1, n_cpu + 1 + n_jobs if n_jobs < 0 else n_jobs)
+
+def get_worker_pool(n_jobs=-1):
+    n_workers = n_workers_for(n_jobs)
+    if _POOL["executor"] is None or _POOL["n_workers"] != n_workers:
+        shutdown_worker_pool()
+        _POOL["executor"] = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context(START_METHOD))
+        _POOL["n_workers"] = n_workers
+    return _POOL["executor"]
+
+def shutdown_worker_pool():
+    if _POOL["executor"] is not None:
+        _POOL["executor"].shutdown(wait=True, cancel_futures=True)
+    _POOL["executor"] = None
+    _POOL["n_workers"] = 0
+
+atexit.register(shutdown_worker_pool)
+
+def share_array(arr):
+    # Copies arr into a new shared memory block; returns (block, spec). Workers attach with the
+    # spec (name, shape, dtype) instead of receiving the array itself. The caller unlinks the block.
+    arr = np.ascontiguousarray(arr)
+    block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+    return block, (block.name, arr.shape, arr.dtype.str)
+
+def attach_array(spec):
+    # Returns (block, view); keep block alive while using view and close it afterwards. Only the creator
+    # tracks the block: before Python 3.13 attaching registered it with the resource tracker as well, which
+    # unlinks blocks it still holds (with a leak warning) when it shuts down. The registration is skipped
+    # rather than undone, because the workers share the creator's tracker and an unregister from a worker
+    # would drop the creator's entry too.
+    name, shape, dtype = spec
+    if sys.version_info >= (3, 13):
+        block = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        with _ATTACH_LOCK:
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                block = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+    return block, np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+def release_arrays(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+def split_blocks(n, n_jobs=-1, per_worker=1):
+    # Contiguous index blocks, per_worker of them for each worker of the pool
+    n_blocks = max(1, min(n, per_worker * n_workers_for(n_jobs)))
+    return [block for block in np.array_split(np.arange(n), n_blocks) if len(block)]
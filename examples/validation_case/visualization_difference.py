@@ -7,9 +7,9 @@ Created on Wed Feb 11 10:21:54 2026
 import numpy as np
 import plotly.graph_objects as go
 
-# Load both .npz files
-temp1 = np.load('temp_interp_opt_BHEOpt_gm_30m.npy')
-temp2 = np.load('temp_interp_opt_comsol_gm_30m.npy')
+# Load both .npy files
+temp1 = np.load('temp_interp_opt_BHEOpt_30m.npy')
+temp2 = np.load('temp_interp_opt_comsol_30m.npy')
 
 # Compute absolute difference
 temp_diff = np.abs(temp1 - temp2)
@@ -18,8 +18,8 @@ temp_diff = np.abs(temp1 - temp2)
 source_points = [(-25, -15), (-25, -5), (-15, -15), (-15, -5), (-5, -15),
                  (5, 5), (5, 15), (15, 5), (25, 5)]
 
-x1d = np.linspace(-50, 50, 1001)
-y1d = np.linspace(-50, 50, 1001)
+x1d = np.linspace(-50, 50, temp_diff.shape[1])
+y1d = np.linspace(-50, 50, temp_diff.shape[0])
 
 dx = x1d[1] - x1d[0]
 dy = y1d[1] - y1d[0]
@@ -39,9 +39,7 @@ for xs, ys in source_points:
 
 
 # Define the grid
-x = np.linspace(-50, 50, 1001)
-y = np.linspace(-50, 50, 1001)
-x, y = np.meshgrid(x, y)
+x, y = np.meshgrid(x1d, y1d)
 
 # Plot the absolute temperature difference
 fig = go.Figure(data=go.Contour(
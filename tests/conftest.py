@@ -0,0 +1,12 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# conftest.py
+# The bheopt modules import each other by module name, as when run from bheopt/
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bheopt"))
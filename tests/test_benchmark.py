@@ -0,0 +1,30 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_benchmark.py
+import numpy as np
+from benchmark import SENSITIVITY_LAYOUTS, run_benchmark, write_report, read_report, compare_reports, scaling_table
+
+def test_benchmark_smoke(tmp_path):
+    # the two smallest layouts, one run per case: every case is reported, survives the JSON round trip and compares to itself
+    report = run_benchmark(SENSITIVITY_LAYOUTS[:2], point_densities=(1,), methods=("lp",), repeat=1)
+    assert len(report["cases"]) == 2 * 3
+    for case in report["cases"]:
+        assert case["wall_time"] > 0 and case["peak_memory"] > 0
+    assert all(case["success"] for case in report["cases"] if case["case"] == "optimize_heat_load")
+    assert any(case["line_integrals"] > 0 for case in report["cases"])
+
+    path = tmp_path / "report.json"
+    write_report(path, report)
+    baseline = read_report(path)
+    assert baseline["cases"] == report["cases"]
+    comparison = compare_reports(report, baseline)
+    assert len(comparison) == len(report["cases"])
+    assert np.allclose(comparison["time_ratio"], 1.0) and not comparison["regression"].any()
+
+    scaling = scaling_table(report)
+    assert len(scaling) == 3
+    assert np.isfinite(scaling["time_exponent"]).all()
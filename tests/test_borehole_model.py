@@ -0,0 +1,174 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_borehole_model.py
+import os
+import numpy as np
+import pandas as pd
+from api import read_layout, hydro_parameters, grid_spacing
+from validation import load_validation_case, source_mask, VALIDATION_GROUND
+from utils import create_extended_grid, assign_sources_to_nearest_nodes
+from borehole_model import (precompute_integrals, compute_temperature_grid, update_temperature_grid, compute_line_integrals, get_kernel_table,
+                            lookup_kernel_table, _KERNEL_TABLES)
+import main_refactor
+
+SENSITIVITY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case")
+VALIDATION_LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "validation_case", "BHE layout_benchmark.csv")
+
+def test_fft_engine_matches_direct_on_mixed_lengths():
+    # 45 m to 80 m boreholes on a grid that does not line up with them, so the sources sit off the nodes
+    layout = pd.read_csv(VALIDATION_LAYOUT, encoding="utf-8-sig")
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values.astype(float), layout["q0"].values.astype(float)
+    spacing = 1.3
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals([30], H_array, R_w=spacing)
+    for u_gw in (1e-7, 1e-6):
+        hydro = {"V_T": u_gw * 4.2 / 2.5, "ANGLE": 7 * np.pi / 6, "A": 1e-6, "LAMDA": 2.5}
+        grids = [compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro, integrals=integrals, node_map=node_map,
+                                          engine=engine) for engine in ("direct", "fft")]
+        assert np.abs(grids[1] - grids[0]).max() < 2e-4
+
+def test_fft_engine_matches_vectorized_with_influence_radius():
+    # sources just inside or outside the radius of a node may snap to the other side of it
+    layout = pd.read_csv(VALIDATION_LAYOUT, encoding="utf-8-sig")
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values.astype(float), layout["q0"].values.astype(float)
+    spacing = 1.3
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals([30], H_array, R_w=spacing)
+    hydro = {"V_T": 1e-7 * 4.2 / 2.5, "ANGLE": 7 * np.pi / 6, "A": 1e-6, "LAMDA": 2.5}
+    grids = [compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro, integrals=integrals, node_map=node_map,
+                                      engine=engine, influence_radius=20.0) for engine in ("vectorized", "fft")]
+    assert np.abs(grids[1] - grids[0]).max() < 2e-4
+
+def test_vectorized_engine_reproduces_stored_validation_fields():
+    # The shipped BHEOpt fields were interpolated from a 1 m grid, whose nodes away from the BHEs are
+    # reproduced to round-off (at the BHE nodes the self term depends on the R_w they were made with)
+    case = load_validation_case()
+    grid_x, grid_y = case["grid_x"][::5, ::5], case["grid_y"][::5, ::5]
+    sources, H_array, heat_rates = case["layout"][["x", "y"]].values, case["layout"]["H"].values, case["layout"]["q_l"].values
+    node_map = assign_sources_to_nearest_nodes(sources, grid_x[0], grid_y[:, 0])
+    keep = source_mask(grid_x, grid_y, sources, radius=0.5)
+    for depth, stored in case["fields"]["bheopt"].items():
+        integrals = precompute_integrals([depth], H_array, R_w=1.0)
+        field = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, depth, **hydro_parameters(**VALIDATION_GROUND),
+                                         integrals=integrals, node_map=node_map)
+        assert np.abs(field - stored[::5, ::5])[keep].max() < 1e-10
+
+def test_vectorized_engine_matches_direct_on_sensitivity_layouts():
+    for n in (25, 50):
+        layout = read_layout(os.path.join(SENSITIVITY_DIR, f"BHE_generated_{n}.csv"))
+        sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+        spacing = grid_spacing(sources, 1)
+        grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+        node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+        integrals = precompute_integrals([30], H_array, R_w=spacing)
+        grids = [compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro_parameters(), integrals=integrals, node_map=node_map,
+                                          engine=engine) for engine in ("direct", "vectorized")]
+        assert np.allclose(grids[1], grids[0], rtol=1e-12, atol=1e-12)
+
+def test_tree_engine_stays_within_tol():
+    # the Barnes–Hut engine against the exact sum, on mixed lengths and with a loose and a tight tolerance
+    layout = read_layout(os.path.join(SENSITIVITY_DIR, "BHE_generated_200.csv"))
+    sources, heat_rates = layout[["x", "y"]].values, layout["q_l"].values
+    H_array = np.where(np.arange(len(sources)) % 3 == 0, 60.0, layout["H"].values)
+    spacing = grid_spacing(sources, 1)
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals([30], H_array, R_w=spacing)
+    for u_gw in (1e-7, 1e-6):
+        hydro = hydro_parameters(u_gw=u_gw)
+        exact = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro, integrals=integrals, node_map=node_map)
+        for tol in (1e-2, 1e-5):
+            field = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro, integrals=integrals, node_map=node_map,
+                                             engine="tree", tree_tol=tol)
+            assert np.abs(field - exact).max() <= tol
+
+def _fine_trapz_line_integrals(r_sq, z_values, H_array, V_T, A, dz=1e-3):
+    # reference: direct-minus-mirror integral with a 1 mm trapezoid per source
+    c = V_T / (2 * A)
+    ints = np.empty((len(r_sq), len(z_values)))
+    for i, (r_sq_i, H) in enumerate(zip(r_sq, H_array)):
+        z0 = np.linspace(0, H, int(round(H / dz)) + 1)
+        for k, z in enumerate(z_values):
+            r, r_mirror = np.sqrt(r_sq_i + (z - z0)**2), np.sqrt(r_sq_i + (z + z0)**2)
+            kernel = np.exp(-c * r) / r - np.exp(-c * r_mirror) / r_mirror
+            ints[i, k] = np.sum((kernel[1:] + kernel[:-1]) / 2 * np.diff(z0))
+    return ints
+
+LINE_R_SQ = np.array([0.5, 3.0, 10.0, 40.0, 200.0])**2
+LINE_H = np.array([80.0, 60.0, 100.0, 80.0, 50.0])
+LINE_Z = np.array([5.0, 30.0, 55.0])
+
+def test_gauss_and_exact_line_integrals_match_fine_trapezoid():
+    A = hydro_parameters()["A"]
+    for V_T in (0.0, hydro_parameters()["V_T"]):
+        reference = _fine_trapz_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, V_T, A)
+        ints, err = compute_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, V_T, A, quadrature="gauss", quad_order=16, return_error=True)
+        assert np.allclose(ints, reference, rtol=1e-6, atol=0)
+        # the error estimate of a lower order covers its actual error
+        ints, err = compute_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, V_T, A, quadrature="gauss", quad_order=8, return_error=True)
+        assert np.all(np.abs(ints - reference) <= err + 1e-6 * np.abs(reference))
+    exact = compute_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, 0.0, A, quadrature="exact")
+    assert np.allclose(exact, _fine_trapz_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, 0.0, A), rtol=1e-6, atol=0)
+
+def test_table_line_integrals_stay_within_their_error_bound(tmp_path):
+    A = hydro_parameters()["A"]
+    for V_T in (0.0, hydro_parameters()["V_T"]):
+        reference = _fine_trapz_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, V_T, A)
+        ints, err = compute_line_integrals(LINE_R_SQ, LINE_Z, LINE_H, V_T, A, quadrature="table", return_error=True)
+        assert np.all(np.abs(ints - reference) <= err + 1e-8 * np.abs(reference))
+        assert np.allclose(ints, reference, rtol=1e-5, atol=0)
+    # a table read back from the on-disk cache answers as the freshly built one
+    built = get_kernel_table(80.0, 30.0, hydro_parameters()["V_T"], A, cache_dir=str(tmp_path), n_r=256)
+    _KERNEL_TABLES.clear()
+    loaded = get_kernel_table(80.0, 30.0, hydro_parameters()["V_T"], A, cache_dir=str(tmp_path), n_r=256)
+    assert loaded is not built
+    assert np.array_equal(lookup_kernel_table(loaded, LINE_R_SQ), lookup_kernel_table(built, LINE_R_SQ))
+
+def test_incremental_grid_update_matches_full_recompute(tmp_path):
+    layout = read_layout(os.path.join(SENSITIVITY_DIR, "BHE_generated_25.csv"))
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+    spacing = grid_spacing(sources, 1)
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals([30], H_array, R_w=spacing)
+    new_rates = heat_rates.copy()
+    new_rates[[0, 7, 19]] *= [0.5, 1.3, 0.0]
+    fields = {}
+    for engine in ("vectorized", "fft", "adaptive"):
+        grid_args = (grid_x, grid_y, sources, H_array)
+        old = compute_temperature_grid(*grid_args, heat_rates, 30, **hydro_parameters(), integrals=integrals, node_map=node_map, engine=engine)
+        full = compute_temperature_grid(*grid_args, new_rates, 30, **hydro_parameters(), integrals=integrals, node_map=node_map, engine=engine)
+        updated = update_temperature_grid(old, *grid_args, heat_rates, new_rates, 30, **hydro_parameters(), integrals=integrals, node_map=node_map,
+                                          engine=engine)
+        assert np.allclose(updated, full, rtol=1e-10, atol=1e-12)
+        fields[engine] = full
+
+    # the plot cache goes through the incremental path for the second load set on the same grid
+    main_refactor._FIELD_CACHE.clear()
+    for rates in (heat_rates, new_rates):
+        cached = main_refactor.cached_temperature_grid("initial", grid_x, grid_y, sources, H_array, rates, 30, **hydro_parameters(), integrals=integrals,
+                                                       node_map=node_map, spacing=spacing, cache_dir=str(tmp_path))
+    assert np.allclose(cached, fields["vectorized"], rtol=1e-10, atol=1e-12)
+
+def test_adaptive_engine_stays_within_tol():
+    # the quadtree against the full evaluation on a fine grid, where most nodes are interpolated
+    for n in (25, 50):
+        layout = read_layout(os.path.join(SENSITIVITY_DIR, f"BHE_generated_{n}.csv"))
+        sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+        spacing = grid_spacing(sources, 3)
+        grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+        node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+        integrals = precompute_integrals([30], H_array, R_w=spacing)
+        for u_gw in (1e-7, 1e-6):
+            hydro = hydro_parameters(u_gw=u_gw)
+            exact = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro, integrals=integrals, node_map=node_map)
+            for tol in (0.02, 0.002):
+                field = compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro, integrals=integrals, node_map=node_map,
+                                                 engine="adaptive", adaptive_tol=tol)
+                assert np.abs(field - exact).max() <= tol
@@ -0,0 +1,37 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_cache.py
+import numpy as np
+import cache
+from cache import cache_key, cached_call, store_result, unpack_arrays
+from api import optimization_kind, nearest_solution, solution_distance
+
+def test_model_version_invalidates_entries(tmp_path, monkeypatch):
+    # an entry written before a version bump is not served afterwards
+    inputs = dict(sources=np.zeros((2, 2)), V_T=1e-7)
+    first = cached_call("simulation", lambda: {"value": np.array(1.0)}, cache_dir=str(tmp_path), **inputs)
+    key = cache_key("simulation", **inputs)
+    monkeypatch.setattr(cache, "MODEL_VERSION", cache.MODEL_VERSION + 1)
+    assert cache_key("simulation", **inputs) != key
+    second = cached_call("simulation", lambda: {"value": np.array(2.0)}, cache_dir=str(tmp_path), **inputs)
+    assert first["value"] == 1.0 and second["value"] == 2.0
+
+def test_nearest_solution_reads_layouts_of_promising_entries_only(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    sources, H_array = rng.uniform(0, 100, (25, 2)), np.full(25, 80.0)
+    ground, limits = np.array([1.68e-7, 7 * np.pi / 6, 1e-6, 2.5]), np.array([6.0, 1.5, 5.0, 50.0])
+    entry = dict(x=np.full(25, 20.0), success=True, sources=sources + 0.1, H_array=H_array, ground=ground, limits=limits)
+    store_result(cache_key(optimization_kind(25), case="near"), entry, str(tmp_path))
+    store_result(cache_key(optimization_kind(25), case="other ground"), dict(entry, sources=sources, ground=ground * [10, 1, 1, 1]), str(tmp_path))
+    store_result(cache_key(optimization_kind(24), case="other layout"), dict(entry, sources=sources[:24], H_array=H_array[:24], x=np.full(24, 20.0)), str(tmp_path))
+
+    read = []
+    monkeypatch.setattr(cache, "unpack_arrays", lambda packed: read.append(set(packed)) or unpack_arrays(packed))
+    nearest = nearest_solution(sources, H_array, *ground, *limits, cache_dir=str(tmp_path))
+    assert nearest["key"] == cache_key(optimization_kind(25), case="near")
+    assert nearest["distance"] == solution_distance(entry, sources, H_array, ground, limits)
+    assert sum("sources" in fields for fields in read) == 1
@@ -0,0 +1,30 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_cli.py
+import json
+import os
+import subprocess
+import sys
+from cli import main
+
+BHEOPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bheopt")
+LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case", "BHE_generated_25.csv")
+
+def test_headless_modules_do_not_import_ui_packages():
+    # in a fresh interpreter, as the installed bheopt command would run
+    code = ("import sys, bheopt.cli, api, main_refactor, volume, sweep, uncertainty, benchmark, validation, jobs; "
+            "loaded = [name for name in ('streamlit', 'plotly', 'folium', 'matplotlib') if name in sys.modules]; "
+            "assert not loaded, loaded")
+    subprocess.run([sys.executable, "-c", code], cwd=os.path.join(BHEOPT_DIR, ".."), check=True)
+
+def test_simulate_writes_outputs(tmp_path, capsys):
+    prefix = str(tmp_path / "sim")
+    assert main(["simulate", LAYOUT, "--out", prefix]) == 0
+    summary = json.loads(capsys.readouterr().out)
+    assert summary["max_Tg"] > summary["max_Tn"] > 0
+    for suffix in (".npz", "_bhe.csv", ".json"):
+        assert os.path.exists(prefix + suffix)
@@ -0,0 +1,70 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_jobs.py
+import os
+import threading
+import numpy as np
+import pandas as pd
+import profiling
+from api import hydro_parameters, optimize_layout
+from jobs import start_job, cancel_job, job_running, wait_job
+
+LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case", "BHE_generated_25.csv")
+LIMITS = {"lim_env": 6.0, "lim_neigh": 1.5, "low_lim": 5, "up_lim": 50}
+
+def test_job_records_into_its_own_recording():
+    # the script thread stops its recording while the job is still emitting events
+    release = threading.Event()
+
+    def work(callback_logger, progress, cancel_event):
+        release.wait(5)
+        with profiling.timer("job.stage"):
+            profiling.count("job_counter", 3)
+        return "done"
+
+    profiling.enable()
+    job = start_job(work, profile=True)
+    with profiling.timer("script.stage"):
+        pass
+    profiling.disable()
+    release.set()
+    assert wait_job(job, timeout=5) == "done"
+
+    assert [event["name"] for event in profiling.events(job["recording"])] == ["job.stage"]
+    assert profiling.counters(job["recording"]) == {"job_counter": 3}
+    assert [event["name"] for event in profiling.events()] == ["script.stage"]
+    assert not profiling.is_enabled()
+
+def test_cancelling_a_job_stops_the_optimization(tmp_path):
+    # the job waits at its second SLSQP iteration until it is cancelled, as if the user pressed Cancel there
+    layout = pd.read_csv(LAYOUT)
+    sources, H_array = layout[["x", "y"]].values, layout["H"].values
+    options = dict(**hydro_parameters(), **LIMITS, method="SLSQP", maxiter=200, ftol=1e-12, warm_start=False, cache_dir=str(tmp_path))
+    reached = threading.Event()
+
+    def work(callback_logger, progress, cancel_event):
+        def report(state):
+            progress(state)
+            if state["iteration"] == 2:
+                reached.set()
+                cancel_event.wait(5)
+        return optimize_layout(sources, H_array, **options, callback_logger=callback_logger, progress=report, cancel_event=cancel_event)
+
+    job = start_job(work)
+    assert reached.wait(30)
+    cancel_job(job)
+    result, logs = wait_job(job, timeout=30)
+    assert not job_running(job)
+    assert result.cancelled and not result.success
+    assert result.nit == 2
+    assert result.max_env <= LIMITS["lim_env"] + 1e-6 and result.max_neigh <= LIMITS["lim_neigh"] + 1e-6
+    assert logs[-1].startswith("⏹️ Cancelled at iteration 2")
+    assert np.isclose(np.sum(result.x), job["progress"]["best_total_q"])
+
+    # the cancelled run was not cached: the same call runs to the end
+    result, _ = optimize_layout(sources, H_array, **options)
+    assert not result.get("cancelled") and result.nit > 2
@@ -0,0 +1,164 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_optimization.py
+import os
+import numpy as np
+import pandas as pd
+from utils import find_closest_pair
+from borehole_model import precompute_integrals
+from api import capacity_curve
+from worker_pool import START_METHOD, get_worker_pool
+from optimization import compute_max_BHE_Tchange, build_influence_operator, build_sparse_influence_operator, apply_influence_operator, influence_gradient, optimize_heat_load, \
+    build_depth_search, depth_profile, depth_gradient, refine_depth_maximum, influence_constraint_matrices, ks_aggregate
+
+LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case", "BHE_generated_25.csv")
+# GUI defaults: λ = 2.5 W/m·K, ρc = 2.5 MJ/m³·K, 1e-7 m/s groundwater flow at 30°, and the optimization limits
+HYDRO = {"V_T": 1.68e-7, "ANGLE": 7 * np.pi / 6, "A": 1e-6, "LAMDA": 2.5}
+LIMITS = {"lim_env": 6.0, "lim_neigh": 1.5, "low_lim": 5, "up_lim": 50}
+Z_VALUES = list(range(10, 80, 10))
+
+def _problem():
+    layout = pd.read_csv(LAYOUT)
+    sources, H_array = layout[["x", "y"]].values, layout["H"].values
+    spacing = find_closest_pair(sources)[1] / 2
+    integrals = precompute_integrals(Z_VALUES, H_array, spacing)
+    return sources, H_array, spacing, integrals
+
+def test_operator_matches_per_bhe_evaluation():
+    # the operator against the per-BHE evaluation it replaced, on the layout's lengths and on mixed ones
+    sources, H_layout, spacing, _ = _problem()
+    q = np.random.default_rng(0).uniform(5, 50, len(sources))
+    for H_array in (H_layout, np.where(np.arange(len(sources)) % 3 == 0, 60.0, H_layout)):
+        integrals = precompute_integrals(Z_VALUES, H_array, spacing)
+        operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1, influence_radius=None)
+        t_neigh, t_total = apply_influence_operator(operator, q)
+        for i in range(len(sources)):
+            max_neigh, max_total = compute_max_BHE_Tchange(i, sources, q, Z_VALUES, integrals, H_array, **HYDRO, influence_radius=None)
+            assert np.isclose(np.max(t_neigh[i]), max_neigh, rtol=1e-12, atol=0)
+            assert np.isclose(np.max(t_total[i]), max_total, rtol=1e-12, atol=0)
+
+def test_default_is_no_cutoff():
+    # without an explicit influence_radius every BHE sees all others, as in the original box-free evaluation
+    sources, H_array, spacing, _ = _problem()
+    sources = sources * 1.5
+    assert np.ptp(sources, axis=0).min() > 500.0
+    q = np.random.default_rng(1).uniform(5, 50, len(sources))
+    integrals = precompute_integrals(Z_VALUES, H_array, spacing)
+    default = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1)
+    full = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1, influence_radius=None)
+    assert np.array_equal(default["neigh"], full["neigh"])
+    t_neigh, _ = apply_influence_operator(default, q)
+    for i in range(len(sources)):
+        max_neigh, _ = compute_max_BHE_Tchange(i, sources, q, Z_VALUES, integrals, H_array, **HYDRO)
+        assert np.isclose(np.max(t_neigh[i]), max_neigh, rtol=1e-12, atol=0)
+
+def test_worker_pool_build_matches_serial_build():
+    # the pool's workers are started by forkserver or spawn, never forked from the caller
+    sources, H_array, _, integrals = _problem()
+    serial = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1)
+    pooled = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=2)
+    assert np.array_equal(pooled["neigh"], serial["neigh"])
+    assert START_METHOD in ("forkserver", "spawn")
+    assert get_worker_pool(2)._mp_context.get_start_method() == START_METHOD
+
+def test_sparse_operator_matches_dense_without_cutoff():
+    sources, H_array, spacing, integrals = _problem()
+    dense = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1, influence_radius=None)
+    csr = build_sparse_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1, influence_radius=None)
+    q = np.random.default_rng(0).uniform(5, 50, len(sources))
+    for dense_t, csr_t in zip(apply_influence_operator(dense, q), apply_influence_operator(csr, q)):
+        assert np.allclose(dense_t, csr_t, rtol=1e-12, atol=0)
+    for i, k in [(0, 0), (7, 3), (24, 6)]:
+        for include_self in (True, False):
+            assert np.allclose(influence_gradient(dense, i, k, include_self), influence_gradient(csr, i, k, include_self), rtol=1e-12, atol=0)
+
+def test_gradient_leaves_operator_unchanged():
+    sources, H_array, spacing, integrals = _problem()
+    operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1, influence_radius=None)
+    neigh, self_term = operator["neigh"].copy(), operator["self"].copy()
+    for i in range(len(sources)):
+        for k in range(len(Z_VALUES)):
+            influence_gradient(operator, i, k)
+    assert np.array_equal(operator["neigh"], neigh)
+    assert np.array_equal(operator["self"], self_term)
+
+def test_optimize_leaves_operator_unchanged():
+    sources, H_array, spacing, integrals = _problem()
+    operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1)
+    neigh, self_term = operator["neigh"].copy(), operator["self"].copy()
+    result = optimize_heat_load(sources, H_array, None, **HYDRO, R_w=spacing, maxiter=50, ftol=0.1, eps=None, operator=operator, **LIMITS)
+    assert np.array_equal(operator["neigh"], neigh)
+    assert np.array_equal(operator["self"], self_term)
+    # SLSQP with the GUI's ftol stops within about 1 % of the limits
+    assert result.success
+    assert result.max_neigh <= 1.01 * LIMITS["lim_neigh"]
+
+def test_lp_optimum_bounds_slsqp_and_meets_the_limits():
+    # the LP solves the sampled-depth problem exactly: at least the SLSQP total, every margin and bound met
+    sources, H_array, spacing, integrals = _problem()
+    operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1)
+    options = dict(R_w=spacing, maxiter=100, ftol=1e-6, eps=None, operator=operator, verbose=False, **LIMITS)
+    lp = optimize_heat_load(sources, H_array, None, **HYDRO, method='lp', **options)
+    slsqp = optimize_heat_load(sources, H_array, None, **HYDRO, method='SLSQP', constraint_mode='vector', **options)
+    assert lp.success and slsqp.success
+    assert np.sum(lp.x) >= np.sum(slsqp.x) - 1e-6 * np.sum(lp.x)
+    t_neigh, t_total = apply_influence_operator(operator, lp.x)
+    assert np.max(t_total) <= LIMITS["lim_env"] * (1 + 1e-7)
+    assert np.max(t_neigh) <= LIMITS["lim_neigh"] * (1 + 1e-7)
+    assert np.all(lp.x >= LIMITS["low_lim"] - 1e-9) and np.all(lp.x <= LIMITS["up_lim"] + 1e-9)
+    assert lp.binding_env.any() or lp.binding_neigh.any() or np.any(lp.x >= LIMITS["up_lim"] - 1e-9)
+
+def _finite_difference(f, q, h):
+    return np.array([(f(q + h * e) - f(q - h * e)) / (2 * h) for e in np.eye(len(q))])
+
+def test_constraint_jacobians_match_finite_differences():
+    sources, H_array, spacing, integrals = _problem()
+    q = np.random.default_rng(3).uniform(5, 50, len(sources))
+    operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1)
+    for i, k in ((0, 0), (7, 3), (24, 6)):
+        for include_self in (True, False):
+            fd = _finite_difference(lambda q: apply_influence_operator(operator, q)[1 if include_self else 0][i, k], q, 1e-3)
+            assert np.allclose(influence_gradient(operator, i, k, include_self), fd, rtol=1e-6, atol=1e-12)
+    # the KS aggregate is non-linear in q
+    m_env, _ = influence_constraint_matrices(operator)
+    for rho in (5.0, 50.0):
+        fd = _finite_difference(lambda q: ks_aggregate(m_env @ q, m_env, rho)[0], q, 1e-4)
+        assert np.allclose(ks_aggregate(m_env @ q, m_env, rho)[1], fd, rtol=1e-5, atol=1e-10)
+    # continuous depths
+    search = build_depth_search(sources, H_array, spacing, **HYDRO)
+    fd = _finite_difference(lambda q: depth_profile(search, q, [33.3], targets=[5])[0], q, 1e-3)
+    assert np.allclose(depth_gradient(search, 5, 33.3), fd, rtol=1e-6, atol=1e-12)
+
+def test_continuous_depth_search_is_at_least_grid_maximum():
+    # the continuous profile uses the operator's quadrature: it passes through the sampled values, and the
+    # refined maximum is never below the sampled one
+    sources, H_array, spacing, integrals = _problem()
+    q = np.random.default_rng(2).uniform(5, 50, len(sources))
+    for quadrature in ("trapz", "gauss"):
+        operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1, quadrature=quadrature)
+        search = build_depth_search(sources, H_array, spacing, **HYDRO, quadrature=quadrature)
+        t_neigh, t_total = apply_influence_operator(operator, q)
+        for k, z in enumerate(Z_VALUES):
+            assert np.allclose(depth_profile(search, q, np.full(len(sources), z)), t_total[:, k], rtol=1e-10, atol=0)
+            assert np.allclose(depth_profile(search, q, np.full(len(sources), z), include_self=False), t_neigh[:, k], rtol=1e-10, atol=0)
+        z_max, t_max = refine_depth_maximum(search, q, Z_VALUES, t_total)
+        assert np.all(t_max >= np.max(t_total, axis=1))
+        assert np.all(depth_profile(search, q, z_max) >= np.max(t_total, axis=1) - 1e-12)
+
+def test_capacity_curve_max_mode_warm_starts():
+    sources, H_array, spacing, integrals = _problem()
+    operator = build_influence_operator(sources, H_array, Z_VALUES, integrals, **HYDRO, n_jobs=1)
+    limits = [(lim_env, lim_env / 4) for lim_env in np.linspace(5, 7, 9)]
+    curve = capacity_curve(sources, H_array, **HYDRO, limits=limits, low_lim=5, up_lim=50, warm_start=False, cache_dir=None)
+    cold = [optimize_heat_load(sources, H_array, None, **HYDRO, R_w=spacing, maxiter=50, ftol=0.1, eps=None, lim_env=lim_env, lim_neigh=lim_neigh,
+                               low_lim=5, up_lim=50, operator=operator) for lim_env, lim_neigh in limits]
+    assert all(result.success for result in curve)
+    # SLSQP on the max() constraints is erratic per point; warm starts halve the iterations of the
+    # continued points overall and never end below the cold solution
+    assert sum(result.nit for result in curve[1:]) < 0.75 * sum(result.nit for result in cold[1:])
+    for warm, start in zip(curve, cold):
+        assert np.sum(warm.x) >= 0.999 * np.sum(start.x)
@@ -0,0 +1,37 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_sweep.py
+import os
+import numpy as np
+from api import read_layout, hydro_parameters, grid_spacing
+from borehole_model import precompute_integrals
+from optimization import observation_depths, build_influence_operator, apply_influence_operator, optimize_heat_load
+from sweep import scenario_grid, run_sweep
+
+LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case", "BHE_generated_25.csv")
+LIMITS = {"lim_env": 6.0, "lim_neigh": 1.5, "low_lim": 5, "up_lim": 50}
+
+def test_sweep_scenarios_match_single_runs():
+    # every sweep row against its own operator build and LP optimization, over groups that share and do not share V_T / 2A
+    layout = read_layout(LAYOUT)
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+    scenarios = scenario_grid(u_gw=[1e-7, 5e-7], theta_gw=[0, 90], lamda=[2.0, 2.5])
+    table = run_sweep(sources, H_array, heat_rates, scenarios, n_jobs=1, **LIMITS)
+
+    z_values = observation_depths()
+    spacing = grid_spacing(sources, 2)
+    integrals = precompute_integrals(z_values, H_array, R_w=spacing)
+    for _, row in table.iterrows():
+        hydro = hydro_parameters(lamda=row["lamda"], u_gw=row["u_gw"], theta_gw=row["theta_gw"])
+        operator = build_influence_operator(sources, H_array, z_values, integrals, **hydro, n_jobs=1)
+        t_neigh, t_total = apply_influence_operator(operator, heat_rates)
+        assert np.isclose(row["max_env_initial"], np.max(t_total), rtol=1e-10, atol=0)
+        assert np.isclose(row["max_neigh_initial"], np.max(t_neigh), rtol=1e-10, atol=0)
+        result = optimize_heat_load(sources, H_array, None, **hydro, R_w=spacing, eps=None, operator=operator, verbose=False, method="lp",
+                                    maxiter=50, ftol=0.1, **LIMITS)
+        assert row["success"] == result.success
+        assert np.isclose(row["total_q_opt"], np.sum(result.x), rtol=1e-6, atol=0)
@@ -0,0 +1,55 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_uncertainty.py
+import os
+import numpy as np
+import pandas as pd
+from api import read_layout, hydro_parameters, grid_spacing
+import pytest
+from utils import create_extended_grid, assign_sources_to_nearest_nodes
+from borehole_model import precompute_integrals, compute_temperature_grid
+from optimization import build_influence_operator, observation_depths, apply_influence_operator
+from uncertainty import propagate_uncertainty, propagate_field_uncertainty, parse_distribution, sample_parameters
+
+LAYOUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "sensitivity_case", "BHE_generated_50.csv")
+
+def test_propagation_matches_direct_evaluation_and_stays_finite_at_fast_flow():
+    layout = read_layout(LAYOUT)
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+    samples = pd.DataFrame({"u_gw": [1e-7, 1e-6, 3e-6], "theta_gw": [0.0, 120.0, 30.0], "lamda": [3.0, 2.0, 2.5], "rho_c": [2.5, 2.5, 2.5]})
+    result = propagate_uncertainty(sources, H_array, heat_rates, samples, lim_env=6.0, lim_neigh=1.5)
+
+    assert np.all(np.isfinite(result["max_env"])) and np.all(np.isfinite(result["max_neigh"]))
+    assert np.all(np.isfinite(result["env_percentiles"]))
+    z_values = observation_depths()
+    integrals = precompute_integrals(z_values, H_array, grid_spacing(sources, 2))
+    for k in range(2):
+        operator = build_influence_operator(sources, H_array, z_values, integrals, **hydro_parameters(**samples.iloc[k].to_dict()), quadrature="gauss", n_jobs=1)
+        t_neigh, t_total = apply_influence_operator(operator, heat_rates)
+        assert np.allclose(result["max_env"][k], t_total.max(axis=1), atol=1e-6)
+        assert np.allclose(result["max_neigh"][k], t_neigh.max(axis=1), atol=1e-6)
+
+def test_negative_velocity_samples_are_rejected():
+    with pytest.raises(ValueError, match="u_gw"):
+        sample_parameters({"u_gw": parse_distribution("normal:1e-7,1e-7")}, 1000)
+    samples = sample_parameters({"u_gw": parse_distribution("truncnormal:1e-7,1e-7,0,1e-6")}, 1000)
+    assert samples["u_gw"].min() >= 0
+
+def test_field_percentiles_bracket_the_realizations():
+    layout = read_layout(LAYOUT)
+    sources, H_array, heat_rates = layout[["x", "y"]].values, layout["H"].values, layout["q_l"].values
+    samples = pd.DataFrame({"u_gw": [1e-7, 5e-7], "theta_gw": [0.0, 120.0], "lamda": [3.0, 2.0], "rho_c": [2.5, 2.5]})
+    result = propagate_field_uncertainty(sources, H_array, heat_rates, samples, obs_z=30, point_density=1, percentiles=(0, 100))
+
+    spacing = grid_spacing(sources, 1)
+    grid_x, grid_y, x_grid, y_grid = create_extended_grid(sources, spacing)
+    node_map = assign_sources_to_nearest_nodes(sources, x_grid, y_grid)
+    integrals = precompute_integrals([30], H_array, R_w=spacing)
+    fields = [compute_temperature_grid(grid_x, grid_y, sources, H_array, heat_rates, 30, **hydro_parameters(**samples.iloc[k].to_dict()), integrals=integrals,
+                                       node_map=node_map, quadrature="gauss") for k in range(2)]
+    assert np.allclose(result["fields"][0], np.minimum(*fields), atol=1e-6)
+    assert np.allclose(result["fields"][1], np.maximum(*fields), atol=1e-6)
@@ -0,0 +1,31 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_validation.py
+import numpy as np
+from validation import VALIDATION_OPTIONS, load_validation_case, run_validation, fastest_within
+
+def test_validation_harness_on_a_crop():
+    # x, y in [-30, 30] m at every fifth node (1 m, the spacing the stored BHEOpt fields were made with)
+    case = load_validation_case()
+    crop = (slice(100, 401, 5), slice(100, 401, 5))
+    case = {"layout": case["layout"], "grid_x": case["grid_x"][crop], "grid_y": case["grid_y"][crop],
+            "fields": {name: {depth: field[crop] for depth, field in fields.items()} for name, fields in case["fields"].items()}}
+    options = {label: VALIDATION_OPTIONS[label] for label in ("trapz", "gauss 16", "exact", "table", "gauss 8 cutoff 10 m")}
+    table = run_validation(options, case=case)
+    assert len(table) == len(case["fields"]["comsol"]) * (len(options) + 1)
+
+    for depth, rows in table.groupby("depth"):
+        rows = rows.set_index("option")
+        # the 1 m trapezoid is the stored BHEOpt evaluation, the accurate quadratures agree with each other
+        assert np.allclose(rows.loc["trapz", ["max_abs", "rms", "rel_l2"]], rows.loc["stored BHEOpt", ["max_abs", "rms", "rel_l2"]], rtol=1e-6)
+        assert abs(rows.loc["gauss 16", "max_abs"] - rows.loc["exact", "max_abs"]) < 1e-6
+        assert abs(rows.loc["table", "max_abs"] - rows.loc["exact", "max_abs"]) < 1e-4
+        assert rows.loc["gauss 8 cutoff 10 m", "max_abs"] > 10 * rows.loc["exact", "max_abs"]
+
+    fastest = fastest_within(table, 0.5)
+    assert {"trapz", "gauss 16", "exact", "table"} == set(fastest.index)
+    assert fastest["wall_time"].is_monotonic_increasing
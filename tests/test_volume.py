@@ -0,0 +1,17 @@
+"""
+Created on Wed Feb 11 10:21:54 2026
+
+@author: qliu
+"""
+
+# test_volume.py
+import numpy as np
+import pytest
+from volume import volume_depths
+
+def test_volume_depths():
+    assert np.array_equal(volume_depths(10, 70, 5), np.arange(10, 75, 5))
+    assert np.array_equal(volume_depths(30, 30, 5), [30.0])
+    for z_min, z_max, z_step in ((70, 10, 5), (10, 70, 0), (10, 70, -5)):
+        with pytest.raises(ValueError):
+            volume_depths(z_min, z_max, z_step)